@@ -11,4 +11,6 @@ from .pop_gen import check_mutation_rate
 from .pop_gen import check_burn_in_generations
 from .pop_gen import check_num_generations
 from .pop_gen import check_num_mutations
-from .pop_gen import check_population_size
\ No newline at end of file
+from .pop_gen import check_population_size
+from .pop_gen import check_step_mode
+from .pop_gen import check_output_format
\ No newline at end of file
@@ -105,3 +105,57 @@ def check_num_mutations(num_mutations):
                      variable_name="num_mutations",
                      minimum_allowed=0,
                      minimum_inclusive=False)
+
+def check_step_mode(step_mode):
+    """
+    Validate Wright-Fisher step mode ("individual" or "multinomial").
+    
+    Parameters
+    ----------
+    step_mode : str
+        how to advance each generation of a simulation
+    
+    Returns
+    -------
+    step_mode : str
+        validated step mode
+    """
+
+    allowed = ["individual","multinomial"]
+
+    step_mode = f"{step_mode}"
+    if step_mode not in allowed:
+        err = f"\nstep_mode '{step_mode}' not recognized. Should be one of:\n"
+        for a in allowed:
+            err += f"    {a}\n"
+        err += "\n"
+        raise ValueError(err)
+
+    return step_mode
+
+def check_output_format(output_format):
+    """
+    Validate generation file output format ("pickle" or "npz").
+    
+    Parameters
+    ----------
+    output_format : str
+        format for generation files written by a simulation
+    
+    Returns
+    -------
+    output_format : str
+        validated output format
+    """
+
+    allowed = ["pickle","npz"]
+
+    output_format = f"{output_format}"
+    if output_format not in allowed:
+        err = f"\noutput_format '{output_format}' not recognized. Should be one of:\n"
+        for a in allowed:
+            err += f"    {a}\n"
+        err += "\n"
+        raise ValueError(err)
+
+    return output_format
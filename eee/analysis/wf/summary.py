@@ -8,6 +8,8 @@ Functions for summarizing the result of a Wright-Fisher simulation.
 from eee.analysis.plots import plt
 
 from eee.io.read_json import read_json
+from eee.io.generations import read_generations
+from eee.io.generations import read_generation_block
 from eee._private.interface import MockContextManager
 
 import pandas as pd
@@ -145,7 +147,7 @@ def load_simulation_results(sim_directory):
     results : dict
         dictionary with keys holding Simulation object, keywords passed to 
         start the run, the genotypes dataframe, and a list of (sorted) pickle
-        files holding the populations at each generation. 
+        or npz files holding the populations at each generation. 
     """
     
     so, kwargs = read_json(os.path.join(sim_directory,
@@ -162,9 +164,13 @@ def load_simulation_results(sim_directory):
     genotypes = pd.read_csv(df_file)
     genotypes = genotypes.set_index("genotype")
 
-    # Get list of pickle files
+    # Get list of generation files (pickle, or npz blocks if the simulation
+    # was run with output_format="npz")
     pickle_pattern = os.path.join(sim_directory,f"{kwargs['write_prefix']}*.pickle")
     pickle_files = glob.glob(pickle_pattern)
+    if len(pickle_files) == 0:
+        npz_pattern = os.path.join(sim_directory,f"{kwargs['write_prefix']}*.npz")
+        pickle_files = glob.glob(npz_pattern)
     pickle_files.sort()
     
     results = {"so":so,
@@ -174,97 +180,220 @@ def load_simulation_results(sim_directory):
     
     return results
 
-def fitness_and_variance(genotypes,
-                         pickle_files,
-                         verbose=True):
+_FITNESS_COLUMNS = ["mu","std","skew","kurtosis","median","p5","p95"]
+
+def _get_fitness_lookup(genotypes):
     """
-    Given the output of a wf_sim run, calculate the mean and standard deviation
-    of the population fitness over time.
-    
+    Build an array where fitness_lookup[genotype] is the fitness of that 
+    genotype (nan for genotypes not in the genotypes dataframe).
+    """
+
+    index = np.asarray(genotypes.index,dtype=np.int64)
+
+    size = 0
+    if len(index) > 0:
+        size = np.max(index) + 1
+
+    fitness_lookup = np.full(size,np.nan,dtype=float)
+    fitness_lookup[index] = np.asarray(genotypes["fitness"],dtype=float)
+
+    return fitness_lookup
+
+
+def _weighted_fitness_stats(fitness,counts,local_gen,num_generations):
+    """
+    Calculate population fitness statistics for many generations at once from
+    (fitness, count) pairs, without expanding counts into one entry per 
+    individual.
+
     Parameters
     ----------
-    genotypes : pandas.DataFrame
-        genotypes dataframe created by load_directory
-    pickle_files : list
-        list of pickle files to load (in order)
-    verbose : bool, default=True
-        print outputs and status bars
-    
+    fitness : numpy.ndarray
+        fitness of each (generation, genotype) record
+    counts : numpy.ndarray
+        number of individuals for each record
+    local_gen : numpy.ndarray
+        generation (0 to num_generations - 1) of each record
+    num_generations : int
+        number of generations
+
     Returns
     -------
-    df : pandas.DataFrame
-        dataframe with mean and standard deviation of the fitness
+    stats : dict
+        dictionary of arrays (one value per generation) with keys "mu", "std",
+        "skew", "kurtosis" (excess), "median", "p5", and "p95". Quantiles are
+        the smallest fitness at which the cumulative fraction of the 
+        population reaches the quantile (numpy "inverted_cdf").
     """
 
-    if verbose:
-        print("Calculating fitness over time")
-        print("Reading pickle files",flush=True)
-        pbar = tqdm(total=len(pickle_files))
-    else:
-        pbar = MockContextManager()
+    counts = np.asarray(counts,dtype=float)
+    pop_size = np.bincount(local_gen,
+                           weights=counts,
+                           minlength=num_generations)
+
+    with np.errstate(divide="ignore",invalid="ignore"):
+
+        # Central moments
+        mu = np.bincount(local_gen,
+                         weights=fitness*counts,
+                         minlength=num_generations)/pop_size
+        dev = fitness - mu[local_gen]
+        dev2 = dev*dev
+        m2 = np.bincount(local_gen,
+                         weights=counts*dev2,
+                         minlength=num_generations)/pop_size
+        m3 = np.bincount(local_gen,
+                         weights=counts*dev2*dev,
+                         minlength=num_generations)/pop_size
+        m4 = np.bincount(local_gen,
+                         weights=counts*dev2*dev2,
+                         minlength=num_generations)/pop_size
+
+        stats = {"mu":mu,
+                 "std":np.sqrt(m2),
+                 "skew":m3/m2**1.5,
+                 "kurtosis":m4/(m2*m2) - 3}
+
+    # Sort records by generation, then fitness. Cumulative counts over the 
+    # sorted records are monotonic, so the record where each generation 
+    # reaches a quantile can be found with one searchsorted call. 
+    order = np.lexsort((fitness,local_gen))
+    sorted_fitness = fitness[order]
+    cumulative = np.cumsum(counts[order])
+    gen_start = np.cumsum(pop_size) - pop_size
+    empty = pop_size == 0
+
+    for key, q in [("p5",0.05),("median",0.5),("p95",0.95)]:
         
+        if len(cumulative) == 0:
+            stats[key] = np.full(num_generations,np.nan)
+            continue
 
-    mean_fitness = []
-    sd_fitness = []
-    num_generations = 0 
-    with pbar:
+        idx = np.searchsorted(cumulative,gen_start + q*pop_size,side="left")
+        idx = np.clip(idx,0,len(cumulative) - 1)
+        values = sorted_fitness[idx]
+        values[empty] = np.nan
+        stats[key] = values
 
-        for pickle_file in pickle_files:
-    
-            # Load this block of generations
-            with open(pickle_file,'rb') as f:
-                generations = pickle.load(f)
-
-            # Get population size from first entry
-            if num_generations == 0:
-                population_size = np.sum(list(generations[0].values()))
-
-            # Go through generations
-            for generation in generations:
-                
-                # Create a vector holding the fitness of every genotype in this
-                # generation
-                last_counter = 0
-                fitness_vector = np.zeros(population_size,dtype=float)
-                for genotype in generation:
-                    
-                    f = genotypes.loc[int(genotype),"fitness"]
-                    new_counter = last_counter + generation[genotype]
-                    fitness_vector[last_counter:new_counter] = f
-                    last_counter = new_counter
-                
-                # Record mean and sd of fitness vector
-                mean_fitness.append(np.mean(fitness_vector))
-                sd_fitness.append(np.std(fitness_vector))
-                
-                num_generations += 1
-            
-            pbar.update()
+    return stats
 
-    return pd.DataFrame({"mu":mean_fitness,
-                         "std":sd_fitness})
-            
 
-def extract_key_trajectories(pickle_files,
-                             key_genotype_cutoff=1e-3,
-                             verbose=True):
+class _HeavyHitters:
+    """
+    Bounded heavy-hitters sketch that tracks the genotypes seen in the most
+    individuals over a simulation, as well as their history over generations.
+    Counts are merged in blocks using the Misra-Gries rule: if more than 
+    max_tracked genotypes are being tracked, the (max_tracked + 1)th largest 
+    count is subtracted from all counts and genotypes with counts <= 0 are 
+    dropped. If the number of distinct genotypes never exceeds max_tracked, 
+    counts and histories are exact. 
     """
-    Extract frequency of genotypes seen in at least cutoff of the individuals 
-    seen over the entire simulation. 
+
+    def __init__(self,max_tracked):
+
+        self._max_tracked = max_tracked
+        
+        self._genotypes = np.zeros(0,dtype=np.int64)
+        self._counts = np.zeros(0,dtype=np.int64)
+        self._first_seen = np.zeros(0,dtype=np.int64)
+        
+        # Chunks of (generation, genotype, count) history for tracked genotypes
+        self._history = []
+
+    def update(self,genotypes,counts,generation):
+        """
+        Add a block of (generation, genotype, count) records to the sketch.
+        """
+
+        # Merge block totals with current counts. Record the first generation
+        # each genotype was seen. 
+        all_genotypes = np.concatenate((self._genotypes,genotypes))
+        all_counts = np.concatenate((self._counts,counts))
+        all_first = np.concatenate((self._first_seen,generation))
+
+        uniq, inverse = np.unique(all_genotypes,return_inverse=True)
+        merged = np.bincount(inverse,weights=all_counts).astype(np.int64)
+        first_seen = np.full(len(uniq),np.iinfo(np.int64).max,dtype=np.int64)
+        np.minimum.at(first_seen,inverse,all_first)
+
+        # Too many genotypes. Drop the least common. 
+        evicted = False
+        if len(uniq) > self._max_tracked:
+            threshold = np.sort(merged)[::-1][self._max_tracked]
+            merged = merged - threshold
+            keep = merged > 0
+            uniq = uniq[keep]
+            merged = merged[keep]
+            first_seen = first_seen[keep]
+            evicted = True
+
+        self._genotypes = uniq
+        self._counts = merged
+        self._first_seen = first_seen
+
+        # Record history of tracked genotypes
+        if evicted:
+            self._history = [h[:,np.isin(h[1],uniq)] for h in self._history]
+
+        mask = np.isin(genotypes,uniq)
+        self._history.append(np.array([generation[mask],
+                                       genotypes[mask],
+                                       counts[mask]],dtype=np.int64))
+
+    @property
+    def genotypes(self):
+        return self._genotypes
+    
+    @property
+    def counts(self):
+        return self._counts
+    
+    @property
+    def first_seen(self):
+        return self._first_seen
+
+    @property
+    def history(self):
+        if len(self._history) == 0:
+            return np.zeros((3,0),dtype=np.int64)
+        return np.concatenate(self._history,axis=1)
+
+
+def summarize_generations(pickle_files,
+                          genotypes=None,
+                          key_genotype_cutoff=1e-3,
+                          max_tracked_genotypes=100000,
+                          verbose=True):
+    """
+    Summarize the generations written out by a wf_sim run in a single pass 
+    through the generation files. 
 
     Parameters
     ----------
     pickle_files : list
-        list of pickle files (in order)
+        list of pickle (or npz) files to load (in order)
+    genotypes : pandas.DataFrame, optional
+        genotypes dataframe created by load_directory. If not specified, do
+        not calculate fitness. 
     key_genotype_cutoff : float, default=1e-3
         how to filter genotypes. if cutoff is 0.001, this will return the 
         genotypes that account for 0.999 of all individuals seen over the 
         entire simulation
+    max_tracked_genotypes : int, default=100000
+        maximum number of genotypes whose histories are tracked while reading
+        the generations. If more distinct genotypes than this are seen, the 
+        rarest genotypes are dropped as the files are read and the key 
+        trajectories become approximate. 
     verbose : bool, default=True
-        print information and status bars
+        print outputs and status bars
     
     Returns
     -------
+    fit_df : pandas.DataFrame or None
+        dataframe with mean ("mu"), standard deviation ("std"), skewness 
+        ("skew"), excess kurtosis ("kurtosis"), median ("median"), and 5th
+        and 95th percentiles ("p5", "p95") of population fitness for each 
+        generation. None if genotypes not specified. 
     out_df : pandas.DataFrame
         dataframe where columns are genotypes (can be looked up in the
         simulation genotypes dataframe) and rows are generations. entries are 
@@ -272,122 +401,159 @@ def extract_key_trajectories(pickle_files,
         discarded. 
     """
 
+    fitness_lookup = None
+    if genotypes is not None:
+        fitness_lookup = _get_fitness_lookup(genotypes)
+    
     if verbose:
-        print("Extracting key trajectories")
-        print("Counting the number of times each genotype was seen",flush=True)
+        print("Summarizing generations",flush=True)
         pbar = tqdm(total=len(pickle_files))
     else:
         pbar = MockContextManager()
 
-    # Count how many times each genotype is seen over the entire trajectory
+    sketch = _HeavyHitters(max_tracked=max_tracked_genotypes)
+    
+    fitness_stats = []
+    population_sizes = []
     num_generations = 0
-    times_seen = {}
     with pbar:
 
-        # Go through all generations
         for pickle_file in pickle_files:
-            with open(pickle_file,'rb') as f:
-                generations = pickle.load(f)
-
-            # For each generation
-            for generation in generations:
-
-                # Get population size
-                if num_generations == 0:
-                    population_size = np.sum(list(generation.values()))
-
-                # Build up times_seen count for how often we say a given 
-                # genotype.
-                for genotype in generation:
-                    if genotype not in times_seen:
-                        times_seen[genotype] = 0
-                    times_seen[genotype] += generation[genotype]
 
-                num_generations += 1
-        
+            # Load this block of generations as flat arrays
+            block_genotypes, block_counts, offsets = read_generation_block(pickle_file)
+            num_in_block = len(offsets) - 1
+
+            # Generation (relative to block) of each record
+            local_gen = np.repeat(np.arange(num_in_block),np.diff(offsets))
+            pop_size = np.bincount(local_gen,
+                                   weights=block_counts,
+                                   minlength=num_in_block)
+            population_sizes.append(pop_size)
+
+            # Fitness statistics for every generation in the block at once
+            if fitness_lookup is not None:
+                stats = _weighted_fitness_stats(fitness=fitness_lookup[block_genotypes],
+                                                counts=block_counts,
+                                                local_gen=local_gen,
+                                                num_generations=num_in_block)
+                fitness_stats.append(stats)
+
+            # Update heavy hitters
+            sketch.update(genotypes=block_genotypes,
+                          counts=block_counts,
+                          generation=local_gen + num_generations)
+
+            num_generations += num_in_block
+            
             pbar.update()
 
-    # Record the total number of generations seen
-    total_num_generations = num_generations
+    fit_df = None
+    if fitness_lookup is not None:
+        fit_df = pd.DataFrame({k:np.concatenate([b[k] for b in fitness_stats])
+                               for k in _FITNESS_COLUMNS})
 
-    if verbose:
-        percentile = 100*(1 - key_genotype_cutoff)
-        print(f"Identifying the set of genotypes that make up {percentile:.5f}% of individuals over time",flush=True)
-
-    # Build cumulative distribution of genootypes
-    all_counts = np.array(list(times_seen.values()))
-    all_counts.sort()
-    cumulative = np.cumsum(all_counts)/np.sum(all_counts)
+    # Build cumulative distribution of genotypes. Individuals in genotypes 
+    # dropped from the sketch are treated as a single block of rare genotypes. 
+    population_sizes = np.concatenate(population_sizes)
+    total_seen = np.sum(population_sizes)
+    all_counts = np.sort(sketch.counts)
+    untracked = total_seen - np.sum(all_counts)
+    cumulative = (untracked + np.cumsum(all_counts))/total_seen
 
     # Find count cutoff that corresponds to cutoff
     fx = np.sum(cumulative > key_genotype_cutoff)/len(cumulative)
     count_cutoff = np.min(all_counts[cumulative > key_genotype_cutoff])
 
-    # Keep only genotypes seen at least count_cutoff times
-    filtered_genotypes = {}
-    for t in times_seen:
-        if times_seen[t] >= count_cutoff:
-            filtered_genotypes[t] = times_seen[t]
-
+    # Keep only genotypes seen at least count_cutoff times. Order by when they
+    # were first seen. 
+    keep = sketch.counts >= count_cutoff
+    order = np.lexsort((sketch.genotypes[keep],sketch.first_seen[keep]))
+    filtered_genotypes = sketch.genotypes[keep][order]
+    
     if verbose:
         print(f" + Taking {len(filtered_genotypes)} ({100*fx:.3f}%) of genotypes")
         print(f" + Corresponds to genotypes seen >= {count_cutoff} times",flush=True)
-    
-        print("Setting up structures to hold genotype histories",flush=True)
-        pbar = tqdm(total=len(filtered_genotypes)*2)
-    else:
-        pbar = MockContextManager()
 
-    to_sort = []
-    with pbar:
-        for f in filtered_genotypes:
-            to_sort.append((filtered_genotypes[f],f))
-            pbar.update()
+    # Fill in frequencies of the filtered genotypes
+    generation, genotype, count = sketch.history
+    mask = np.isin(genotype,filtered_genotypes)
+    sorter = np.argsort(filtered_genotypes)
+    column = sorter[np.searchsorted(filtered_genotypes,genotype[mask],sorter=sorter)]
     
-        to_sort.sort()
-        to_sort = to_sort[::-1]
+    # Last column holds "other" genotypes
+    num_filtered = len(filtered_genotypes)
+    freq = np.zeros((num_generations,num_filtered + 1),dtype=float)
+    freq[generation[mask],column] = count[mask]/population_sizes[generation[mask]]
+    freq[:,num_filtered] = 1 - np.sum(freq[:,:num_filtered],axis=1)
 
-        genotype_traj = {}
-        for t in to_sort:
-            genotype_traj[t[1]] = np.zeros(num_generations,dtype=int)
-            pbar.update()
+    columns = [f"{g}" for g in filtered_genotypes]
+    columns.append("other")
+    out_df = pd.DataFrame(freq,columns=columns,copy=False)
 
-    if verbose:
-        print("Extracting genotype histories",flush=True)
-        pbar = tqdm(total=len(pickle_files))
-    else:
-        pbar = MockContextManager()
+    return fit_df, out_df
 
-    # Construct a dictionary to hold frequency of each genotype over generations
-    to_df = dict([(f"{g}",np.zeros(total_num_generations,dtype=float))
-                  for g in filtered_genotypes])
-    with pbar:
 
-        # Go through simulation pickles
-        generation_counter = 0
-        for pickle_file in pickle_files:
-
-            with open(pickle_file,'rb') as f:
-                generations = pickle.load(f)
-
-            # For each generation
-            for generation in generations:
+def fitness_and_variance(genotypes,
+                         pickle_files,
+                         verbose=True):
+    """
+    Given the output of a wf_sim run, calculate the mean, standard deviation,
+    higher moments, and quantiles of the population fitness over time.
+    
+    Parameters
+    ----------
+    genotypes : pandas.DataFrame
+        genotypes dataframe created by load_directory
+    pickle_files : list
+        list of pickle (or npz) files to load (in order)
+    verbose : bool, default=True
+        print outputs and status bars
+    
+    Returns
+    -------
+    df : pandas.DataFrame
+        dataframe with mean, standard deviation, higher moments, and quantiles
+        of the fitness (see summarize_generations)
+    """
 
-                # For each genotype
-                for genotype in generation:
+    fit_df, _ = summarize_generations(pickle_files=pickle_files,
+                                      genotypes=genotypes,
+                                      verbose=verbose)
+    
+    return fit_df
+            
 
-                    # If the genotype is one we care about, record its frequency
-                    if genotype in filtered_genotypes:
-                        freq = generation[genotype]/population_size
-                        to_df[f"{genotype}"][generation_counter] = freq
+def extract_key_trajectories(pickle_files,
+                             key_genotype_cutoff=1e-3,
+                             verbose=True):
+    """
+    Extract frequency of genotypes seen in at least cutoff of the individuals 
+    seen over the entire simulation. 
 
-                generation_counter += 1
-            
-            pbar.update()
+    Parameters
+    ----------
+    pickle_files : list
+        list of pickle (or npz) files (in order)
+    key_genotype_cutoff : float, default=1e-3
+        how to filter genotypes. if cutoff is 0.001, this will return the 
+        genotypes that account for 0.999 of all individuals seen over the 
+        entire simulation
+    verbose : bool, default=True
+        print information and status bars
+    
+    Returns
+    -------
+    out_df : pandas.DataFrame
+        dataframe where columns are genotypes (can be looked up in the
+        simulation genotypes dataframe) and rows are generations. entries are 
+        frequency at that generation. the "other" columns accounts for genotypes
+        discarded. 
+    """
 
-    # Create final dataframe
-    out_df = pd.DataFrame(to_df)
-    out_df["other"] = 1 - np.sum(out_df,axis=1)
+    _, out_df = summarize_generations(pickle_files=pickle_files,
+                                      key_genotype_cutoff=key_genotype_cutoff,
+                                      verbose=verbose)
 
     return out_df
 
@@ -423,8 +589,8 @@ def summarize_simulation(sim_directory,
         genotypes seen over simulation) and "pickle_files" (pickle files 
         written out by the simulation)
     fitness_results : pandas.DataFrame
-        dataframe holding mean and variance of population fitness over the 
-        simulation
+        dataframe holding mean, standard deviation, higher moments, and 
+        quantiles of population fitness over the simulation
     key_traj : pandas.DataFrame
         frequencies of genotypes that make up 1-cutoff of all genotypes seen
         as a function of time
@@ -440,18 +606,33 @@ def summarize_simulation(sim_directory,
     fitness_results = None
     key_traj = None
 
-    # Get overall fitness versus time
+    # Read existing summaries
     avg_fitness_csv = os.path.join(sim_directory,"avg_fitness.csv")
     if os.path.exists(avg_fitness_csv):
         fitness_results = pd.read_csv(avg_fitness_csv)
 
-    else:
-        if len(sim["pickle_files"]) > 0:
+    key_traj_csv = os.path.join(sim_directory,"key_traj.csv")
+    if os.path.exists(key_traj_csv):
+        key_traj = pd.read_csv(key_traj_csv)
+
+    # Calculate missing summaries with a single pass through the generation
+    # files
+    need_fitness = fitness_results is None
+    need_key_traj = key_traj is None
+    if (need_fitness or need_key_traj) and len(sim["pickle_files"]) > 0:
 
-            # We have pickle files. Load results and generate plots if requested. 
-            fitness_results = fitness_and_variance(genotypes=sim["genotypes"],
-                                                   pickle_files=sim["pickle_files"],
-                                                   verbose=verbose)
+        genotypes = None
+        if need_fitness:
+            genotypes = sim["genotypes"]
+
+        fit_df, traj_df = summarize_generations(pickle_files=sim["pickle_files"],
+                                                genotypes=genotypes,
+                                                key_genotype_cutoff=key_genotype_cutoff,
+                                                verbose=verbose)
+        
+        # Write fitness results and generate plots if requested. 
+        if need_fitness:
+            fitness_results = fit_df
             fitness_results.to_csv(avg_fitness_csv,index=False)
             
             if generate_plots:
@@ -459,20 +640,10 @@ def summarize_simulation(sim_directory,
                 fig.savefig(os.path.join(sim_directory,"avg_fitness.pdf"))
                 plt.close()
     
-    # Get key trajectories
-    key_traj_csv = os.path.join(sim_directory,"key_traj.csv")
-    if os.path.exists(key_traj_csv):
-        key_traj = pd.read_csv(key_traj_csv)
-
-    else:
-        if len(sim["pickle_files"]) > 0:
-            
-            # We have pickle files. Load results and generate plots if requested. 
-            key_traj = extract_key_trajectories(pickle_files=sim["pickle_files"],
-                                                key_genotype_cutoff=key_genotype_cutoff,
-                                                verbose=verbose)
-            key_traj.to_csv(os.path.join(sim_directory,"key_traj.csv"),
-                            index=False)
+        # Write key trajectories and generate plots if requested. 
+        if need_key_traj:
+            key_traj = traj_df
+            key_traj.to_csv(key_traj_csv,index=False)
             
             if generate_plots:
                 fig, _ = plot_genotypes_vs_generations(genotypes=sim["genotypes"],
@@ -480,15 +651,13 @@ def summarize_simulation(sim_directory,
                 fig.savefig(os.path.join(sim_directory,"key_traj.pdf"))
                 plt.close()
         
-
     # Delete pickle files, if requested
     if delete_pickle_files:
         
         if len(sim["pickle_files"]) > 0:
 
-            # Read last pickle file
-            with open(sim["pickle_files"][-1],'rb') as f:
-                generations = pickle.load(f)
+            # Read last generation from last generation file
+            generations = read_generations(sim["pickle_files"][-1],start=-1)
             
             # Write last generation from last pickle file to it's own pickle file
             # to allow extension of trajectories
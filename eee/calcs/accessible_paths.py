@@ -18,7 +18,8 @@ class AccessiblePaths(Simulation):
             max_depth=1,
             allow_neutral=True,
             find_all_paths=True,
-            output_file="eee_accessible.csv"):
+            output_file="eee_accessible.csv",
+            unique_genotypes=False):
         """
         Identify all accessible evolutionary paths starting from a wildtype
         protein.
@@ -40,6 +41,10 @@ class AccessiblePaths(Simulation):
             visit the same genotype. 
         output_file : str, default="genotypes.csv"
             return visited genotypes (with trajectory information) to this file
+        unique_genotypes : bool, default=False
+            record each accessible genotype once (with a num_paths column) 
+            rather than once per accepted path, and write accepted steps to
+            {output_file root}_edges.csv
         """
 
         max_depth = check_int(value=max_depth,
@@ -51,6 +56,8 @@ class AccessiblePaths(Simulation):
                                     variable_name="find_all_paths")
         
         output_file = f"{output_file}"
+        unique_genotypes = check_bool(value=unique_genotypes,
+                                      variable_name="unique_genotypes")
     
         # Record the new keys
         calc_params = {}
@@ -58,6 +65,7 @@ class AccessiblePaths(Simulation):
         calc_params["allow_neutral"] = allow_neutral
         calc_params["find_all_paths"] = find_all_paths
         calc_params["output_file"] = output_file
+        calc_params["unique_genotypes"] = unique_genotypes
 
         self._prepare_calc(output_directory=output_directory,
                            calc_params=calc_params)
@@ -69,6 +77,7 @@ class AccessiblePaths(Simulation):
                    allow_neutral=calc_params["allow_neutral"],
                    find_all_paths=calc_params["find_all_paths"],
                    output_file=calc_params["output_file"],
+                   unique_genotypes=calc_params["unique_genotypes"],
                    return_output=False)
         
         self._complete_calc()
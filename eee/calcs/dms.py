@@ -5,6 +5,7 @@ from .simulation_base import Simulation
 from eee.core.engine import exhaustive
 
 from eee._private.check.standard import check_int
+from eee._private.check.standard import check_float
 from eee._private.interface import run_cleanly
 
 
@@ -16,7 +17,13 @@ class DeepMutationalScan(Simulation):
     def run(self,
             output_directory="eee_dms",
             max_depth=1,
-            output_file="eee_dms.csv"):
+            output_file="eee_dms.csv",
+            batch_size=100000,
+            output_format="csv",
+            num_workers=None,
+            keep_top_k=None,
+            min_fitness=None,
+            min_relative_fitness=None):
         """
         Run a deep mutational scan up to max_depth mutations away from wildtype. 
         
@@ -30,18 +37,59 @@ class DeepMutationalScan(Simulation):
             very large as the number of sites and number of possible mutations 
             increase. 
         output_file : str, default="eee_dms.csv"
-            write results to the indicated csv file
+            write results to the indicated csv file (or directory if 
+            output_format is "npz")
+        batch_size : int, default=100000
+            number of genotypes to score and write at once. Peak memory 
+            scales with batch_size rather than the size of the scan. 
+        output_format : str, default="csv"
+            "csv" or "npz" (directory of compressed, columnar blocks that can
+            be read with eee.io.read_exhaustive)
+        num_workers : int, optional
+            if specified, score genotypes in this many worker processes. The
+            output is identical to a scan run in a single process. 
+        keep_top_k : int, optional
+            only write the keep_top_k genotypes with the highest fitness
+        min_fitness : float, optional
+            only write genotypes with fitness >= min_fitness
+        min_relative_fitness : float, optional
+            only write genotypes with fitness >= min_relative_fitness times
+            the fitness of wildtype
         """
 
         max_depth = check_int(value=max_depth,
                               variable_name="max_depth",
                               minimum_allowed=0)
         output_file = f"{output_file}"
+        batch_size = check_int(value=batch_size,
+                               variable_name="batch_size",
+                               minimum_allowed=1)
+        output_format = f"{output_format}"
+        if num_workers is not None:
+            num_workers = check_int(value=num_workers,
+                                    variable_name="num_workers",
+                                    minimum_allowed=1)
+        if keep_top_k is not None:
+            keep_top_k = check_int(value=keep_top_k,
+                                   variable_name="keep_top_k",
+                                   minimum_allowed=1)
+        if min_fitness is not None:
+            min_fitness = check_float(value=min_fitness,
+                                      variable_name="min_fitness")
+        if min_relative_fitness is not None:
+            min_relative_fitness = check_float(value=min_relative_fitness,
+                                               variable_name="min_relative_fitness")
     
         # Record the new keys
         calc_params = {}
         calc_params["max_depth"] = max_depth
         calc_params["output_file"] = output_file
+        calc_params["batch_size"] = batch_size
+        calc_params["output_format"] = output_format
+        calc_params["num_workers"] = num_workers
+        calc_params["keep_top_k"] = keep_top_k
+        calc_params["min_fitness"] = min_fitness
+        calc_params["min_relative_fitness"] = min_relative_fitness
 
         self._prepare_calc(output_directory=output_directory,
                            calc_params=calc_params)
@@ -50,7 +98,13 @@ class DeepMutationalScan(Simulation):
         exhaustive(gc=self._gc,
                    max_depth=calc_params["max_depth"],
                    output_file=calc_params["output_file"],
-                   return_output=False)
+                   return_output=False,
+                   batch_size=calc_params["batch_size"],
+                   output_format=calc_params["output_format"],
+                   num_workers=calc_params["num_workers"],
+                   keep_top_k=calc_params["keep_top_k"],
+                   min_fitness=calc_params["min_fitness"],
+                   min_relative_fitness=calc_params["min_relative_fitness"])
         
         self._complete_calc()
 
@@ -101,7 +101,8 @@ class Simulation:
         self._gc = Genotype(ens=self._ens,
                             fitness_function=self._fc.fitness,
                             ddg_df=ddg_df,
-                            choice_function=self._rng.choice)
+                            choice_function=self._rng.choice,
+                            fitness_function_batch=self._fc.fitness_batch)
 
         # Make sure the Simulation object is subclassed.
         if self.__class__ is Simulation:
@@ -4,19 +4,188 @@ Code to run a Wright-Fisher simulation on an ensemble.
 from .simulation_base import Simulation
 
 from eee.core.engine import wright_fisher
+from eee.core.engine import resume_wright_fisher
+from eee.core.engine.stopping import build_stopping_criteria
 
 from eee._private.check.eee import check_num_generations
 from eee._private.check.eee import check_num_mutations
 from eee._private.check.eee import check_mutation_rate
 from eee._private.check.eee import check_population_size
+from eee._private.check.eee import check_step_mode
+from eee._private.check.eee import check_output_format
 from eee._private.check.standard import check_int
 from eee._private.check.standard import check_bool
 from eee._private.interface import run_cleanly
+from eee._private.interface import MockContextManager
+from eee.io.generations import read_generations
+
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+import inspect
+import glob
+import json
+import os
+
+def _summarize_replicate(output_directory,
+                         write_prefix):
+    """
+    Get a one-row summary of a completed wf_sim run: the final generation,
+    mean population fitness at that generation, and the most frequent 
+    genotype at that generation. 
+    """
+
+    genotypes = pd.read_csv(os.path.join(output_directory,
+                                         f"{write_prefix}_genotypes.csv"))
+    genotypes = genotypes.set_index("genotype")
+
+    gen_files = glob.glob(os.path.join(output_directory,
+                                       f"{write_prefix}_generations_*"))
+    gen_files.sort()
+
+    # Get the last generation recorded
+    num_generations = 0
+    last_generation = {}
+    for gen_file in gen_files:
+        generations = read_generations(gen_file)
+        num_generations += len(generations)
+        if len(generations) > 0:
+            last_generation = generations[-1]
+
+    seen = np.array(list(last_generation.keys()),dtype=int)
+    counts = np.array(list(last_generation.values()),dtype=float)
+    fitness = np.array(genotypes.loc[seen,"fitness"])
+    dominant = seen[np.argmax(counts)]
+
+    summary = {"num_generations":num_generations,
+               "num_genotypes":len(genotypes),
+               "mean_fitness":np.sum(fitness*counts)/np.sum(counts),
+               "dominant_genotype":dominant,
+               "dominant_freq":np.max(counts)/np.sum(counts),
+               "dominant_accum_mut":genotypes.loc[dominant,"accum_mut"],
+               "dominant_num_accum_mut":genotypes.loc[dominant,"num_accum_mut"]}
+    
+    return summary
+
+def _run_replicate(ens,
+                   ddg_df,
+                   conditions,
+                   seed,
+                   output_directory,
+                   run_kwargs):
+    """
+    Run one replicate wf_sim in its own output directory. This is done in a
+    worker process by WrightFisherSimulation.run_replicates.
+    """
+
+    sim = WrightFisherSimulation(ens=ens,
+                                 ddg_df=ddg_df,
+                                 conditions=conditions,
+                                 seed=seed)
+    sim.run(output_directory=output_directory,**run_kwargs)
+
+    write_prefix = run_kwargs.get("write_prefix","eee_wf-sim")
+
+    return _summarize_replicate(output_directory=output_directory,
+                                write_prefix=write_prefix)
+
 
 class WrightFisherSimulation(Simulation):
 
     calc_type = "wf_sim"
 
+    def _check_run_params(self,
+                          population_size,
+                          mutation_rate,
+                          num_generations,
+                          num_mutations,
+                          write_prefix,
+                          write_frequency,
+                          canonical_genotypes,
+                          step_mode,
+                          output_format,
+                          background_write,
+                          checkpoint_frequency,
+                          stopping_criteria,
+                          verbose):
+        """
+        Validate the arguments to run and return them as a calc_params 
+        dictionary.
+        """
+
+        population_size = check_population_size(population_size)
+        mutation_rate = check_mutation_rate(mutation_rate) 
+        num_generations = check_num_generations(num_generations)
+        if num_mutations is not None:
+            num_mutations = check_num_mutations(num_mutations)
+        write_prefix = f"{write_prefix}"
+
+        write_frequency = check_int(value=write_frequency,
+                                    variable_name="write_frequency",
+                                    minimum_allowed=1)
+        canonical_genotypes = check_bool(value=canonical_genotypes,
+                                         variable_name="canonical_genotypes")
+        step_mode = check_step_mode(step_mode)
+        output_format = check_output_format(output_format)
+        background_write = check_bool(value=background_write,
+                                      variable_name="background_write")
+        if checkpoint_frequency is not None:
+            checkpoint_frequency = check_int(value=checkpoint_frequency,
+                                             variable_name="checkpoint_frequency",
+                                             minimum_allowed=1)
+        if stopping_criteria is not None:
+            if not issubclass(type(stopping_criteria),dict):
+                err = "\nstopping_criteria should be a dictionary\n\n"
+                raise ValueError(err)
+            build_stopping_criteria(stopping_criteria)
+        verbose = check_bool(value=verbose,
+                             variable_name="verbose")
+    
+        # Record the new keys
+        calc_params = {}
+        calc_params["population_size"] = population_size
+        calc_params["mutation_rate"] = mutation_rate
+        calc_params["num_generations"] = num_generations
+        calc_params["num_mutations"] = num_mutations
+        calc_params["write_prefix"] = write_prefix
+        calc_params["write_frequency"] = write_frequency
+        calc_params["canonical_genotypes"] = canonical_genotypes
+        calc_params["step_mode"] = step_mode
+        calc_params["output_format"] = output_format
+        calc_params["background_write"] = background_write
+        calc_params["checkpoint_frequency"] = checkpoint_frequency
+        calc_params["stopping_criteria"] = stopping_criteria
+        calc_params["verbose"] = verbose
+
+        return calc_params
+
+    def _check_run_kwargs(self,kwargs):
+        """
+        Validate a dictionary of keyword arguments to run (other than 
+        output_directory), filling in run's defaults for anything not given.
+        Returns them as a calc_params dictionary.
+        """
+
+        run_sig = inspect.signature(self.run)
+        bad_kwargs = [k for k in kwargs
+                      if k not in run_sig.parameters or k == "output_directory"]
+        if len(bad_kwargs) > 0:
+            err = "\nThe following keyword arguments are not arguments to run:\n"
+            for k in bad_kwargs:
+                err += f"    {k}\n"
+            err += "\n"
+            raise ValueError(err)
+
+        run_kwargs = run_sig.bind_partial(**kwargs)
+        run_kwargs.apply_defaults()
+        run_kwargs = dict(run_kwargs.arguments)
+        run_kwargs.pop("output_directory")
+
+        return self._check_run_params(**run_kwargs)
+
     @run_cleanly
     def run(self,
             output_directory="eee_wf-sim",
@@ -26,6 +195,12 @@ class WrightFisherSimulation(Simulation):
             num_mutations=None,
             write_prefix="eee_wf-sim",
             write_frequency=1000,
+            canonical_genotypes=False,
+            step_mode="individual",
+            output_format="pickle",
+            background_write=True,
+            checkpoint_frequency=None,
+            stopping_criteria=None,
             verbose=True):
         """
         Run a Wright-Fisher simulation on an ensemble.
@@ -48,36 +223,58 @@ class WrightFisherSimulation(Simulation):
             write output files during the run with this prefix. 
         write_frequency : int, default=1000
             write the generations out every write_frequency generations. 
+        canonical_genotypes : bool, default=False
+            if True, recurrent mutants (genotypes with the same set of 
+            mutations that arise on different lineages) share one genotype
+            index. This shrinks the number of genotypes tracked each 
+            generation. 
+        step_mode : str, default="individual"
+            how to advance each generation. "individual" samples every member
+            of the population. "multinomial" samples offspring counts for each
+            distinct genotype, which is much faster for large populations. 
+        output_format : str, default="pickle"
+            format for generation files. "pickle" or "npz" (compressed, 
+            columnar blocks that can be read in slices). 
+        background_write : bool, default=True
+            write output files on a background thread so the simulation does
+            not wait on file I/O
+        checkpoint_frequency : int, optional
+            write a checkpoint ({write_prefix}_checkpoint.ckpt) at the first 
+            write after every checkpoint_frequency generations and at the end
+            of the run. An interrupted run can be continued, or a finished run
+            extended, with the resume method. The checkpoint holds every 
+            genotype still tracked, so it can be large. If None (the default),
+            do not write checkpoints. 
+        stopping_criteria : dict, optional
+            stop the simulation early if any of these criteria are met. Keys
+            are criterion names ("fixation", "fitness_plateau", 
+            "target_fitness", "wall_clock", "memory"); values are 
+            dictionaries of keyword arguments for each criterion. For example,
+            {"fitness_plateau":{"window":1000,"tolerance":1e-3}}. See 
+            eee.core.engine.stopping. 
         verbose : bool, default=True
             whether to print information and status bars
         """
 
-        population_size = check_population_size(population_size)
-        mutation_rate = check_mutation_rate(mutation_rate) 
-        num_generations = check_num_generations(num_generations)
-        if num_mutations is not None:
-            num_mutations = check_num_mutations(num_mutations)
-        write_prefix = f"{write_prefix}"
-
-        write_frequency = check_int(value=write_frequency,
-                                    variable_name="write_frequency",
-                                    minimum_allowed=1)
-        verbose = check_bool(value=verbose,
-                             variable_name="verbose")
-    
-        # Record the new keys
-        calc_params = {}
-        calc_params["population_size"] = population_size
-        calc_params["mutation_rate"] = mutation_rate
-        calc_params["num_generations"] = num_generations
-        calc_params["num_mutations"] = num_mutations
-        calc_params["write_prefix"] = write_prefix
-        calc_params["write_frequency"] = write_frequency
-        calc_params["verbose"] = verbose
+        calc_params = self._check_run_params(population_size=population_size,
+                                             mutation_rate=mutation_rate,
+                                             num_generations=num_generations,
+                                             num_mutations=num_mutations,
+                                             write_prefix=write_prefix,
+                                             write_frequency=write_frequency,
+                                             canonical_genotypes=canonical_genotypes,
+                                             step_mode=step_mode,
+                                             output_format=output_format,
+                                             background_write=background_write,
+                                             checkpoint_frequency=checkpoint_frequency,
+                                             stopping_criteria=stopping_criteria,
+                                             verbose=verbose)
 
         self._prepare_calc(output_directory=output_directory,
                            calc_params=calc_params)
         
+        self._gc.canonical_genotypes = calc_params["canonical_genotypes"]
+
         # Run and return a Wright Fisher simulation.
         self._gc, _ =  wright_fisher(gc=self._gc,
                                      population=calc_params["population_size"],
@@ -86,10 +283,201 @@ class WrightFisherSimulation(Simulation):
                                      num_mutations=calc_params["num_mutations"],
                                      write_prefix=calc_params["write_prefix"],
                                      write_frequency=calc_params["write_frequency"],
+                                     step_mode=calc_params["step_mode"],
+                                     output_format=calc_params["output_format"],
+                                     background_write=calc_params["background_write"],
+                                     checkpoint_frequency=calc_params["checkpoint_frequency"],
+                                     stopping_criteria=calc_params["stopping_criteria"],
                                      verbose=calc_params["verbose"],
                                      rng=self._rng)
         
         self._complete_calc()
 
+    @run_cleanly
+    def resume(self,
+               output_directory="eee_wf-sim",
+               num_generations=None,
+               write_prefix="eee_wf-sim",
+               background_write=True,
+               verbose=True,
+               **kwargs):
+        """
+        Resume a Wright-Fisher simulation from the last checkpoint written by
+        run. The population, genotypes, random number generator state, and 
+        write counters are restored from the checkpoint, so an interrupted 
+        simulation continues exactly as if it had never stopped. A finished 
+        simulation can be extended by passing a larger num_generations. 
+
+        Parameters
+        ----------
+        output_directory : str, default="eee_wf-sim"
+            directory holding the simulation to resume
+        num_generations : int, optional
+            total number of generations for the simulation (counting from the
+            start of the original run). If None, use the value from the 
+            original run. 
+        write_prefix : str, default="eee_wf-sim"
+            write_prefix used for the original run
+        background_write : bool, default=True
+            write output files on a background thread
+        verbose : bool, default=True
+            whether to print information and status bars
+        **kwargs : 
+            other arguments to run, so the keyword arguments used for run can 
+            be passed directly. The simulation always continues with the 
+            settings stored in the checkpoint; a ValueError is raised if any 
+            of these differ from those settings. 
+        """
+
+        if num_generations is not None:
+            num_generations = check_num_generations(num_generations)
+        write_prefix = f"{write_prefix}"
+        background_write = check_bool(value=background_write,
+                                      variable_name="background_write")
+        verbose = check_bool(value=verbose,
+                             variable_name="verbose")
+
+        # Validate the run arguments we were passed. Only the ones actually 
+        # passed are compared to the checkpointed settings.
+        expected_settings = self._check_run_kwargs(kwargs)
+        expected_settings = {k:expected_settings[k] for k in kwargs}
+
+        checkpoint_file = f"{write_prefix}_checkpoint.ckpt"
+        if not os.path.isfile(os.path.join(output_directory,checkpoint_file)):
+            err = f"\nno checkpoint ({checkpoint_file}) found in output_directory\n"
+            err += f"({output_directory}). Checkpoints are only written if run is\n"
+            err += "called with checkpoint_frequency set.\n\n"
+            raise FileNotFoundError(err)
+
+        self._current_dir = os.getcwd()
+        os.chdir(output_directory)
+
+        self._gc, _ = resume_wright_fisher(checkpoint_file=checkpoint_file,
+                                           num_generations=num_generations,
+                                           expected_settings=expected_settings,
+                                           verbose=verbose,
+                                           background_write=background_write,
+                                           rng=self._rng)
+
+        # Record the new number of generations. This is only done once the
+        # checkpoint has accepted it, so a rejected resume leaves the json 
+        # untouched. 
+        if num_generations is not None:
+            json_file = os.path.join("input","simulation.json")
+            with open(json_file) as f:
+                out = json.load(f)
+            out["calc_params"]["num_generations"] = num_generations
+            with open(json_file,"w") as f:
+                json.dump(out,f,indent=2)
+        
+        self._complete_calc()
+
+    @run_cleanly
+    def run_replicates(self,
+                       num_replicates,
+                       output_directory="eee_wf-sim",
+                       num_workers=None,
+                       verbose=True,
+                       **kwargs):
+        """
+        Run independent replicate Wright-Fisher simulations in parallel. 
+        
+        Each replicate gets its own seed, spawned from the seed of this 
+        object with numpy.random.SeedSequence, and is written to its own 
+        subdirectory (replicate_000, replicate_001, ...) of output_directory.
+        The seed is stored in each replicate's input/simulation.json, so a
+        replicate can be reproduced alone (i.e. `eee-run-calculation 
+        replicate_003/input/simulation.json out --use_stored_seed`). A summary
+        of the final generation of every replicate is written to 
+        output_directory/replicates.csv. The run arguments, num_replicates, 
+        and num_workers are stored in output_directory/input/simulation.json.
+
+        Parameters
+        ----------
+        num_replicates : int
+            number of replicates to run. Should be >= 1. 
+        output_directory : str, default="eee_wf-sim"
+            write replicates to this output directory
+        num_workers : int, optional
+            number of processes to use. If None, use the number of cpus. 
+        verbose : bool, default=True
+            show a status bar tracking completed replicates
+        **kwargs : 
+            keyword arguments passed to run for each replicate (i.e. 
+            population_size, num_generations). Each replicate runs with 
+            verbose=False. 
+
+        Returns
+        -------
+        replicates : pandas.DataFrame
+            dataframe with the seed, output directory, and a summary of the 
+            final generation of each replicate
+        """
+
+        num_replicates = check_int(value=num_replicates,
+                                   variable_name="num_replicates",
+                                   minimum_allowed=1)
+        if num_workers is not None:
+            num_workers = check_int(value=num_workers,
+                                    variable_name="num_workers",
+                                    minimum_allowed=1)
+        verbose = check_bool(value=verbose,
+                             variable_name="verbose")
+
+        # Validate the run arguments here, before anything is written or 
+        # spawned
+        run_kwargs = dict(kwargs)
+        run_kwargs["verbose"] = False
+        run_kwargs = self._check_run_kwargs(run_kwargs)
+
+        # Spawn one child seed per replicate. Each child is turned into an 
+        # integer seed so it can be stored in, and read back from, a json file.
+        children = np.random.SeedSequence(self._seed).spawn(num_replicates)
+        seeds = [int(c.generate_state(1,dtype=np.uint64)[0]) for c in children]
+
+        # Record the replicate settings alongside the run arguments so the 
+        # whole set of replicates can be reproduced from this json file. 
+        calc_params = dict(run_kwargs)
+        calc_params["num_replicates"] = num_replicates
+        calc_params["num_workers"] = num_workers
+
+        self._prepare_calc(output_directory=output_directory,
+                           calc_params=calc_params)
+
+        num_digits = len(f"{num_replicates - 1}")
+        rep_dirs = [os.path.abspath(f"replicate_{i:0{num_digits}d}")
+                    for i in range(num_replicates)]
+
+        if verbose:
+            pbar = tqdm(total=num_replicates)
+        else:
+            pbar = MockContextManager()
+
+        summaries = [None for _ in range(num_replicates)]
+        with pbar, ProcessPoolExecutor(max_workers=num_workers) as executor:
+
+            futures = {}
+            for i in range(num_replicates):
+                f = executor.submit(_run_replicate,
+                                    ens=self._ens,
+                                    ddg_df=self._gc._ddg_df,
+                                    conditions=self._fc.condition_df,
+                                    seed=seeds[i],
+                                    output_directory=rep_dirs[i],
+                                    run_kwargs=run_kwargs)
+                futures[f] = i
+
+            for f in as_completed(futures):
+                summaries[futures[f]] = f.result()
+                pbar.update(n=1)
+
+        out = {"replicate":np.arange(num_replicates,dtype=int),
+               "seed":seeds,
+               "directory":[os.path.basename(d) for d in rep_dirs]}
+        replicates = pd.concat((pd.DataFrame(out),pd.DataFrame(summaries)),
+                               axis=1)
+        replicates.to_csv("replicates.csv",index=False)
+
+        self._complete_calc()
 
-    
\ No newline at end of file
+        return replicates
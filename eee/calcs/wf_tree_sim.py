@@ -9,6 +9,7 @@ from eee._private.check.eee import check_num_generations
 from eee._private.check.eee import check_mutation_rate
 from eee._private.check.eee import check_population_size
 from eee._private.check.eee import check_burn_in_generations
+from eee._private.check.standard import check_int
 from eee._private.interface import run_cleanly
 from eee.io.read_tree import read_tree
 
@@ -27,7 +28,8 @@ class WrightFisherTreeSimulation(Simulation):
             mutation_rate=0.01,
             num_generations=100,
             burn_in_generations=100,
-            write_prefix="eee_wf-tree-sim"):
+            write_prefix="eee_wf-tree-sim",
+            num_workers=None):
         """
         Perform a Wright-Fisher simulation across an existing evolutionary tree. 
         
@@ -52,6 +54,11 @@ class WrightFisherTreeSimulation(Simulation):
             ancestral population. Must be >= 0. 
         write_prefix : str, default="eee_sim"
             write output files during the run with this prefix. 
+        num_workers : int, optional
+            if specified, simulate independent branches in parallel using this
+            many processes. Results are reproducible for a given seed and do 
+            not depend on num_workers (but differ from a run with num_workers
+            None, which simulates branches one after another).
         """
         
         # Read the tree
@@ -63,6 +70,10 @@ class WrightFisherTreeSimulation(Simulation):
         num_generations = check_num_generations(num_generations)
         burn_in_generations = check_burn_in_generations(burn_in_generations)
         write_prefix = f"{write_prefix}"
+        if num_workers is not None:
+            num_workers = check_int(value=num_workers,
+                                    variable_name="num_workers",
+                                    minimum_allowed=1)
     
         # Record the new keys
         calc_params = {}
@@ -72,6 +83,7 @@ class WrightFisherTreeSimulation(Simulation):
         calc_params["num_generations"] = num_generations
         calc_params["write_prefix"] = write_prefix
         calc_params["burn_in_generations"] = burn_in_generations
+        calc_params["num_workers"] = num_workers
 
         self._prepare_calc(output_directory=output_directory,
                            calc_params=calc_params)
@@ -84,6 +96,7 @@ class WrightFisherTreeSimulation(Simulation):
                                    num_generations=calc_params["num_generations"],
                                    burn_in_generations=calc_params["burn_in_generations"],
                                    write_prefix=calc_params["write_prefix"],
+                                   num_workers=calc_params["num_workers"],
                                    rng=self._rng)
         
         # A small hack to copy tree to input directory so json can load
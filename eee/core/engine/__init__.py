@@ -3,6 +3,7 @@ Code for moving through sequence space.
 """
 
 from .wright_fisher import wright_fisher
+from .wright_fisher import resume_wright_fisher
 from .exhaustive import exhaustive
 from .pathfinder import pathfinder
 from .follow_tree import follow_tree
@@ -7,19 +7,180 @@ from eee.core import Genotype
 
 from eee._private.check.standard import check_int
 from eee._private.check.standard import check_bool
+from eee._private.check.standard import check_float
 
 from eee.analysis import get_num_genotypes
+from eee.io.exhaustive import append_exhaustive_csv
+from eee.io.exhaustive import write_exhaustive_block
+from eee.io.exhaustive import exhaustive_block_to_df
 
 import numpy as np
+import pandas as pd
 from tqdm.auto import tqdm
 
+from concurrent.futures import ProcessPoolExecutor
+import collections
 import itertools
-import copy
+import warnings
+import glob
+import os
+
+def _iter_site_combinations(num_sites,max_depth):
+    """
+    Yield tuples of site indexes in scan order: () (wildtype), then every 
+    combination of 1 site, 2 sites, etc. up to max_depth. 
+    """
+
+    yield ()
+    for L in range(1,min(max_depth,num_sites)+1):
+        yield from itertools.combinations(range(num_sites),L)
+
+def _combination_block(site_ids,sites,width):
+    """
+    Build every combination of mutations at sites as one (num_combinations x
+    width) array of mutation ids padded with -1. Rows are in the same order
+    as itertools.product (last site varies fastest). 
+    """
+
+    if len(sites) == 0:
+        return -np.ones((1,width),dtype=np.int64)
+
+    grids = np.meshgrid(*[np.asarray(site_ids[i],dtype=np.int64) for i in sites],
+                        indexing="ij")
+    
+    block = -np.ones((grids[0].size,width),dtype=np.int64)
+    for k, grid in enumerate(grids):
+        block[:,k] = grid.ravel()
+
+    return block
+
+def _iter_mutation_batches(site_ids,site_combinations,width,batch_size):
+    """
+    Lazily generate every combination of mutations at each entry in 
+    site_combinations (in order), yielding (batch_size x width) arrays of 
+    mutation ids padded with -1. 
+    """
+
+    batch = -np.ones((batch_size,width),dtype=np.int64)
+    num_in_batch = 0
+    
+    for sites in site_combinations:
+
+        # Copy the whole block for this site combination into one or more
+        # batches
+        block = _combination_block(site_ids,sites,width)
+        start = 0
+        while start < len(block):
+            
+            if num_in_batch == batch_size:
+                yield batch
+                batch = -np.ones((batch_size,width),dtype=np.int64)
+                num_in_batch = 0
+
+            num_to_copy = min(len(block) - start,batch_size - num_in_batch)
+            batch[num_in_batch:num_in_batch + num_to_copy] = block[start:start + num_to_copy]
+            num_in_batch += num_to_copy
+            start += num_to_copy
+
+    yield batch[:num_in_batch]
+
+def _iter_shards(site_ids,max_depth,shard_size):
+    """
+    Group site combinations (in scan order) into shards holding at least 
+    shard_size genotypes. Yields lists of site combinations and the number of
+    genotypes in each shard. 
+    """
+
+    shard = []
+    num_genotypes = 0
+    for sites in _iter_site_combinations(len(site_ids),max_depth):
+
+        shard.append(sites)
+        num_genotypes += int(np.prod([len(site_ids[i]) for i in sites]))
+        
+        if num_genotypes >= shard_size:
+            yield shard, num_genotypes
+            shard = []
+            num_genotypes = 0
+
+    if len(shard) > 0:
+        yield shard, num_genotypes
+
+# Set in each worker process by _init_worker
+_worker_data = {}
+
+def _init_worker(gc,site_ids,width):
+    """
+    Store the Genotype object and site mutation ids in a worker process so 
+    they are only sent once per worker. 
+    """
+
+    _worker_data["gc"] = gc
+    _worker_data["site_ids"] = site_ids
+    _worker_data["width"] = width
+
+def _score_shard(site_combinations,num_genotypes):
+    """
+    Build and score every genotype in a shard of site combinations. Run in
+    a worker process. Returns mutations, energy, fitness. 
+    """
+
+    mutations = next(_iter_mutation_batches(site_ids=_worker_data["site_ids"],
+                                            site_combinations=site_combinations,
+                                            width=_worker_data["width"],
+                                            batch_size=num_genotypes))
+    energy, fitness = _score_batch(_worker_data["gc"],mutations)
+
+    return mutations, energy, fitness
+
+def _score_batch(gc,mutations):
+    """
+    Calculate the mutation energies (summed ddg rows) and fitness of a batch
+    of genotypes defined by a padded array of mutation ids. 
+    """
+
+    energy = gc.mut_energy_batch(mutations)
+    fitness = gc.fitness_batch(energy)
+
+    return energy, fitness
+
+def _merge_top_k(top,block,k):
+    """
+    Merge a block of scored genotypes into the current top genotypes, keeping
+    the k with the highest fitness. Ties go to the lower genotype number. 
+    Only k + len(block) genotypes are ever held at once. 
+    """
+
+    if top is not None:
+        block = {key:np.concatenate((top[key],block[key])) for key in block}
+
+    if len(block["fitness"]) > k:
+        order = np.lexsort((block["genotype"],-block["fitness"]))[:k]
+        order.sort()
+        block = {key:block[key][order] for key in block}
+
+    return block
+
+def _get_shells_file(output_file,output_format):
+    """
+    Name of the file holding per-shell genotype counts for a filtered scan.
+    """
+
+    if output_format == "csv":
+        return f"{os.path.splitext(output_file)[0]}_shells.csv"
+    
+    return os.path.join(output_file,"shells.csv")
 
 def exhaustive(gc,
                max_depth=1,
                output_file="exhaustive.csv",
-               return_output=False):
+               return_output=False,
+               batch_size=100000,
+               output_format="csv",
+               num_workers=None,
+               keep_top_k=None,
+               min_fitness=None,
+               min_relative_fitness=None):
     """
     Perform a deep mutational scan up to max_depth mutations away from wildtype. 
     
@@ -33,76 +194,244 @@ def exhaustive(gc,
         very large as the number of sites and number of possible mutations 
         increase. 
     output_file : str, default="exhaustive.csv"
-        write results to the indicated csv file
+        write results to the indicated csv file (or directory if output_format
+        is "npz"). If None, do not write output. 
     return_output : bool, default=False
         return the resulting dataframe. if not, return None. The output dataframe
         can be huge; we recommend using False in most circumstances, then 
-        reading the dataframe in later. 
+        reading the dataframe in later (see eee.io.read_exhaustive). 
+    batch_size : int, default=100000
+        number of genotypes to score and write at once. Peak memory scales
+        with batch_size rather than the total number of genotypes. 
+    output_format : str, default="csv"
+        "csv" appends each batch to output_file. "npz" writes each batch as a
+        compressed, columnar numpy block in the directory output_file. 
+    num_workers : int, optional
+        score genotypes in this many worker processes. Site combinations are
+        split into shards of about batch_size genotypes, scored in parallel,
+        and written in order, so the output (and genotype numbering) is 
+        identical to a scan without workers. If None, score genotypes in this
+        process. 
+    keep_top_k : int, optional
+        only keep the keep_top_k genotypes with the highest fitness (ties go
+        to the lower genotype number). Kept genotypes are written in scan
+        order after the scan finishes. 
+    min_fitness : float, optional
+        only keep genotypes with fitness >= min_fitness
+    min_relative_fitness : float, optional
+        only keep genotypes with fitness >= min_relative_fitness times the 
+        fitness of wildtype
     
     Returns
     -------
     out_df : pandas.DataFrame or None
         dataframe holding the mutations that occurred, their energies and 
-        fitness. if return_output == False, return None.
+        fitness. if return_output == False, return None. Genotypes keep their
+        scan numbering when filtered. 
+
+    Notes
+    -----
+    Genotypes are generated lazily and scored in batches, so peak memory is
+    set by batch_size rather than the size of the scan. The mutation ids for 
+    every combination of sites are built as a single array. Mutation 
+    energies are the sum of the ddg rows for the mutations in each genotype,
+    starting from wildtype, and each batch is scored with one batched fitness
+    calculation. 
+
+    The scan always starts from wildtype and numbers genotypes in scan order
+    (wildtype is genotype 0). Unlike earlier versions, genotypes already held
+    in gc (i.e. from a simulation) are not written to the output and do not 
+    shift the numbering; a warning is issued if gc holds any. Write gc.df 
+    separately if they are needed. 
+
+    If keep_top_k, min_fitness or min_relative_fitness are set, genotypes are
+    filtered as they are scored. The number of genotypes in each shell 
+    (num_mutations), the number passing the fitness thresholds, and the 
+    number kept are written to {output_file root}_shells.csv (csv) or 
+    shells.csv in the output directory (npz). 
     """
 
     if not issubclass(type(gc),Genotype):
         err = "\ngc must be of type Genotype\n\n"
         raise ValueError(err)
 
-    # Operate on a copy of gc. We're about to generate a bunch of mutants
-    gc = copy.deepcopy(gc)
-
     max_depth = check_int(value=max_depth,
                           variable_name="max_depth",
                           minimum_allowed=0)
 
     return_output = check_bool(value=return_output,
                                variable_name="return_output")
+    
+    batch_size = check_int(value=batch_size,
+                           variable_name="batch_size",
+                           minimum_allowed=1)
+    
+    if num_workers is not None:
+        num_workers = check_int(value=num_workers,
+                                variable_name="num_workers",
+                                minimum_allowed=1)
+
+    if keep_top_k is not None:
+        keep_top_k = check_int(value=keep_top_k,
+                               variable_name="keep_top_k",
+                               minimum_allowed=1)
+    
+    if min_fitness is not None:
+        min_fitness = check_float(value=min_fitness,
+                                  variable_name="min_fitness")
 
-        # Get sites to mutate
-    all_sites = list(gc.ddg_dict.keys())
+    if min_relative_fitness is not None:
+        min_relative_fitness = check_float(value=min_relative_fitness,
+                                           variable_name="min_relative_fitness")
+        
+    filtered = (keep_top_k is not None or 
+                min_fitness is not None or 
+                min_relative_fitness is not None)
+
+    if output_format not in ["csv","npz"]:
+        err = f"\noutput_format '{output_format}' not recognized. Should be\n"
+        err += "'csv' or 'npz'\n\n"
+        raise ValueError(err)
+
+    # Remove existing output 
+    if output_file is not None:
+        output_file = f"{output_file}"
+        if output_format == "csv":
+            if os.path.isfile(output_file):
+                os.remove(output_file)
+        else:
+            to_remove = glob.glob(os.path.join(output_file,"block_*.npz"))
+            to_remove.append(os.path.join(output_file,"metadata.npz"))
+            for f in to_remove:
+                if os.path.isfile(f):
+                    os.remove(f)
+        
+        shells_file = _get_shells_file(output_file,output_format)
+        if os.path.isfile(shells_file):
+            os.remove(shells_file)
+
+    if len(gc.genotypes) > 1:
+        w = f"\n\ngc holds {len(gc.genotypes) - 1} genotype(s) besides wildtype. These are\n"
+        w += "not included in the exhaustive output, which starts from wildtype.\n\n"
+        warnings.warn(w)
 
     num_genotypes_per_shell = get_num_genotypes(gc.ddg_dict,max_depth=max_depth)
-    total_calcs = np.sum(num_genotypes_per_shell) - 1
+    total_calcs = np.sum(num_genotypes_per_shell)
 
-    # Store indexes of previous backgrounds in which to do mutations
-    existing_genotype_dict = {tuple([]):0}
+    site_ids = gc.site_mutation_ids
+    width = max(min(max_depth,len(site_ids)),1)
 
-    pbar = tqdm(total=total_calcs)
+    # Fitness threshold for each genotype
+    threshold = -np.inf
+    if min_fitness is not None:
+        threshold = max(threshold,min_fitness)
+    if min_relative_fitness is not None:
+        wt_mutations = -np.ones((1,width),dtype=np.int64)
+        wt_fitness = _score_batch(gc,wt_mutations)[1][0]
+        threshold = max(threshold,min_relative_fitness*wt_fitness)
 
-    with pbar:
+    num_shells = len(num_genotypes_per_shell)
+    num_passed = np.zeros(num_shells,dtype=np.int64)
+    num_kept = np.zeros(num_shells,dtype=np.int64)
+
+    dfs = []
+    counters = {"first_genotype":0,"block":0}
+    top = {"block":None}
+
+    def _write(block):
+        """
+        Write out (and/or store) a block of genotypes.
+        """
+
+        block["mutation_names"] = gc.ddg_mutations
+        block["species"] = list(gc._ens.species)
+
+        if output_file is not None:
+            if output_format == "csv":
+                append_exhaustive_csv(output_file,block)
+            else:
+                write_exhaustive_block(output_file,counters["block"],block)
+        
+        # Keep an empty dataframe only if nothing else is kept 
+        if return_output:
+            if len(block["genotype"]) > 0 or len(dfs) == 0:
+                dfs.append(exhaustive_block_to_df(block))
+            if len(dfs) > 1 and len(dfs[0]) == 0:
+                dfs.pop(0)
 
-        # Go over all mutation dimensionality from 1 to depth
-        for L in range(1,max_depth+1):
+        num_kept[:] += np.bincount(np.sum(block["mutations"] >= 0,axis=1),
+                                   minlength=num_shells)
+        counters["block"] += 1
 
-            # Create all possible combinations of sites with dimensionality L
-            for sites in itertools.combinations(all_sites,L):
+    def _record(mutations,energy,fitness):
+        """
+        Filter a scored batch of genotypes, then write it out or merge it into
+        the top genotypes. 
+        """
 
-                # Create all possible mutations at these sites
-                for mutations in itertools.product(*[gc.ddg_dict[i] for i in sites]):
+        first_genotype = counters["first_genotype"]
+        block = {"genotype":np.arange(first_genotype,
+                                      first_genotype + len(mutations),
+                                      dtype=np.int64),
+                 "mutations":mutations,
+                 "energy":energy,
+                 "fitness":fitness}
+        
+        if threshold > -np.inf:
+            keep = fitness >= threshold
+            block = {key:block[key][keep] for key in block}
 
-                    bg = existing_genotype_dict[mutations[:-1]]
-                    gc.mutate(bg,site=sites[-1],mutation=mutations[-1])
-                    existing_genotype_dict[mutations] = len(gc.genotypes) - 1
-                    
-                    pbar.update(n=1)
+        num_passed[:] += np.bincount(np.sum(block["mutations"] >= 0,axis=1),
+                                     minlength=num_shells)
 
-    df = gc.df
+        if keep_top_k is None:
+            _write(block)
+        else:
+            top["block"] = _merge_top_k(top["block"],block,keep_top_k)
+
+        counters["first_genotype"] += len(mutations)
+
+        pbar.update(n=len(mutations))
     
-    # Drop extra columns that really only matter for evolutionary trajectories
-    all_columns = set(df.columns)
-    to_drop = set(["accum_mut","num_accum_mut","parent","trajectory"])
-    to_drop = list(to_drop.intersection(all_columns))
-    df = df.drop(columns=to_drop)
+    pbar = tqdm(total=total_calcs)
+    with pbar:
+
+        if num_workers is None:
+
+            combos = _iter_site_combinations(len(site_ids),max_depth)
+            for mutations in _iter_mutation_batches(site_ids,combos,width,batch_size):
+                energy, fitness = _score_batch(gc,mutations)
+                _record(mutations,energy,fitness)
+
+        else:
+
+            # Keep a bounded number of shards in flight and record results
+            # in submission order. 
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     initializer=_init_worker,
+                                     initargs=(gc,site_ids,width)) as executor:
+                
+                pending = collections.deque()
+                for shard, num_genotypes in _iter_shards(site_ids,max_depth,batch_size):
+                    pending.append(executor.submit(_score_shard,shard,num_genotypes))
+                    if len(pending) >= 2*num_workers:
+                        _record(*pending.popleft().result())
+                
+                while len(pending) > 0:
+                    _record(*pending.popleft().result())
+
+    if keep_top_k is not None:
+        _write(top["block"])
 
-    if not output_file is None:
-        print("Writing output",flush=True)
-        df.to_csv(output_file)
+    if filtered and output_file is not None:
+        shells = pd.DataFrame({"num_mutations":np.arange(num_shells),
+                               "num_genotypes":num_genotypes_per_shell,
+                               "num_passed":num_passed,
+                               "num_kept":num_kept})
+        shells.to_csv(shells_file,index=False)
 
     out = None
     if return_output:
-        out = df
+        out = pd.concat(dfs,ignore_index=True)
 
     return out
-    
\ No newline at end of file
@@ -12,12 +12,34 @@ from eee._private.check.eee import check_mutation_rate
 from eee._private.check.eee import check_burn_in_generations
 from eee._private.check.eee import check_wf_population
 
+from eee._private.check.standard import check_int
+
 import numpy as np
 from tqdm.auto import tqdm
 import ete3
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
 import pickle
 
+def _get_num_mutations(branch_length,
+                       sequence_length,
+                       num_mutations_start):
+    """
+    Get the number of accumulated mutations at which to stop simulating along
+    a branch: the start + the branch length times the sequence length, with at
+    least one mutation on the branch. 
+    """
+
+    num_mutations = int(np.round(branch_length*sequence_length,0))
+    num_mutations = num_mutations + num_mutations_start
+    if num_mutations == 0:
+        num_mutations = 1
+
+    return num_mutations
+
+
 def _simulate_branch(start_node,
                      end_node,
                      gc,
@@ -34,25 +56,17 @@ def _simulate_branch(start_node,
     
     starting_pop = start_node.population
 
-    # Get number of mutations to accumulate based on the branch length times 
-    # the sequence length
-    branch_length = start_node.get_distance(end_node)
-    sequence_length = len(gc.wt_sequence)
-    num_mutations = int(np.round(branch_length*sequence_length,0))
-
     # Get the number of mutations at the starting node. The number to accumulate
-    # over the branch is the start + the branch length. (This is the total number
-    # of mutations that have accumulated, including reversions and multiple 
-    # mutations at the same site). 
+    # over the branch is the start + the branch length times the sequence 
+    # length. (This is the total number of mutations that have accumulated, 
+    # including reversions and multiple mutations at the same site). 
     num_mutations_start = get_num_accumulated_mutations(seen=list(starting_pop.keys()),
                                                         counts=list(starting_pop.values()),
                                                         gc=gc)
     
-    num_mutations = num_mutations + num_mutations_start
-
-    # Force at least one mutation to occur on the branch
-    if num_mutations == 0:
-        num_mutations = 1
+    num_mutations = _get_num_mutations(branch_length=start_node.get_distance(end_node),
+                                       sequence_length=len(gc.wt_sequence),
+                                       num_mutations_start=num_mutations_start)
     
     gc, generations = wright_fisher(gc,
                                     population=starting_pop,
@@ -71,6 +85,215 @@ def _simulate_branch(start_node,
     end_node.add_feature("population",generations[-1])
 
 
+def _simulate_branch_worker(gc,
+                            population,
+                            branch_length,
+                            mutation_rate,
+                            num_generations,
+                            seed_sequence):
+    """
+    Simulate evolution along one branch in a worker process. gc is a Genotype
+    object holding only the genotypes in the starting population (see
+    Genotype._fork). population is the starting population, keyed by genotype
+    index in gc. The branch gets its own random number stream from 
+    seed_sequence. 
+
+    Returns a dictionary describing the genotypes created on the branch (in 
+    local indexes; genotypes 0 through num_start - 1 are the starting 
+    genotypes), the generations (local indexes), and an export of the 
+    genotypes in the final population (to start child branches). 
+    """
+
+    rng = np.random.Generator(np.random.PCG64(seed_sequence))
+    gc._choice_function = rng.choice
+    num_start = gc._store.num_ids
+
+    num_mutations_start = get_num_accumulated_mutations(seen=list(population.keys()),
+                                                        counts=list(population.values()),
+                                                        gc=gc)
+    num_mutations = _get_num_mutations(branch_length=branch_length,
+                                       sequence_length=len(gc.wt_sequence),
+                                       num_mutations_start=num_mutations_start)
+
+    gc, generations = wright_fisher(gc,
+                                    population=population,
+                                    mutation_rate=mutation_rate,
+                                    num_generations=num_generations,
+                                    num_mutations=num_mutations,
+                                    verbose=False,
+                                    write_prefix=None,
+                                    rng=rng)
+    
+    store = gc._store
+    new_ids = np.arange(num_start,store.num_ids)
+    new_rows = store.get_rows(new_ids)
+    
+    end_ids = np.array(sorted(generations[-1].keys()),dtype=np.int64)
+
+    result = {"num_start":num_start,
+              "parent":store.get_parent(new_ids).copy(),
+              "step":[store.step_names[c] for c in store.get_step(new_ids)],
+              "mutations":[store.mutations[r] for r in new_rows],
+              "energy":store.energy[new_rows].copy(),
+              "fitness":store.fitness[new_rows].copy(),
+              "generations":generations,
+              "end_ids":end_ids,
+              "end_genotypes":gc._export(end_ids)}
+    
+    return result
+
+
+def _merge_branch(gc,
+                  result,
+                  start_ids):
+    """
+    Add the genotypes created on a branch (result from 
+    _simulate_branch_worker) to gc. start_ids are the indexes in gc of the 
+    branch's starting genotypes. New genotypes get the next block of indexes 
+    in gc, in the order they were created on the branch. Returns an array
+    mapping local branch indexes to indexes in gc.
+    """
+
+    num_start = result["num_start"]
+    num_new = len(result["fitness"])
+
+    global_ids = np.zeros(num_start + num_new,dtype=np.int64)
+    global_ids[:num_start] = start_ids
+    for i in range(num_new):
+        global_ids[num_start + i] = gc._add_genotype(prev_index=global_ids[result["parent"][i]],
+                                                     mutations=result["mutations"][i],
+                                                     mut_energy=result["energy"][i],
+                                                     step_name=result["step"][i],
+                                                     fitness=result["fitness"][i])
+
+    return global_ids
+
+
+def _follow_tree_parallel(gc,
+                          tree,
+                          branches,
+                          mutation_rate,
+                          num_generations,
+                          write_prefix,
+                          gc_filename,
+                          num_workers,
+                          rng,
+                          pbar):
+    """
+    Simulate all branches in a tree, running independent branches in parallel.
+    The branch into a node is dispatched to a worker process as soon as the 
+    branch leading to its parent node finishes. Each branch gets its own 
+    random number stream, spawned from rng in branch order, so results do not
+    depend on num_workers or the order in which branches finish. Branch 
+    results are merged into gc (assigning genotype indexes) in branch order. 
+    """
+
+    num_branches = len(branches)
+    seed_sequences = np.random.SeedSequence(int(rng.integers(2**63))).spawn(num_branches)
+
+    # Branches that start at each node
+    children = {}
+    for i, (start_node, _) in enumerate(branches):
+        children.setdefault(start_node,[]).append(i)
+
+    # Root population (burn in). Branch results are stored in local indexes; 
+    # source[i] is the branch (or -1 for gc itself) whose local indexes the
+    # starting population of branch i refers to.
+    root = tree.get_tree_root()
+    root_ids = np.array(sorted(root.population.keys()),dtype=np.int64)
+    root_genotypes = gc._export(root_ids)
+    root_population = dict([(i,root.population[g]) for i, g in enumerate(root_ids)])
+    
+    source = {}
+    start_local_ids = {}
+    results = {}
+    global_ids = {-1:np.arange(gc._store.num_ids,dtype=np.int64)}
+
+    def _get_start_genotypes(first_unmerged):
+        """
+        Genotypes in gc at the start of branches that have not been merged. 
+        These stay in gc so merged genotypes can point to their parents. 
+        """
+
+        keep = set()
+        for j in range(first_unmerged,num_branches):
+            population = getattr(branches[j][0],"population",None)
+            if population is not None:
+                keep.update(population.keys())
+        
+        return sorted(keep)
+
+    gc.dump_to_csv(filename=gc_filename,keep_genotypes=_get_start_genotypes(0))
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+
+        pending = {}
+        def _dispatch(branch_index,genotypes,population,source_branch,local_ids):
+
+            start_node, end_node = branches[branch_index]
+            source[branch_index] = source_branch
+            start_local_ids[branch_index] = local_ids
+
+            f = executor.submit(_simulate_branch_worker,
+                                gc=gc._fork(genotypes),
+                                population=population,
+                                branch_length=start_node.get_distance(end_node),
+                                mutation_rate=mutation_rate,
+                                num_generations=num_generations,
+                                seed_sequence=seed_sequences[branch_index])
+            pending[f] = branch_index
+
+        for i in children.get(root,[]):
+            _dispatch(i,root_genotypes,root_population,-1,root_ids)
+
+        next_to_merge = 0
+        while next_to_merge < num_branches:
+
+            done, _ = wait(pending,return_when=FIRST_COMPLETED)
+            for f in done:
+                i = pending.pop(f)
+                result = f.result()
+                results[i] = result
+                
+                # Start branches from the end of this one 
+                end_node = branches[i][1]
+                end_population = result["generations"][-1]
+                population = dict([(j,end_population[k])
+                                   for j, k in enumerate(result["end_ids"])])
+                for c in children.get(end_node,[]):
+                    _dispatch(c,result["end_genotypes"],population,i,result["end_ids"])
+
+            # Merge finished branches into gc in branch order
+            while next_to_merge in results:
+
+                i = next_to_merge
+                result = results.pop(i)
+                start_node, end_node = branches[i]
+
+                start_ids = global_ids[source[i]][start_local_ids[i]]
+                global_ids[i] = _merge_branch(gc=gc,
+                                              result=result,
+                                              start_ids=start_ids)
+                
+                lookup = global_ids[i]
+                generations = [dict([(int(lookup[k]),v) for k, v in g.items()])
+                               for g in result["generations"]]
+                
+                pickle_name = f"{write_prefix}_{start_node.name}-{end_node.name}.pickle"
+                with open(pickle_name,"wb") as f:
+                    pickle.dump(generations,f)
+
+                end_node.add_feature("population",generations[-1])
+
+                gc.dump_to_csv(filename=gc_filename,
+                               keep_genotypes=_get_start_genotypes(next_to_merge + 1))
+
+                next_to_merge += 1
+                pbar.update(n=1)
+
+    return gc
+
+
 def follow_tree(gc,
                 tree,
                 population=1000,
@@ -78,6 +301,7 @@ def follow_tree(gc,
                 num_generations=100,
                 burn_in_generations=10,
                 write_prefix="eee_follow-tree",
+                num_workers=None,
                 rng=None):
     """
     Run a Wright-Fisher simulation following an evolutionary tree. 
@@ -113,6 +337,13 @@ def follow_tree(gc,
         ancestral population. Must be >= 0. 
     write_prefix : str
         write output files during the run with this prefix. 
+    num_workers : int, optional
+        if specified, simulate independent branches in parallel using this 
+        many processes. Each branch starts as soon as the branch leading to 
+        its parent node finishes and gets its own random number stream 
+        (spawned from rng), so results are the same for any num_workers. 
+        These streams differ from the single stream used when num_workers is
+        None (the default, which simulates branches one after another). 
     rng : numpy.random._generator.Generator, optional
         random number generator object to allow reproducible sims. If None, one
         is created locally. 
@@ -148,6 +379,11 @@ def follow_tree(gc,
         raise ValueError(err)
     write_prefix = f"{write_prefix}"
 
+    if num_workers is not None:
+        num_workers = check_int(value=num_workers,
+                                variable_name="num_workers",
+                                minimum_allowed=1)
+
     if rng is None:
         rng = np.random.Generator(np.random.PCG64())
 
@@ -202,55 +438,81 @@ def follow_tree(gc,
         gc.dump_to_csv(filename=gc_filename,
                        keep_genotypes=genotypes_to_keep)
 
-        for n in tree.traverse(strategy="levelorder"):
-            
-            if not n.is_leaf():
-
-                # Get descendants
-                left, right = n.get_children()
-
-                # Simulate evolution from n to left descendant. 
-                if left.name == "":
-                    left.name = anc_fmt_string.format(anc_counter)
-                    anc_counter += 1
-
-                _simulate_branch(start_node=n,
-                                 end_node=left,
-                                 gc=gc,
-                                 mutation_rate=mutation_rate,
-                                 num_generations=num_generations,
-                                 write_prefix=write_prefix,
-                                 rng=rng)
+        # Simulate independent branches in parallel. Name the nodes and list 
+        # the branches in the same order as the serial traversal below.
+        if num_workers is not None:
+
+            branches = []
+            for n in tree.traverse(strategy="levelorder"):
+                if not n.is_leaf():
+                    for child in n.get_children():
+                        if child.name == "":
+                            child.name = anc_fmt_string.format(anc_counter)
+                            anc_counter += 1
+                        branches.append((n,child))
+
+            gc = _follow_tree_parallel(gc=gc,
+                                       tree=tree,
+                                       branches=branches,
+                                       mutation_rate=mutation_rate,
+                                       num_generations=num_generations,
+                                       write_prefix=write_prefix,
+                                       gc_filename=gc_filename,
+                                       num_workers=num_workers,
+                                       rng=rng,
+                                       pbar=pbar)
+
+        else:
+
+            for n in tree.traverse(strategy="levelorder"):
+
+                if not n.is_leaf():
+
+                    # Get descendants
+                    left, right = n.get_children()
+
+                    # Simulate evolution from n to left descendant. 
+                    if left.name == "":
+                        left.name = anc_fmt_string.format(anc_counter)
+                        anc_counter += 1
+
+                    _simulate_branch(start_node=n,
+                                     end_node=left,
+                                     gc=gc,
+                                     mutation_rate=mutation_rate,
+                                     num_generations=num_generations,
+                                     write_prefix=write_prefix,
+                                     rng=rng)
                 
-                # Dump genotypes to file
-                genotypes_to_keep.extend(list(left.population.keys()))
-                genotypes_to_keep = list(set(genotypes_to_keep))
-                gc.dump_to_csv(filename=gc_filename,
-                               keep_genotypes=genotypes_to_keep)
-
-                pbar.update(n=1)
-
-                # Simulate evolution from n to right descendent. (implicitly updates
-                # gc and right node)
-                if right.name == "":
-                    right.name = anc_fmt_string.format(anc_counter)
-                    anc_counter += 1
-
-                _simulate_branch(start_node=n,
-                                 end_node=right,
-                                 gc=gc,
-                                 mutation_rate=mutation_rate,
-                                 num_generations=num_generations,
-                                 write_prefix=write_prefix,
-                                 rng=rng)
+                    # Dump genotypes to file
+                    genotypes_to_keep.extend(list(left.population.keys()))
+                    genotypes_to_keep = list(set(genotypes_to_keep))
+                    gc.dump_to_csv(filename=gc_filename,
+                                   keep_genotypes=genotypes_to_keep)
+
+                    pbar.update(n=1)
+
+                    # Simulate evolution from n to right descendent. (implicitly updates
+                    # gc and right node)
+                    if right.name == "":
+                        right.name = anc_fmt_string.format(anc_counter)
+                        anc_counter += 1
+
+                    _simulate_branch(start_node=n,
+                                     end_node=right,
+                                     gc=gc,
+                                     mutation_rate=mutation_rate,
+                                     num_generations=num_generations,
+                                     write_prefix=write_prefix,
+                                     rng=rng)
                 
-                # Dump genotypes to file
-                genotypes_to_keep.extend(list(right.population.keys()))
-                genotypes_to_keep = list(set(genotypes_to_keep))
-                gc.dump_to_csv(filename=gc_filename,
-                               keep_genotypes=genotypes_to_keep)
+                    # Dump genotypes to file
+                    genotypes_to_keep.extend(list(right.population.keys()))
+                    genotypes_to_keep = list(set(genotypes_to_keep))
+                    gc.dump_to_csv(filename=gc_filename,
+                                   keep_genotypes=genotypes_to_keep)
 
-                pbar.update(n=1)
+                    pbar.update(n=1)
                 
 
     # Write tree
@@ -9,74 +9,287 @@ from eee._private.check.standard import check_int
 from eee.analysis import get_num_genotypes
 
 import numpy as np
+import pandas as pd
 from tqdm.auto import tqdm
 
-def _traverse(current_genotype_idx,
-              max_depth,
-              current_depth,
-              visited_dict,
-              condition_fcn,
-              not_exhaustive_path,
-              gc,
-              pbar):
+import os
+
+def _find_paths(gc,
+                max_depth,
+                condition_fcn,
+                pbar,
+                index=0):
     """
-    Recursive function for exploring paths through sequence space. 
-    current_genotype_idx is the current genotype, max_depth is how far we can 
-    go, current_depth is the current distance from the start, visited_dict
-    is a dictionary of visited genotypes (used to prevent visiting the same
-    genotype by a different path), condition_fcn is a function that takes two
-    values and returns True or False based on the comparison of those values 
-    (_traverse uses the function as `condition_fcn(new_fitness,old_fitness)`),
-    gc is a Genotype object, and pbar is a status bar. 
+    Breadth-first search for paths through sequence space starting at 
+    genotype index in gc. 
+
+    Genotypes are keyed by their sorted tuple of mutation ids, so each 
+    genotype is visited (and its fitness calculated) once no matter how many
+    paths lead to it. Genotypes one mutation further away are scored together
+    in a single batch. A step from parent to child is accepted if 
+    condition_fcn(child_fitness,parent_fitness) is True; only genotypes 
+    reached by at least one accepted step are expanded. 
+
+    Returns a dictionary of per-node values (node 0 is the starting genotype;
+    nodes are in the order they were first seen): "mutations" (mutation ids 
+    in the order introduced along the first accepted path; None if not
+    accessible), "energy", "fitness", "parent" (first accepted parent; -1 if 
+    none), "step" (mutation id added from parent; -1 if none), and 
+    "accessible". Every step tried is recorded in "cand_parent", 
+    "cand_child", "cand_step" and "cand_accepted". The steps out of each 
+    expanded node are contiguous and in site, then mutation, order; 
+    "first_cand" and "num_cand" give where they start and how many there are. 
     """
-    
-    # We've reached the max depth; do not do anything
-    if current_depth >= max_depth:
-        return visited_dict
-    
-    # Consider all sites
-    for site in gc.ddg_dict:
-        
-        # Can't mutate same site we have already mutated
-        if site in gc.genotypes[current_genotype_idx].sites:
-            continue
-        
-        # All possible mutations at this site
-        for mutation in gc.ddg_dict[site]:
-            
-            # Construct mutant tuple and see if we've visited it before. 
-            new_genotype = gc.genotypes[current_genotype_idx].mutations[:]
-            new_genotype.append(mutation)
-            new_genotype.sort()
-            new_genotype = tuple(new_genotype)
-        
-            # Already tried this genotype
-            if new_genotype in visited_dict and not_exhaustive_path:
+
+    site_ids = gc.site_mutation_ids
+    site_of = {}
+    for i, ids in enumerate(site_ids):
+        for m in ids:
+            site_of[m] = i
+
+    row = gc._store.get_row(index)
+    start_mutations = tuple(gc._store.mutations[row])
+    start_key = tuple(sorted(start_mutations))
+    start_energy = gc._store.energy[row].copy()
+
+    keys = [start_key]
+    key_to_node = {start_key:0}
+    energy = [start_energy]
+    fitness = [gc._store.fitness[row]]
+    mutations = [start_mutations]
+    parent = [-1]
+    step = [-1]
+
+    cand_parent = []
+    cand_child = []
+    cand_step = []
+    cand_accepted = []
+    first_cand = {}
+
+    layer = [0]
+    for _ in range(max_depth):
+
+        # Enumerate every single-mutation step out of the current layer, 
+        # creating nodes for genotypes we have not seen. 
+        first_new = len(keys)
+        layer_start = len(cand_parent)
+        for p in layer:
+            first_cand[p] = len(cand_parent)
+            used_sites = set([site_of[m] for m in keys[p]])
+            for i, ids in enumerate(site_ids):
+                if i in used_sites:
+                    continue
+                for m in ids:
+                    child_key = tuple(sorted(keys[p] + (m,)))
+                    c = key_to_node.get(child_key)
+                    if c is None:
+                        c = len(keys)
+                        key_to_node[child_key] = c
+                        keys.append(child_key)
+                    cand_parent.append(p)
+                    cand_child.append(c)
+                    cand_step.append(m)
+
+        num_new = len(keys) - first_new
+        if num_new == 0:
+            break
+
+        # Score all new genotypes at once. Energies are summed over the added
+        # mutations in canonical (sorted) order. 
+        added = [[m for m in keys[c] if m not in start_key] 
+                 for c in range(first_new,len(keys))]
+        width = max([len(a) for a in added])
+        added_ids = -np.ones((num_new,width),dtype=np.int64)
+        for i, a in enumerate(added):
+            added_ids[i,:len(a)] = a
+        new_energy = gc.mut_energy_batch(added_ids) + start_energy
+        new_fitness = gc.fitness_batch(new_energy)
+
+        energy.extend(new_energy)
+        fitness.extend(new_fitness)
+        mutations.extend([None]*num_new)
+        parent.extend([-1]*num_new)
+        step.extend([-1]*num_new)
+
+        all_fitness = np.array(fitness)
+        layer_parent = np.array(cand_parent[layer_start:],dtype=np.int64)
+        layer_child = np.array(cand_child[layer_start:],dtype=np.int64)
+        accepted = condition_fcn(all_fitness[layer_child],all_fitness[layer_parent])
+        accepted = np.asarray(accepted,dtype=bool)
+        cand_accepted.extend(accepted.tolist())
+
+        # The first accepted step into a genotype defines its trajectory. 
+        for p, c, m in zip(layer_parent[accepted].tolist(),
+                           layer_child[accepted].tolist(),
+                           np.array(cand_step[layer_start:])[accepted].tolist()):
+            if parent[c] < 0:
+                parent[c] = p
+                step[c] = m
+                mutations[c] = mutations[p] + (m,)
+
+        layer = [c for c in range(first_new,len(keys)) if parent[c] >= 0]
+
+        pbar.update(num_new)
+
+        if len(layer) == 0:
+            break
+
+    num_cand = np.zeros(len(keys),dtype=np.int64)
+    first = np.zeros(len(keys),dtype=np.int64)
+    for p in first_cand:
+        first[p] = first_cand[p]
+    np.add.at(num_cand,np.array(cand_parent,dtype=np.int64),1)
+
+    out = {"mutations":mutations,
+           "energy":np.array(energy),
+           "fitness":np.array(fitness),
+           "parent":np.array(parent,dtype=np.int64),
+           "step":np.array(step,dtype=np.int64),
+           "accessible":np.array(parent,dtype=np.int64) >= 0,
+           "cand_parent":np.array(cand_parent,dtype=np.int64),
+           "cand_child":np.array(cand_child,dtype=np.int64),
+           "cand_step":np.array(cand_step,dtype=np.int64),
+           "cand_accepted":np.array(cand_accepted,dtype=bool),
+           "first_cand":first,
+           "num_cand":num_cand}
+    out["accessible"][0] = True
+
+    return out
+
+def _record_paths(gc,paths,find_all_paths,index=0):
+    """
+    Record one genotype in gc for every accepted path found by _find_paths, 
+    in depth-first order (each accepted step is followed before the next 
+    step out of its parent is tried). If find_all_paths is False, each 
+    genotype is only tried from the first parent that reaches it; later 
+    paths to it are ignored whether or not that first step was accepted. 
+    Energies are built up along each path and all fitness values are 
+    calculated in one batch. Returns gc. 
+    """
+
+    # Depth-first walk over the steps recorded by _find_paths. Each path 
+    # becomes a row with (parent row, step, energy); row -1 is the starting
+    # genotype. 
+    row_parent = []
+    row_step = []
+    row_energy = []
+    row_mutations = []
+
+    start_row = gc._store.get_row(index)
+    start_mutations = tuple(gc._store.mutations[start_row])
+    start_energy = gc._store.energy[start_row]
+
+    tried = set()
+    stack = [(0,-1,paths["first_cand"][0])]
+    while len(stack) > 0:
+
+        node, row, next_cand = stack.pop()
+
+        end_cand = paths["first_cand"][node] + paths["num_cand"][node]
+        while next_cand < end_cand:
+
+            c = paths["cand_child"][next_cand]
+            accepted = paths["cand_accepted"][next_cand]
+            m = paths["cand_step"][next_cand]
+            next_cand += 1
+
+            if not find_all_paths:
+                if c in tried:
+                    continue
+                tried.add(c)
+
+            if not accepted:
                 continue
-            
-            # Try to introduce the mutation
-            new_idx = gc.conditional_mutate(index=current_genotype_idx,
-                                            site=site,
-                                            mutation=mutation,
-                                            condition_fcn=condition_fcn)
-            # Mutation accepted
-            pbar.update(1)
-            if new_idx >= 0:
-                
-                 # Record that we visited
-                visited_dict[new_genotype] = True
-                visited_dict = _traverse(current_genotype_idx=new_idx,
-                                         max_depth=max_depth,
-                                         current_depth=current_depth+1,
-                                         visited_dict=visited_dict,
-                                         condition_fcn=condition_fcn,
-                                         not_exhaustive_path=not_exhaustive_path,
-                                         gc=gc,
-                                         pbar=pbar)
+
+            if row < 0:
+                energy = start_energy + gc.ddg_array[m]
+                mutations = start_mutations + (m,)
             else:
-                visited_dict[new_genotype] = False
+                energy = row_energy[row] + gc.ddg_array[m]
+                mutations = row_mutations[row] + (m,)
+
+            row_parent.append(row)
+            row_step.append(m)
+            row_energy.append(energy)
+            row_mutations.append(mutations)
+
+            # Come back to the rest of this node's steps after following the
+            # new genotype
+            stack.append((node,row,next_cand))
+            stack.append((c,len(row_parent) - 1,paths["first_cand"][c]))
+            break
 
-    return visited_dict
+    if len(row_parent) == 0:
+        return gc
+
+    row_fitness = gc.fitness_batch(np.array(row_energy))
+
+    row_index = []
+    for i in range(len(row_parent)):
+        if row_parent[i] < 0:
+            prev_index = index
+        else:
+            prev_index = row_index[row_parent[i]]
+        new_index = gc._add_genotype(prev_index=prev_index,
+                                     mutations=row_mutations[i],
+                                     mut_energy=row_energy[i],
+                                     step_name=gc.ddg_mutations[row_step[i]],
+                                     fitness=row_fitness[i])
+        row_index.append(new_index)
+
+    return gc
+
+def _record_genotypes(gc,paths,find_all_paths,index=0):
+    """
+    Record each accessible genotype found by _find_paths in gc once, with the
+    trajectory of the first accepted path that reached it. Returns gc, the 
+    number of accepted paths from the start to each recorded genotype (a 
+    dictionary keyed by genotype index), and a dataframe of accepted steps 
+    (parent and child genotype indexes). If find_all_paths is False, only the
+    first accepted step into each genotype is kept. 
+    """
+
+    # Record accessible genotypes in gc, parents first
+    node_to_index = np.zeros(len(paths["parent"]),dtype=np.int64)
+    node_to_index[0] = index
+    for node in np.flatnonzero(paths["accessible"])[1:]:
+        prev_index = node_to_index[paths["parent"][node]]
+        step_name = gc.ddg_mutations[paths["step"][node]]
+        node_to_index[node] = gc._add_genotype(prev_index=prev_index,
+                                               mutations=paths["mutations"][node],
+                                               mut_energy=paths["energy"][node],
+                                               step_name=step_name,
+                                               fitness=paths["fitness"][node])
+
+    # Accepted steps. If we are not finding all paths, only keep the step 
+    # that defines each genotype's trajectory. 
+    accepted = paths["cand_accepted"]
+    edge_parent = paths["cand_parent"][accepted]
+    edge_child = paths["cand_child"][accepted]
+    if not find_all_paths:
+        is_first = paths["parent"][edge_child] == edge_parent
+        is_first &= paths["step"][edge_child] == paths["cand_step"][accepted]
+        edge_parent = edge_parent[is_first]
+        edge_child = edge_child[is_first]
+
+    # Count paths. Edges are stored layer by layer, so every parent's count
+    # is complete before it is propagated. 
+    num_paths = np.zeros(len(paths["parent"]),dtype=np.int64)
+    num_paths[0] = 1
+    depth = np.array([0 if m is None else len(m) for m in paths["mutations"]],
+                     dtype=np.int64)
+    for d in np.unique(depth[edge_child]):
+        in_layer = depth[edge_child] == d
+        np.add.at(num_paths,edge_child[in_layer],num_paths[edge_parent[in_layer]])
+
+    accessible = np.flatnonzero(paths["accessible"])
+    num_paths = dict(zip(node_to_index[accessible].tolist(),
+                         num_paths[accessible].tolist()))
+
+    edges = pd.DataFrame({"parent":node_to_index[edge_parent],
+                          "child":node_to_index[edge_child]})
+
+    return gc, num_paths, edges
 
 
 def pathfinder(gc,
@@ -84,10 +297,10 @@ def pathfinder(gc,
                allow_neutral=True,
                find_all_paths=True,
                output_file="genotypes.csv",
+               unique_genotypes=False,
                return_output=False):
     """
-    Recursively explore paths through sequence space implied by mutations stored
-    in gc. 
+    Explore paths through sequence space implied by mutations stored in gc. 
     
     Parameters
     ----------
@@ -103,9 +316,23 @@ def pathfinder(gc,
         all allowed paths to a given genotype. If False, ignore new paths that
         visit the same genotype. 
     output_file : str, default="genotypes.csv"
-        return visited genotypes (with trajectory information) to this file
+        return visited genotypes (with trajectory information) to this file. 
+        If None, do not write output.
+    unique_genotypes : bool, default=False
+        record each accessible genotype once rather than once per accepted 
+        path (see Notes).
     return_output : bool, default=False
         return the dataframe describing the results. Otherwise, return None
+
+    Notes
+    -----
+    By default, every accepted path is recorded in gc as its own genotype 
+    entry, in depth-first order. If unique_genotypes is True, each accessible
+    genotype is recorded once, with the trajectory of the first accepted path
+    that reached it. The output then has a num_paths column with the number 
+    of accepted paths from wildtype to each genotype (1 for every genotype if
+    find_all_paths is False), and every accepted step is written as parent 
+    and child genotype indexes to {output_file root}_edges.csv.
     """
 
     if not issubclass(type(gc),Genotype):
@@ -123,7 +350,11 @@ def pathfinder(gc,
     find_all_paths = check_bool(value=find_all_paths,
                                 variable_name="find_all_paths")
     
-    output_file = f"{output_file}"
+    if output_file is not None:
+        output_file = f"{output_file}"
+
+    unique_genotypes = check_bool(value=unique_genotypes,
+                                  variable_name="unique_genotypes")
 
     return_output = check_bool(value=return_output,
                                variable_name="return_output")
@@ -147,27 +378,36 @@ def pathfinder(gc,
             print(f"Allowing only adaptive steps")
         print("\nNOTE: status bar gives the maximum time if all genotypes are accessible.",flush=True)
 
-        _ = _traverse(current_genotype_idx=0,
-                    max_depth=max_depth,
-                    current_depth=0,
-                    visited_dict={},
-                    condition_fcn=condition_fcn,
-                    not_exhaustive_path=(not find_all_paths),
-                    gc=gc,
-                    pbar=pbar)
+        paths = _find_paths(gc=gc,
+                            max_depth=max_depth,
+                            condition_fcn=condition_fcn,
+                            pbar=pbar)
         
         # Indicate we completed the calculation
         pbar.n = total_calcs
         pbar.refresh()
         
-    df = gc.df
+    edges = None
+    if unique_genotypes:
+        gc, num_paths, edges = _record_genotypes(gc=gc,
+                                                 paths=paths,
+                                                 find_all_paths=find_all_paths)
+        df = gc.df
+        df["num_paths"] = pd.array(df["genotype"].map(num_paths),dtype="Int64")
+    else:
+        gc = _record_paths(gc=gc,
+                           paths=paths,
+                           find_all_paths=find_all_paths)
+        df = gc.df
 
-    if not output_file is None:
+    if output_file is not None:
         print("Writing output",flush=True)
         df.to_csv(output_file)
+        if edges is not None:
+            edges.to_csv(f"{os.path.splitext(output_file)[0]}_edges.csv",index=False)
 
     out = None
     if return_output:
         out = df
 
-    return out
\ No newline at end of file
+    return out
@@ -0,0 +1,377 @@
+"""
+Criteria for stopping a Wright-Fisher simulation before it reaches
+num_generations.
+"""
+
+from eee._private.check.standard import check_float
+from eee._private.check.standard import check_int
+from eee._private.check.standard import check_bool
+
+import numpy as np
+
+from collections import deque
+import time
+import sys
+
+try:
+    import resource
+except ImportError: # pragma: no cover
+    resource = None
+
+
+class StoppingCriterion:
+    """
+    Base class for stopping criteria. Must be sub-classed to be used.
+
+    Subclasses define check, which is called once per generation and returns
+    True when the simulation should stop. The arguments to check are computed
+    once per generation by wright_fisher and shared between all criteria:
+
+        + generation: current generation number
+        + genotypes: genotype indexes present in the population
+        + counts: number of individuals with each genotype
+        + fitness: absolute fitness of each genotype
+        + mean_fitness: mean fitness of the population
+
+    Subclasses that keep state between generations should clear it in reset,
+    which is called at the start of each new simulation. start is called each
+    time the generation loop starts (including when a simulation is resumed
+    from a checkpoint).
+
+    When a criterion stops a simulation, wright_fisher records the generation
+    that met it in stopped_at (None if the criterion has not stopped the
+    current simulation).
+    """
+
+    name = None
+    stopped_at = None
+
+    def reset(self):
+        pass
+
+    def start(self):
+        pass
+
+    def check(self,generation,genotypes,counts,fitness,mean_fitness):
+        raise NotImplementedError
+
+    @property
+    def description(self):
+        return self.name
+
+
+class Fixation(StoppingCriterion):
+    """
+    Stop when the most frequent genotype reaches a fraction of the
+    population.
+    """
+
+    name = "fixation"
+
+    def __init__(self,threshold=1.0,exclude_initial=True):
+        """
+        Parameters
+        ----------
+        threshold : float, default=1.0
+            stop when the most frequent genotype makes up at least this
+            fraction of the population. Should be > 0 and <= 1.
+        exclude_initial : bool, default=True
+            ignore the genotype that was most frequent in the first generation
+            checked (i.e., wildtype), so the simulation stops when a *new*
+            genotype fixes.
+        """
+
+        self._threshold = check_float(value=threshold,
+                                      variable_name="threshold",
+                                      minimum_allowed=0,
+                                      maximum_allowed=1,
+                                      minimum_inclusive=False)
+        self._exclude_initial = check_bool(value=exclude_initial,
+                                           variable_name="exclude_initial")
+        self.reset()
+
+    def reset(self):
+        self._initial = None
+
+    def check(self,generation,genotypes,counts,fitness,mean_fitness):
+
+        # Running argmax -- no need to sort the population
+        idx = np.argmax(counts)
+        if self._exclude_initial:
+            if self._initial is None:
+                self._initial = genotypes[idx]
+            if genotypes[idx] == self._initial:
+                return False
+
+        return counts[idx] >= self._threshold*np.sum(counts)
+
+    @property
+    def description(self):
+        return f"a genotype reached {self._threshold} of the population"
+
+
+class FitnessPlateau(StoppingCriterion):
+    """
+    Stop when the mean fitness of the population has not changed over a
+    window of generations.
+    """
+
+    name = "fitness_plateau"
+
+    def __init__(self,window=1000,tolerance=1e-3):
+        """
+        Parameters
+        ----------
+        window : int, default=1000
+            number of generations to consider. Should be >= 2.
+        tolerance : float, default=1e-3
+            stop when the range (max - min) of mean fitness over the last
+            window generations is less than or equal to tolerance times the
+            current mean fitness. Should be >= 0.
+        """
+
+        self._window = check_int(value=window,
+                                 variable_name="window",
+                                 minimum_allowed=2)
+        self._tolerance = check_float(value=tolerance,
+                                      variable_name="tolerance",
+                                      minimum_allowed=0)
+        self.reset()
+
+    def reset(self):
+
+        # Monotonic queues of (generation, mean_fitness). The front of each
+        # queue is the max (or min) over the window, so the range can be
+        # updated in O(1) amortized time per generation.
+        self._max_queue = deque()
+        self._min_queue = deque()
+        self._num_seen = 0
+
+    def check(self,generation,genotypes,counts,fitness,mean_fitness):
+
+        while self._max_queue and self._max_queue[-1][1] <= mean_fitness:
+            self._max_queue.pop()
+        self._max_queue.append((generation,mean_fitness))
+
+        while self._min_queue and self._min_queue[-1][1] >= mean_fitness:
+            self._min_queue.pop()
+        self._min_queue.append((generation,mean_fitness))
+
+        # Drop values that have fallen out of the window
+        oldest = generation - self._window
+        while self._max_queue[0][0] <= oldest:
+            self._max_queue.popleft()
+        while self._min_queue[0][0] <= oldest:
+            self._min_queue.popleft()
+
+        self._num_seen += 1
+        if self._num_seen < self._window:
+            return False
+
+        spread = self._max_queue[0][1] - self._min_queue[0][1]
+
+        return spread <= self._tolerance*np.abs(mean_fitness)
+
+    @property
+    def description(self):
+        return f"mean fitness changed by <= {self._tolerance} over {self._window} generations"
+
+
+class TargetFitness(StoppingCriterion):
+    """
+    Stop when the mean fitness of the population reaches a target.
+    """
+
+    name = "target_fitness"
+
+    def __init__(self,target):
+        """
+        Parameters
+        ----------
+        target : float
+            stop when mean fitness is greater than or equal to target
+        """
+
+        self._target = check_float(value=target,
+                                   variable_name="target")
+
+    def check(self,generation,genotypes,counts,fitness,mean_fitness):
+        return mean_fitness >= self._target
+
+    @property
+    def description(self):
+        return f"mean fitness reached {self._target}"
+
+
+class WallClock(StoppingCriterion):
+    """
+    Stop after the simulation has run for a given amount of time. Time spent
+    before a checkpoint is saved with it, so a simulation resumed from a 
+    checkpoint stops after the same total run time. (Time spent after the 
+    last checkpoint of an interrupted run is not counted, as those 
+    generations are run again.)
+    """
+
+    name = "wall_clock"
+
+    def __init__(self,seconds):
+        """
+        Parameters
+        ----------
+        seconds : float
+            maximum run time in seconds. Should be > 0.
+        """
+
+        self._seconds = check_float(value=seconds,
+                                    variable_name="seconds",
+                                    minimum_allowed=0,
+                                    minimum_inclusive=False)
+        self.reset()
+
+    def reset(self):
+        self._elapsed = 0.0
+        self.start()
+
+    def start(self):
+        self._start_time = time.monotonic()
+
+    def _get_elapsed(self):
+        return self._elapsed + time.monotonic() - self._start_time
+
+    def check(self,generation,genotypes,counts,fitness,mean_fitness):
+        return self._get_elapsed() >= self._seconds
+
+    def __getstate__(self):
+
+        # Save the time elapsed so far rather than the (process-specific) 
+        # monotonic start time
+        state = self.__dict__.copy()
+        state["_elapsed"] = self._get_elapsed()
+        state.pop("_start_time")
+
+        return state
+
+    def __setstate__(self,state):
+
+        self.__dict__.update(state)
+        self.start()
+
+    @property
+    def description(self):
+        return f"ran for {self._seconds} seconds"
+
+
+def _get_peak_memory():
+    """
+    Peak resident set size of this process in bytes.
+    """
+
+    # ru_maxrss is in bytes on macOS and kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+
+    return peak*1024
+
+
+class MemoryBudget(StoppingCriterion):
+    """
+    Stop when the peak memory used by the process (resident set size)
+    exceeds a budget. Only available on platforms with the resource module.
+    """
+
+    name = "memory"
+
+    def __init__(self,max_memory):
+        """
+        Parameters
+        ----------
+        max_memory : float
+            maximum memory in bytes. Should be > 0.
+        """
+
+        if resource is None: # pragma: no cover
+            err = "\nmemory stopping criterion is not available on this platform\n\n"
+            raise ValueError(err)
+
+        self._max_memory = check_float(value=max_memory,
+                                       variable_name="max_memory",
+                                       minimum_allowed=0,
+                                       minimum_inclusive=False)
+
+    def check(self,generation,genotypes,counts,fitness,mean_fitness):
+        return _get_peak_memory() >= self._max_memory
+
+    @property
+    def description(self):
+        return f"memory use reached {self._max_memory} bytes"
+
+
+STOPPING_CRITERIA = {"fixation":Fixation,
+                     "fitness_plateau":FitnessPlateau,
+                     "target_fitness":TargetFitness,
+                     "wall_clock":WallClock,
+                     "memory":MemoryBudget}
+
+
+def build_stopping_criteria(stopping_criteria):
+    """
+    Build a list of stopping criteria.
+
+    Parameters
+    ----------
+    stopping_criteria : dict or list
+        either a dictionary keying criterion names ("fixation",
+        "fitness_plateau", "target_fitness", "wall_clock", "memory") to
+        dictionaries of keyword arguments for the criterion or a list of
+        StoppingCriterion instances.
+
+    Returns
+    -------
+    criteria : list
+        list of StoppingCriterion instances
+    """
+
+    if issubclass(type(stopping_criteria),StoppingCriterion):
+        stopping_criteria = [stopping_criteria]
+
+    if issubclass(type(stopping_criteria),dict):
+
+        criteria = []
+        for k in stopping_criteria:
+
+            if k not in STOPPING_CRITERIA:
+                err = f"\nstopping criterion '{k}' not recognized. Should be one of:\n"
+                for c in STOPPING_CRITERIA:
+                    err += f"    {c}\n"
+                err += "\n"
+                raise ValueError(err)
+
+            kwargs = stopping_criteria[k]
+            if kwargs is None:
+                kwargs = {}
+            if not issubclass(type(kwargs),dict):
+                err = f"\nstopping criterion '{k}' should map to a dictionary of\n"
+                err += "keyword arguments\n\n"
+                raise ValueError(err)
+
+            try:
+                criteria.append(STOPPING_CRITERIA[k](**kwargs))
+            except TypeError as e:
+                err = f"\nbad keyword arguments for stopping criterion '{k}'\n\n"
+                raise ValueError(err) from e
+
+        return criteria
+
+    if hasattr(stopping_criteria,"__iter__") and not issubclass(type(stopping_criteria),str):
+        criteria = list(stopping_criteria)
+        for c in criteria:
+            if not issubclass(type(c),StoppingCriterion):
+                err = "\nstopping_criteria list entries should be StoppingCriterion\n"
+                err += "instances\n\n"
+                raise ValueError(err)
+        return criteria
+
+    err = "\nstopping_criteria should be a dictionary or a list of StoppingCriterion\n"
+    err += "instances\n\n"
+    raise ValueError(err)
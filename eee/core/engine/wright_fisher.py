@@ -10,7 +10,13 @@ from eee._private.check.eee import check_wf_population
 from eee._private.check.eee import check_num_generations
 from eee._private.check.eee import check_mutation_rate
 from eee._private.check.eee import check_num_mutations
+from eee._private.check.eee import check_step_mode
+from eee._private.check.eee import check_output_format
 from eee._private.check.standard import check_int
+from eee._private.check.standard import check_bool
+from eee.io.generations import write_generations
+from eee.io.background_writer import BackgroundWriter
+from eee.core.engine.stopping import build_stopping_criteria
 
 import numpy as np
 from tqdm.auto import tqdm
@@ -25,31 +31,67 @@ def write_wf_outputs(gc,
                      write_prefix,
                      write_counter,
                      num_write_digits,
-                     final_dump=False):
-    
+                     final_dump=False,
+                     output_format="pickle",
+                     first_generation=0,
+                     writer=None):
+    """
+    Write out the generations and genotypes accumulated since the last write.
+    Returns gc and the generations list, now holding only the last generation
+    (or nothing if final_dump is True). If writer (a BackgroundWriter) is 
+    specified, the files are written on the writer's thread. 
+    """
+
     if write_prefix is not None:
 
         if final_dump:
-            gen_to_write = [dict(zip(*g)) for g in generations]
+            gen_to_write = generations
             generations = []
             keep_genotypes = None
         else:
-            gen_to_write = [dict(zip(*g)) for g in generations[:-1]]
+            gen_to_write = generations[:-1]
             generations = [generations[-1]]
             keep_genotypes = generations[0][0]
 
-        gen_fmt_string = "{:s}_generations_{:0" + f"{num_write_digits:d}" + "d}.pickle"
+        gen_fmt_string = "{:s}_generations_{:0" + f"{num_write_digits:d}" + "d}." + output_format
         gen_out_file = gen_fmt_string.format(write_prefix,write_counter)
-        with open(gen_out_file,'wb') as f:
-            pickle.dump(gen_to_write,f)
+        if output_format == "npz":
+            write_fcn = write_generations
+        else:
+            write_fcn = _write_generations_pickle
+
+        # Generations are (seen,counts) arrays that are never modified after
+        # they are created, so they can be handed to the writer as is. 
+        if writer is None:
+            write_fcn(filename=gen_out_file,
+                      generations=gen_to_write,
+                      first_generation=first_generation)
+        else:
+            writer.submit(write_fcn,
+                          filename=gen_out_file,
+                          generations=gen_to_write,
+                          first_generation=first_generation)
         
         # Write out the genotypes
         gc_filename = f"{write_prefix}_genotypes.csv"
         gc.dump_to_csv(filename=gc_filename,
-                       keep_genotypes=keep_genotypes)
+                       keep_genotypes=keep_genotypes,
+                       writer=writer)
 
     return gc, generations
 
+def _write_generations_pickle(filename,
+                              generations,
+                              first_generation=0):
+    """
+    Write generations as a pickled list of {genotype:count} dictionaries. 
+    (first_generation is ignored; it is here to match write_generations.)
+    """
+
+    generations = [dict(zip(*g)) for g in generations]
+    with open(filename,'wb') as f:
+        pickle.dump(generations,f)
+
 def get_num_accumulated_mutations(gc,
                                   seen,
                                   counts):
@@ -58,14 +100,109 @@ def get_num_accumulated_mutations(gc,
     mutations at the same site) for the most frequent genotype in the population.
     """
 
-    to_sort = list(zip(counts,seen))
-    to_sort.sort()
-    genotype = to_sort[-1][1]
-    num_mutations = len(gc.genotypes[genotype].mutations_accumulated)
+    # Running argmax rather than a sort. Ties go to the highest genotype 
+    # index. 
+    seen = np.asarray(seen)
+    counts = np.asarray(counts)
+    genotype = np.max(seen[counts == np.max(counts)])
+    num_mutations = int(gc.get_num_accumulated([genotype])[0])
 
     return num_mutations
 
 
+def _individual_step(gc,
+                     current_genotypes,
+                     prob,
+                     population_size,
+                     expected_num_mutations,
+                     rng):
+    """
+    Advance one generation by sampling every individual in the population. 
+    Cost scales with the population size. Returns the genotypes and counts
+    in the new generation. 
+    """
+
+    # Select offspring, with replacement weighted by prob
+    population = rng.choice(current_genotypes,
+                            size=population_size,
+                            p=prob,
+                            replace=True)
+    
+    # Introduce mutations
+    num_to_mutate = rng.poisson(expected_num_mutations)
+
+    # If we have a ridiculously high mutation rate, do not mutate each
+    # genotype more than once.
+    if num_to_mutate > population_size:
+        num_to_mutate = population_size
+
+    # Mutate first num_to_mutate population members, storing the new indexes
+    # in the population. 
+    population[:num_to_mutate] = gc.mutate_many(population[:num_to_mutate])
+
+    # Record populations
+    return np.unique(population,return_counts=True)
+
+
+def _multinomial_step(gc,
+                      current_genotypes,
+                      prob,
+                      population_size,
+                      expected_num_mutations,
+                      rng):
+    """
+    Advance one generation by drawing offspring counts for each distinct 
+    genotype from a multinomial distribution. Mutants are drawn by thinning 
+    those counts. Cost scales with the number of distinct genotypes rather 
+    than the population size. Returns the genotypes and counts in the new 
+    generation. 
+    """
+
+    # Offspring of each genotype
+    counts = rng.multinomial(population_size,prob)
+
+    # Same number of mutants as the individual step (poisson, capped at the 
+    # population size), spread over genotypes without replacement. 
+    num_to_mutate = rng.poisson(expected_num_mutations)
+    if num_to_mutate > population_size:
+        num_to_mutate = population_size
+
+    mutated = rng.multivariate_hypergeometric(counts,num_to_mutate)
+    counts = counts - mutated
+
+    # Generate one new mutant per mutated individual
+    parents = np.repeat(current_genotypes,mutated)
+    new_genotypes = gc.mutate_many(parents).astype(current_genotypes.dtype)
+
+    # Merge surviving parents and new mutants. (Mutants can land on an 
+    # existing genotype if gc collapses recurrent mutants.)
+    keep = counts > 0
+    genotypes = np.concatenate((current_genotypes[keep],new_genotypes))
+    counts = np.concatenate((counts[keep],np.ones(len(new_genotypes),dtype=int)))
+
+    seen, inverse = np.unique(genotypes,return_inverse=True)
+    counts = np.bincount(inverse,weights=counts).astype(int)
+
+    return seen, counts
+
+
+def _get_step_function(step_mode):
+    """
+    Get the function used to advance one generation for step_mode.
+    """
+
+    step_functions = {"individual":_individual_step,
+                      "multinomial":_multinomial_step}
+    if step_mode not in step_functions:
+        err = f"\nstep_mode '{step_mode}' not recognized. Should be one of:\n"
+        for k in step_functions:
+            err += f"    {k}\n"
+        err += "\n"
+        raise ValueError(err)
+    
+    return step_functions[step_mode]
+
+
 def wright_fisher(gc,
                   population,
                   mutation_rate,
@@ -74,6 +211,12 @@ def wright_fisher(gc,
                   verbose=True,
                   write_prefix=None,
                   write_frequency=1000,
+                  step_mode="individual",
+                  output_format="pickle",
+                  background_write=True,
+                  max_write_queue=2,
+                  checkpoint_frequency=None,
+                  stopping_criteria=None,
                   rng=None):
     """
     Run a Wright-Fisher simulation. This is a relatively low-level function. 
@@ -113,6 +256,45 @@ def wright_fisher(gc,
         consumption.
     write_frequency : int, default=1000
         write the generations out every write_frequency generations. 
+    step_mode : str, default="individual"
+        how to advance each generation. "individual" samples every member of
+        the population. "multinomial" samples offspring counts for each 
+        distinct genotype directly, so the cost of each generation scales
+        with the number of distinct genotypes rather than the population 
+        size. Use "multinomial" for very large populations. 
+    output_format : str, default="pickle"
+        format for the generations written out every write_frequency 
+        generations. "pickle" writes a list of {genotype:count} dictionaries.
+        "npz" writes compressed, columnar numpy blocks that can be sliced
+        without loading every generation (see eee.io.read_generations).
+    background_write : bool, default=True
+        write output files on a background thread so the simulation does not
+        wait on file I/O. Snapshots of the generations and genotypes are 
+        queued for writing; all writes finish before this function returns. 
+        If a write fails, the simulation stops and the error is raised. 
+    max_write_queue : int, default=2
+        maximum number of dumps waiting to be written when background_write
+        is True. If the writer falls this far behind, the simulation waits 
+        for it to catch up. 
+    checkpoint_frequency : int, optional
+        write a checkpoint ({write_prefix}_checkpoint.ckpt) holding the 
+        population, genotypes, random number generator state, and write 
+        counters at the first write after every checkpoint_frequency 
+        generations, as well as at the end of the simulation. The simulation
+        can be resumed (or extended) from the checkpoint with 
+        resume_wright_fisher. Requires write_prefix. If None, do not write
+        checkpoints. 
+    stopping_criteria : dict or list, optional
+        stop the simulation early when any of these criteria are met. Either a
+        dictionary keying criterion names to dictionaries of keyword arguments
+        (i.e. {"fixation":{"threshold":0.99},"fitness_plateau":{"window":500}})
+        or a list of StoppingCriterion instances. See 
+        eee.core.engine.stopping for the available criteria ("fixation", 
+        "fitness_plateau", "target_fitness", "wall_clock", and "memory"). 
+        Criteria are checked against every generation, including the last. If
+        a criterion stops the simulation, a warning is issued and the 
+        generation that met it is recorded in the criterion's stopped_at 
+        attribute (pass StoppingCriterion instances to read it).
     rng : numpy.random._generator.Generator, optional
         random number generator object to allow reproducible sims. If None, one
         is created locally. 
@@ -145,10 +327,29 @@ def wright_fisher(gc,
         write_frequency = check_int(value=write_frequency,
                                     variable_name=write_frequency,
                                     minimum_allowed=1)
+    background_write = check_bool(value=background_write,
+                                  variable_name="background_write")
+    max_write_queue = check_int(value=max_write_queue,
+                                variable_name="max_write_queue",
+                                minimum_allowed=1)
+    if checkpoint_frequency is not None:
+        checkpoint_frequency = check_int(value=checkpoint_frequency,
+                                         variable_name="checkpoint_frequency",
+                                         minimum_allowed=1)
+        if write_prefix is None:
+            err = "\ncheckpoint_frequency requires write_prefix\n\n"
+            raise ValueError(err)
+    criteria = []
+    if stopping_criteria is not None:
+        criteria = build_stopping_criteria(stopping_criteria)
+        for c in criteria:
+            c.reset()
     
-    in_gc = set(list(gc.genotypes.keys()))
-    in_pop = set(list(population))
-    if not in_pop.issubset(in_gc):
+    step_mode = check_step_mode(step_mode)
+    output_format = check_output_format(output_format)
+
+    not_in_gc = [g for g in set(list(population)) if g not in gc.genotypes]
+    if len(not_in_gc) > 0:
         err = f"\npopulation has genotype(s) that are not in the gc object\n\n"
         raise ValueError(err)
 
@@ -161,80 +362,354 @@ def wright_fisher(gc,
         err += "instance\n\n"
         raise ValueError(err)
 
-    # Get the mutation rate
-    expected_num_mutations = mutation_rate*population_size
-
     # Genotype populations
     seen, counts = np.unique(population,return_counts=True)
-    generations = [(seen,counts)]
-
-    # Turn off status bar if requested
-    if verbose:
-        pbar = tqdm(total=num_generations-1)
-    else:
-        pbar = MockContextManager(total=num_generations-1)
 
     # Remove existing files
     if write_prefix is not None:
         to_remove = glob.glob(f"{write_prefix}*.pickle")
+        to_remove.extend(glob.glob(f"{write_prefix}*.npz"))
         to_remove.extend(glob.glob(f"{write_prefix}*.csv"))
+        to_remove.extend(glob.glob(f"{write_prefix}*.ckpt"))
         for f in to_remove:
             os.remove(f)
+
+    # Set up to write files
+    num_write_digits = int(f"{num_generations/write_frequency:e}".split("e")[1]) + 1
+    if num_write_digits < 0:
+        num_write_digits = 1
+
+    settings = {"population_size":population_size,
+                "mutation_rate":mutation_rate,
+                "num_generations":num_generations,
+                "num_mutations":num_mutations,
+                "write_prefix":write_prefix,
+                "write_frequency":write_frequency,
+                "step_mode":step_mode,
+                "output_format":output_format,
+                "checkpoint_frequency":checkpoint_frequency,
+                "stopping_criteria":stopping_criteria}
+
+    state = {"gc":gc,
+             "generations":[(seen,counts)],
+             "next_generation":1,
+             "write_counter":0,
+             "num_write_digits":num_write_digits,
+             "last_checkpoint":0,
+             "stopping_criteria":criteria}
+
+    return _run_wright_fisher(state=state,
+                              settings=settings,
+                              verbose=verbose,
+                              background_write=background_write,
+                              max_write_queue=max_write_queue,
+                              rng=rng)
+
+
+def resume_wright_fisher(checkpoint_file,
+                         num_generations=None,
+                         expected_settings=None,
+                         verbose=True,
+                         background_write=True,
+                         max_write_queue=2,
+                         rng=None):
+    """
+    Resume a Wright-Fisher simulation from a checkpoint written by 
+    wright_fisher (with checkpoint_frequency set). This should be run from the
+    directory the original simulation was run in. Output files written after
+    the checkpoint are removed or truncated, so the resumed simulation writes 
+    exactly the same files as a simulation that was never interrupted. This
+    can also be used to extend a finished simulation: the checkpoint written
+    at the end of a run continues from the last generation. 
+
+    Parameters
+    ----------
+    checkpoint_file : str
+        checkpoint file to read ({write_prefix}_checkpoint.ckpt)
+    num_generations : int, optional
+        total number of generations (counting from the start of the original
+        simulation) to run. If None, use num_generations from the original 
+        simulation. Increase this to extend a finished simulation. 
+    expected_settings : dict, optional
+        settings the caller expects the checkpointed simulation to have, keyed
+        by wright_fisher settings name (i.e. "population_size", 
+        "mutation_rate", "write_frequency", "stopping_criteria") or 
+        "canonical_genotypes". Raise a ValueError if any differ from the 
+        checkpoint. The simulation always continues with the checkpointed 
+        settings. 
+    verbose : bool, default=True
+        whether to print outputs and status bars
+    background_write : bool, default=True
+        write output files on a background thread
+    max_write_queue : int, default=2
+        maximum number of dumps waiting to be written when background_write
+        is True
+    rng : numpy.random._generator.Generator, optional
+        random number generator object. Its bit generator is set to the state
+        recorded in the checkpoint. If None, use the generator recorded in the
+        checkpoint. 
+
+    Returns
+    -------
+    gc : GenotypeContainer
+        updated GenotypeContainer
+    generations : list
+        list of dicts holding generations that were not written out (empty, 
+        as all generations are written when the simulation finishes).
+    """
+
+    if not os.path.isfile(checkpoint_file):
+        err = f"\ncheckpoint_file '{checkpoint_file}' does not exist\n\n"
+        raise FileNotFoundError(err)
+
+    with open(checkpoint_file,"rb") as f:
+        checkpoint = pickle.load(f)
+    state = pickle.loads(checkpoint["state"])
+    settings = state.pop("settings")
+
+    # Make sure the caller is not expecting settings other than the ones the
+    # simulation is actually going to use
+    if expected_settings is not None:
+
+        current = dict(settings)
+        current["canonical_genotypes"] = state["gc"].canonical_genotypes
+
+        unknown = [k for k in expected_settings if k not in current]
+        if len(unknown) > 0:
+            err = "\nThe following expected_settings are not recorded in the checkpoint:\n"
+            for k in unknown:
+                err += f"    {k}\n"
+            err += "\n"
+            raise ValueError(err)
+
+        different = [k for k in expected_settings
+                     if expected_settings[k] != current[k]]
+        if len(different) > 0:
+            err = "\nThe following settings differ from the ones in the checkpoint:\n"
+            for k in different:
+                err += f"    {k}: {expected_settings[k]} (checkpoint: {current[k]})\n"
+            err += "\nA simulation must be resumed with the settings it was started\n"
+            err += "with. Only num_generations can be changed.\n\n"
+            raise ValueError(err)
+
+    if num_generations is not None:
+        num_generations = check_num_generations(num_generations)
+        if num_generations < state["next_generation"]:
+            err = f"\nnum_generations ({num_generations}) is less than the number of\n"
+            err += f"generations already run ({state['next_generation']})\n\n"
+            raise ValueError(err)
+        settings["num_generations"] = num_generations
+
+    background_write = check_bool(value=background_write,
+                                  variable_name="background_write")
+    max_write_queue = check_int(value=max_write_queue,
+                                variable_name="max_write_queue",
+                                minimum_allowed=1)
+
+    # Restore the random number generator. If the gc drew mutations from the
+    # same generator, make sure it still does. 
+    saved_rng = state.pop("rng")
+    if rng is None:
+        rng = saved_rng
+    
+    if not issubclass(type(rng),np.random._generator.Generator):
+        err = "\nrng (random number generator) should be a np.random.Generator\n"
+        err += "instance\n\n"
+        raise ValueError(err)
+
+    rng.bit_generator.state = state.pop("rng_state")
+    gc = state["gc"]
+    if getattr(gc._choice_function,"__self__",None) is saved_rng:
+        gc._choice_function = rng.choice
+
+    # Remove anything written after the checkpoint
+    write_prefix = settings["write_prefix"]
+    gc_filename = f"{write_prefix}_genotypes.csv"
+    if os.path.isfile(gc_filename):
+        if checkpoint["csv_size"] > 0:
+            with open(gc_filename,"r+b") as f:
+                f.truncate(checkpoint["csv_size"])
+        else:
+            os.remove(gc_filename)
+    
+    gen_files = glob.glob(f"{write_prefix}_generations_*.{settings['output_format']}")
+    for gen_file in gen_files:
+        counter = os.path.splitext(gen_file)[0].split("_generations_")[-1]
+        if int(counter) >= state["write_counter"]:
+            os.remove(gen_file)
+
+    return _run_wright_fisher(state=state,
+                              settings=settings,
+                              verbose=verbose,
+                              background_write=background_write,
+                              max_write_queue=max_write_queue,
+                              rng=rng)
+
+
+def _write_checkpoint(filename,state,csv_filename):
+    """
+    Write a checkpoint (state pickled to bytes by the caller) along with the
+    current size of the genotypes csv file. This is run in order with the 
+    other write jobs, so the recorded size covers exactly the genotypes 
+    written before the checkpoint. The file is replaced atomically so a crash
+    mid-write never leaves a partial checkpoint. 
+    """
+
+    csv_size = 0
+    if os.path.isfile(csv_filename):
+        csv_size = os.path.getsize(csv_filename)
+
+    tmp_file = f"{filename}.tmp"
+    with open(tmp_file,"wb") as f:
+        pickle.dump({"csv_size":csv_size,"state":state},f)
+    os.replace(tmp_file,filename)
+
+
+def _run_wright_fisher(state,
+                       settings,
+                       verbose,
+                       background_write,
+                       max_write_queue,
+                       rng):
+    """
+    Run the Wright-Fisher generation loop starting from state (a dictionary 
+    holding the gc, the generations not yet written, the next generation to 
+    run, and the write and checkpoint counters). settings holds the validated
+    arguments to wright_fisher. 
+    """
+
+    gc = state["gc"]
+    generations = state["generations"]
+    write_counter = state["write_counter"]
+    num_write_digits = state["num_write_digits"]
+    last_checkpoint = state["last_checkpoint"]
+    next_generation = state["next_generation"]
+
+    population_size = settings["population_size"]
+    mutation_rate = settings["mutation_rate"]
+    num_generations = settings["num_generations"]
+    num_mutations = settings["num_mutations"]
+    write_prefix = settings["write_prefix"]
+    write_frequency = settings["write_frequency"]
+    output_format = settings["output_format"]
+    checkpoint_frequency = settings["checkpoint_frequency"]
+    stopping_criteria = state["stopping_criteria"]
+
+    step_function = _get_step_function(settings["step_mode"])
+
+    # Get the mutation rate
+    expected_num_mutations = mutation_rate*population_size
+
+    if write_prefix is not None:
+        gc_filename = f"{write_prefix}_genotypes.csv"
+        checkpoint_file = f"{write_prefix}_checkpoint.ckpt"
+
+    def _checkpoint(next_generation):
+        """
+        Snapshot the simulation so it can be resumed at next_generation. The
+        gc and rng are pickled together so a gc that draws from rng still 
+        shares it after loading. 
+        """
+
+        to_save = {"gc":gc,
+                   "generations":generations,
+                   "next_generation":next_generation,
+                   "write_counter":write_counter,
+                   "num_write_digits":num_write_digits,
+                   "last_checkpoint":last_checkpoint,
+                   "stopping_criteria":stopping_criteria,
+                   "rng":rng,
+                   "rng_state":rng.bit_generator.state,
+                   "settings":settings}
+        
+        writer.submit(_write_checkpoint,
+                      filename=checkpoint_file,
+                      state=pickle.dumps(to_save),
+                      csv_filename=gc_filename)
+        
+    def _check_stopping_criteria(generation,genotypes,counts,fitness):
+        """
+        Return the first stopping criterion met by a generation (None if no
+        criterion is met).
+        """
+
+        if len(stopping_criteria) == 0:
+            return None
+
+        mean_fitness = np.sum(fitness*counts)/np.sum(counts)
+        for c in stopping_criteria:
+            if c.check(generation=generation,
+                       genotypes=genotypes,
+                       counts=counts,
+                       fitness=fitness,
+                       mean_fitness=mean_fitness):
+                c.stopped_at = generation
+                return c
+
+        return None
+
+    # Turn off status bar if requested
+    if verbose:
+        pbar = tqdm(total=num_generations-1,initial=next_generation-1)
+    else:
+        pbar = MockContextManager(total=num_generations-1)
                          
+    # Write files on a background thread if requested
+    writer = BackgroundWriter(max_queue_size=max_write_queue,
+                              threaded=background_write and write_prefix is not None)
+
     # Run the simulation
-    with pbar:
+    with pbar, writer:
     
         hit_target_num_mutations = False
+        stopped_by = None
+        for c in stopping_criteria:
+            c.stopped_at = None
+            c.start()
 
-        # Set up to write files
-        write_counter = 0
-        num_write_digits = int(f"{num_generations/write_frequency:e}".split("e")[1]) + 1
-        if num_write_digits < 0:
-            num_write_digits = 1
+        if num_mutations is not None:
+            num_mutations_seen = get_num_accumulated_mutations(seen=generations[-1][0],
+                                                               counts=generations[-1][1],
+                                                               gc=gc)
 
         # For all num_generations (first is starting population)
-        for i in range(1,num_generations):
+        for i in range(next_generation,num_generations):
+
+            # Stop right away if a background write has failed
+            writer.check()
 
             # Get the probability of each genotype: its frequency times its 
             # relative fitness. Get the current genotypes and their counts from the
             # last generation recorded
             current_genotypes, counts = generations[-1]
-            prob = np.array([gc.fitnesses[g] for g in current_genotypes])
-            prob = prob*counts
+            fitness = gc.get_fitnesses(current_genotypes)
+            prob = fitness*counts
+
+            # Stop if any criterion is met by the current generation
+            stopped_by = _check_stopping_criteria(generation=i-1,
+                                                  genotypes=current_genotypes,
+                                                  counts=counts,
+                                                  fitness=fitness)
+            if stopped_by is not None:
+                break
             
             # If total prob is zero, give all equal weights. (edge case -- all 
             # genotypes equally terrible)
             if np.sum(prob) == 0:
-                prob = np.ones(population_size)
+                prob = np.ones(len(current_genotypes))
 
             # Calculate relative probability
             prob = prob/np.sum(prob)
 
-            # Select offspring, with replacement weighted by prob
-            population = rng.choice(current_genotypes,
-                                    size=population_size,
-                                    p=prob,
-                                    replace=True)
-            
-            # Introduce mutations
-            num_to_mutate = rng.poisson(expected_num_mutations)
-
-            # If we have a ridiculously high mutation rate, do not mutate each
-            # genotype more than once.
-            if num_to_mutate > population_size:
-                num_to_mutate = population_size
-
-            # Mutate first num_to_mutate population members
-            for j in range(num_to_mutate):
-
-                # Generate a new mutant with a new index, then store that new index
-                # in the population. 
-                new_index = gc.mutate(index=population[j])        
-                population[j] = new_index
-
-            # Record populations
-            seen, counts = np.unique(population,return_counts=True)
+            # Select offspring and introduce mutations
+            seen, counts = step_function(gc=gc,
+                                         current_genotypes=current_genotypes,
+                                         prob=prob,
+                                         population_size=population_size,
+                                         expected_num_mutations=expected_num_mutations,
+                                         rng=rng)
             generations.append((seen,counts))
+            next_generation = i + 1
             
             # If we are checking for number of mutations, check to see what the 
             # number of mutations is in the most frequent genotype. If that has 
@@ -259,23 +734,56 @@ def wright_fisher(gc,
                                                    write_prefix=write_prefix,
                                                    write_counter=write_counter,
                                                    num_write_digits=num_write_digits,
-                                                   final_dump=False)
+                                                   final_dump=False,
+                                                   output_format=output_format,
+                                                   first_generation=write_counter*write_frequency,
+                                                   writer=writer)
 
                 write_counter += 1
 
+                if checkpoint_frequency is not None:
+                    if i - last_checkpoint >= checkpoint_frequency:
+                        last_checkpoint = i
+                        _checkpoint(next_generation)
+
             pbar.update(n=1)
 
+        # Checkpoint before the final dump so the simulation can be extended
+        # from here. 
+        if checkpoint_frequency is not None:
+            _checkpoint(next_generation)
 
-    if write_prefix is not None:
-        gc, generations = write_wf_outputs(gc=gc,
-                                           generations=generations,
-                                           write_prefix=write_prefix,
-                                           write_counter=write_counter,
-                                           num_write_digits=num_write_digits,
-                                           final_dump=True)
+        # The loop checks each generation before drawing the next one, so the
+        # last generation drawn has not been checked yet. This is done after 
+        # the final checkpoint, as a simulation resumed from that checkpoint 
+        # checks it when it starts. 
+        if stopped_by is None and not hit_target_num_mutations:
+            current_genotypes, counts = generations[-1]
+            stopped_by = _check_stopping_criteria(generation=next_generation-1,
+                                                  genotypes=current_genotypes,
+                                                  counts=counts,
+                                                  fitness=gc.get_fitnesses(current_genotypes))
+
+        if write_prefix is not None:
+
+            gc, generations = write_wf_outputs(gc=gc,
+                                               generations=generations,
+                                               write_prefix=write_prefix,
+                                               write_counter=write_counter,
+                                               num_write_digits=num_write_digits,
+                                               final_dump=True,
+                                               output_format=output_format,
+                                               first_generation=write_counter*write_frequency,
+                                               writer=writer)
+
+    # Let the user know the simulation stopped early. The criterion records
+    # the generation at which it stopped the simulation in stopped_at. 
+    if stopped_by is not None:
+        w = f"\n\nStopped at generation {stopped_by.stopped_at}: {stopped_by.description}\n\n"
+        warnings.warn(w)
 
     # Warn if we did not get all of the requested mutations
-    if num_mutations is not None and not hit_target_num_mutations:
+    if num_mutations is not None and not hit_target_num_mutations and stopped_by is None:
                 
         w = f"\n\nDid not accumulate requested number of mutations after {num_generations}\n"
         w += f"generations. Accumulated {num_mutations_seen} of {num_mutations} requested.\n"
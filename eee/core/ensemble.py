@@ -13,6 +13,9 @@ from eee._private.check.eee import check_temperature
 import numpy as np
 import pandas as pd
 
+from collections import OrderedDict
+import hashlib
+
 class Ensemble:
     """
     Hold a thermodynamic ensemble with an arbitrary set of macromolecular
@@ -100,6 +103,10 @@ class Ensemble:
         # Used to avoid/minimize numerical errors in partition function 
         # calculation. 
         self._max_allowed = np.log(np.finfo('d').max)*0.01
+
+        # Least-recently-used cache of z-matrices keyed by chemical potentials
+        self._z_matrix_cache = OrderedDict()
+        self._z_matrix_cache_size = 16
     
     def add_species(self,
                     name,
@@ -160,6 +167,9 @@ class Ensemble:
 
         # Stable list of species
         self._species_list.append(name)
+
+        # Previously built z-matrices no longer describe the ensemble
+        self._z_matrix_cache.clear()
     
     def _build_z_matrix(self,ligand_dict):
         """
@@ -168,9 +178,6 @@ class Ensemble:
         self._not_obs_mask. No error checking. Private function.
         """
 
-        # Figure out number of species in matrix
-        num_species = len(self._species_dict)
-
         # Figure out number of conditions in matrix. If no ligand_dict specified, 
         # single condition with all ligand chemical potential = 0
         if len(ligand_dict) == 0:
@@ -185,43 +192,54 @@ class Ensemble:
             if lig not in ligand_dict:
                 ligand_dict[lig] = np.zeros(num_conditions,dtype=float)
 
-        # Local dictionary with stoich for all species and all ligands. If no stoich
-        # for a given species/ligands, set stoich to 0. 
-        stoich = {}
-        for species_name in self._species_list:
-            stoich[species_name] = {}
-            for lig in ligand_dict:
-                if lig in self._species_dict[species_name]:
-                    stoich[species_name][lig] = self._species_dict[species_name][lig]
-                else:
-                    stoich[species_name][lig] = 0
+        # (ligands x conditions) matrix of chemical potentials
+        mu_matrix = np.zeros((len(self._ligand_list),num_conditions),dtype=float)
+        for i, lig in enumerate(self._ligand_list):
+            mu_matrix[i,:] = ligand_dict[lig]
 
-        # z_matrix holds energy of all species (i) versus conditions (j). 
         # obs_mask holds which species are observable (True) or not (False)
-        self._z_matrix = np.zeros((num_species,num_conditions),dtype=float)
-        self._obs_mask = np.zeros(num_species,dtype=bool)
-        self._folded_mask = np.zeros(num_species,dtype=bool)
-
-        # Go through each species...
-        for i, species_name in enumerate(self._species_dict):
+        self._obs_mask = np.array([self._species_dict[s]["observable"]
+                                   for s in self._species_list],dtype=bool)
+        self._folded_mask = np.array([self._species_dict[s]["folded"]
+                                      for s in self._species_list],dtype=bool)
+        
+        # Non-observable species
+        self._not_obs_mask = np.logical_not(self._obs_mask)
+        self._unfolded_mask = np.logical_not(self._folded_mask)
 
-            # Load reference energy for that species into all conditions
-            self._z_matrix[i,:] = self._species_dict[species_name]["dG0"]
-            
-            # Go through conditions
-            for j in range(num_conditions):
+        # If we have already built a z-matrix for these chemical potentials,
+        # use it. 
+        key = hashlib.blake2b(mu_matrix.tobytes(),digest_size=16).digest()
+        key = (mu_matrix.shape,key)
+        if key in self._z_matrix_cache:
+            self._z_matrix_cache.move_to_end(key)
+            self._z_matrix = self._z_matrix_cache[key]
+            return
+
+        # (species x ligands) stoichiometry matrix. If no stoich for a given
+        # species/ligand, stoich is 0. 
+        stoich = np.zeros((len(self._species_list),len(self._ligand_list)),
+                          dtype=float)
+        dG0 = np.zeros(len(self._species_list),dtype=float)
+        for i, species_name in enumerate(self._species_list):
+            dG0[i] = self._species_dict[species_name]["dG0"]
+            for j, lig in enumerate(self._ligand_list):
+                if lig in self._species_dict[species_name]:
+                    stoich[i,j] = self._species_dict[species_name][lig]
 
-                # Perturb dG with ligand chemical potential for each species under each condition
-                for lig in self._ligand_list:
-                    self._z_matrix[i,j] -= ligand_dict[lig][j]*stoich[species_name][lig]
+        # z_matrix holds energy of all species (i) versus conditions (j): 
+        # reference energy perturbed by chemical potential times stoichiometry
+        # for every ligand. 
+        z_matrix = dG0[:,None] - stoich @ mu_matrix
+        z_matrix.setflags(write=False)
 
-            # Update obs_mask 
-            self._obs_mask[i] = self._species_dict[species_name]["observable"]
-            self._folded_mask[i] = self._species_dict[species_name]["folded"]
+        # Record in the cache, dropping the least recently used z-matrix if 
+        # the cache is full
+        self._z_matrix_cache[key] = z_matrix
+        if len(self._z_matrix_cache) > self._z_matrix_cache_size:
+            self._z_matrix_cache.popitem(last=False)
 
-        # Non-observable species
-        self._not_obs_mask = np.logical_not(self._obs_mask)
-        self._unfolded_mask = np.logical_not(self._folded_mask)
+        self._z_matrix = z_matrix
 
     def _get_weights(self,mut_energy,temperature):
         """
@@ -244,6 +262,26 @@ class Ensemble:
         # Return boltzmann weights
         return np.exp(weights)
 
+    def _get_weights_batch(self,mut_energy_matrix,temperature):
+        """
+        Get Boltzmann weights for many genotypes at once. mut_energy_matrix 
+        must be a (num_genotypes x num_species) array; T must be an array as
+        long as the number of conditions. Returns a (num_genotypes x num_species
+        x num_conditions) array. No error checking. Private. 
+        """
+
+        # Perturb z_matrix by each row of mut_energy_matrix and divide by RT
+        beta = 1/(self._gas_constant*temperature)
+        weights = -beta[None,None,:]*(self._z_matrix[None,:,:] + 
+                                      mut_energy_matrix[:,:,None])
+
+        # Shift each genotype/condition so highest weight is highest allowed
+        # numerically (logsumexp trick applied across species). 
+        shift = self._max_allowed - np.max(weights,axis=1)
+        weights = weights + shift[:,None,:]
+
+        return np.exp(weights)
+
     def get_species_dG(self,
                        name,
                        mut_energy=0,
@@ -528,6 +566,80 @@ class Ensemble:
 
         return dG_out, folded/(folded + unfolded)
 
+    def get_fx_obs_batch(self,mut_energy_matrix,temperature):
+        """
+        Get the fraction observable for many genotypes in one vectorized 
+        calculation. This only works after read_ligand_dict has been run to
+        create the appropriate z-matrix. Warning: no error checking. 
+
+        Parameters
+        ----------
+        mut_energy_matrix : numpy.ndarray
+            (num_genotypes x num_species) array of float. Each row holds the 
+            effects of mutations on the ensemble species for one genotype, in
+            the order of ens.species. 
+        temperature : numpy.ndarray
+            numpy array of float where each value is the T at a given condition.
+
+        Returns
+        -------
+        fx_obs : numpy.ndarray
+            (num_genotypes x num_conditions) array of fraction observable
+        fx_folded : numpy.ndarray
+            (num_genotypes x num_conditions) array of the fraction of the 
+            molecule folded
+        """
+
+        weights = self._get_weights_batch(mut_energy_matrix,temperature)
+
+        obs = np.sum(weights[:,self._obs_mask,:],axis=1)
+        not_obs = np.sum(weights[:,self._not_obs_mask,:],axis=1)
+
+        folded = np.sum(weights[:,self._folded_mask,:],axis=1)
+        unfolded = np.sum(weights[:,self._unfolded_mask,:],axis=1)
+
+        return obs/(obs + not_obs), folded/(folded + unfolded)
+
+    def get_dG_obs_batch(self,mut_energy_matrix,temperature):
+        """
+        Get the dG observable for many genotypes in one vectorized calculation.
+        This only works after read_ligand_dict has been run to create the 
+        appropriate z-matrix. Warning: no error checking. 
+
+        Parameters
+        ----------
+        mut_energy_matrix : numpy.ndarray
+            (num_genotypes x num_species) array of float. Each row holds the 
+            effects of mutations on the ensemble species for one genotype, in
+            the order of ens.species. 
+        temperature : numpy.ndarray
+            numpy array of float where each value is the T at a given condition.
+
+        Returns
+        -------
+        dG_obs : numpy.ndarray
+            (num_genotypes x num_conditions) array of dG observable
+        fx_folded : numpy.ndarray
+            (num_genotypes x num_conditions) array of the fraction of the 
+            molecule folded
+        """
+
+        weights = self._get_weights_batch(mut_energy_matrix,temperature)
+
+        obs = np.sum(weights[:,self._obs_mask,:],axis=1)
+        not_obs = np.sum(weights[:,self._not_obs_mask,:],axis=1)
+
+        not_mask = np.logical_and(obs != 0,not_obs != 0)
+        beta = np.broadcast_to(1/(self._gas_constant*temperature),obs.shape)
+
+        dG_out = np.full(obs.shape,np.nan,dtype=float)
+        dG_out[not_mask] = -beta[not_mask]*np.log(obs[not_mask]/not_obs[not_mask])
+
+        folded = np.sum(weights[:,self._folded_mask,:],axis=1)
+        unfolded = np.sum(weights[:,self._unfolded_mask,:],axis=1)
+
+        return dG_out, folded/(folded + unfolded)
+
     def to_dict(self):
         """
         Return a json-able dictionary describing the ensemble.
@@ -545,7 +657,7 @@ class Ensemble:
         return out
     
     
-    def get_observable_function(self,obs_fcn):
+    def get_observable_function(self,obs_fcn,batch=False):
         """
         Get observable functions by name. 
         
@@ -553,16 +665,23 @@ class Ensemble:
         ----------
         obs_fcn : str
             observable function. should be one of fx_obs or dG_obs.
+        batch : bool, default=False
+            if True, return the batched version of the function that takes a
+            (num_genotypes x num_species) mutation energy matrix. 
         
         Returns
         -------
         fcn : function
-            fast observable function that takes a mutation energy array and
-            temperature array as inputs
+            fast observable function that takes a mutation energy array (or 
+            matrix if batch is True) and temperature array as inputs
         """
 
-        obs_functions = {"fx_obs":self.get_fx_obs_fast,
-                         "dG_obs":self.get_dG_obs_fast}
+        if batch:
+            obs_functions = {"fx_obs":self.get_fx_obs_batch,
+                             "dG_obs":self.get_dG_obs_batch}
+        else:
+            obs_functions = {"fx_obs":self.get_fx_obs_fast,
+                             "dG_obs":self.get_dG_obs_fast}
         
         bad_value = False
         if not issubclass(type(obs_fcn),str):
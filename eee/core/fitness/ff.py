@@ -27,9 +27,26 @@ multiply "fx_obs" by 5 at an iptg chemical potential of 1.
     "select_on": "fx_obs",
     "fitness_kwargs":{"multiply_by":5},
     "ligand_dict":{"iptg":1}}
-    
+
+Fitness functions may declare that they are vectorized (i.e., that they 
+accept either a single float or a numpy array of values, returning fitness with 
+the same shape) by setting :code:`fcn.vectorized = True`. The built-in functions
+below all do so via the _vectorized decorator. Functions that do not declare
+this are treated as scalar-only; map_fitness_fcn wraps them with np.vectorize 
+when a vectorized function is requested (see Fitness.fitness_batch). 
 """
 
+import numpy as np
+
+def _vectorized(fcn):
+    """
+    Declare that a fitness function can take a numpy array of values.
+    """
+    fcn.vectorized = True
+    return fcn
+
+
+@_vectorized
 def ff_on(value,*args,**kwargs):
     """
     Fitness is linearly proportional to value. Useful for simulating selection
@@ -37,6 +54,7 @@ def ff_on(value,*args,**kwargs):
     """
     return value
 
+@_vectorized
 def ff_off(value,*args,**kwargs):
     """
     Fitness is linearly proportional to 1 - value. Useful for simulating
@@ -44,12 +62,17 @@ def ff_off(value,*args,**kwargs):
     """
     return 1 - value
 
+@_vectorized
 def ff_neutral(value,*args,**kwargs):
     """
     Fitness is always 1.0, modeling no selection on observable. 
     """
-    return 1.0
+    if np.ndim(value) == 0:
+        return 1.0
+    
+    return np.ones(np.shape(value),dtype=float)
 
+@_vectorized
 def ff_on_above(value,*args,**kwargs):
     """
     Fitness is 1.0 when observable above a threshold, 0.0 when below it. When
@@ -57,11 +80,14 @@ def ff_on_above(value,*args,**kwargs):
     """
 
     threshold = kwargs["threshold"]
-    if value >= threshold:
-        return 1.0
-    
-    return 0.0
 
+    out = np.where(value >= threshold,1.0,0.0)
+    if np.ndim(value) == 0:
+        return float(out)
+
+    return out
+
+@_vectorized
 def ff_on_below(value,*args,**kwargs):
     """
     Fitness is 0.0 when observable above a threshold, 1.0 when below it. When
@@ -69,10 +95,12 @@ def ff_on_below(value,*args,**kwargs):
     """
 
     threshold = kwargs["threshold"]
-    if value <= threshold:
-        return 1.0
     
-    return 0.0
+    out = np.where(value <= threshold,1.0,0.0)
+    if np.ndim(value) == 0:
+        return float(out)
+
+    return out
 
 
 def _get_ff_available():
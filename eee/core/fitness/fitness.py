@@ -102,9 +102,19 @@ class Fitness:
         for ff in self._condition_df["fitness_fcn"]:
             fitness_fcns.append(map_fitness_fcn(value=ff,return_as="function"))
         self._fitness_fcns = np.array(fitness_fcns)
+
+        # Array-aware versions of the fitness functions for fitness_batch
+        fitness_fcns_batch = []
+        for ff in self._fitness_fcns:
+            fitness_fcns_batch.append(map_fitness_fcn(value=ff,return_as="vectorized"))
+        self._fitness_fcns_batch = fitness_fcns_batch
                                 
         self._num_conditions = len(self._fitness_fcns)
-        self._F_array = np.zeros(self._num_conditions,dtype=float)
+
+        # Batched observable function and mask for select_on_folded conditions
+        self._obs_function_batch = self._private_ens.get_observable_function(self._select_on,
+                                                                             batch=True)
+        self._folded_mask = self._select_on_folded.astype(bool)
 
 
     def fitness(self,mut_energy_array):
@@ -116,18 +126,60 @@ class Fitness:
         mut_energy_array : numpy.ndarray
             array holding the effects of mutations on energy. values should be
             in the order of ens.species 
+
+        Returns
+        -------
+        F_array : numpy.ndarray
+            new array holding the fitness of the genotype in each condition
         """
         
         values, fx_folded = self._obs_function(mut_energy_array=mut_energy_array,
                                                temperature=self._temperature)
 
+        F_array = np.zeros(self._num_conditions,dtype=float)
         for i in range(self._num_conditions):
-            self._F_array[i] = self._fitness_fcns[i](values[i],
-                                                     **self._fitness_kwargs[i])
+            F_array[i] = self._fitness_fcns[i](values[i],
+                                               **self._fitness_kwargs[i])
             if self._select_on_folded[i]:
-               self._F_array[i] *= fx_folded[i]
+               F_array[i] *= fx_folded[i]
  
-        return self._F_array
+        return F_array
+    
+    def fitness_batch(self,mut_energy_matrix):
+        """
+        Calculate the fitness of many genotypes at once. Each row of 
+        mut_energy_matrix holds the total mutational energies of one genotype.
+        Fitness functions are called once per condition on the whole column of
+        observable values. (Scalar-only fitness functions are wrapped by 
+        map_fitness_fcn so they can take arrays.)
+
+        Parameters
+        ----------
+        mut_energy_matrix : numpy.ndarray
+            (num_genotypes x num_species) array holding the effects of mutations
+            on energy. columns should be in the order of ens.species 
+
+        Returns
+        -------
+        F_matrix : numpy.ndarray
+            new (num_genotypes x num_conditions) array holding the fitness of
+            each genotype in each condition. The fitness of each genotype is 
+            np.prod(F_matrix,axis=1). 
+        """
+
+        mut_energy_matrix = np.asarray(mut_energy_matrix,dtype=float)
+        values, fx_folded = self._obs_function_batch(mut_energy_matrix=mut_energy_matrix,
+                                                     temperature=self._temperature)
+
+        F_matrix = np.zeros(values.shape,dtype=float)
+        for i in range(self._num_conditions):
+            F_matrix[:,i] = self._fitness_fcns_batch[i](values[:,i],
+                                                        **self._fitness_kwargs[i])
+
+        # Multiply by fraction folded for select_on_folded conditions
+        F_matrix *= np.where(self._folded_mask[None,:],fx_folded,1.0)
+
+        return F_matrix
     
     def to_dict(self):
         """
@@ -4,6 +4,35 @@ Functions for mapping fitness functions in ff.py to string names.
 
 from .ff import FF_AVAILABLE
 
+import numpy as np
+
+import functools
+
+def _vectorize_fitness_fcn(fcn):
+    """
+    Return a version of fcn that takes arrays of values. If fcn declares itself
+    vectorized, return it unchanged. Otherwise wrap it so it is evaluated 
+    element-by-element with np.vectorize. 
+    """
+
+    if getattr(fcn,"vectorized",False):
+        return fcn
+
+    @functools.wraps(fcn)
+    def vectorized_fcn(value,*args,**kwargs):
+
+        # Scalar input goes straight through
+        if np.ndim(value) == 0:
+            return fcn(value,*args,**kwargs)
+
+        scalar_fcn = np.vectorize(lambda v: fcn(v,*args,**kwargs),
+                                  otypes=[float])
+        return scalar_fcn(value)
+    
+    vectorized_fcn.vectorized = True
+
+    return vectorized_fcn
+
 def map_fitness_fcn(value,return_as):
     """
     Take an input value and map back and forth between the name of that function
@@ -14,13 +43,20 @@ def map_fitness_fcn(value,return_as):
     value : function or str
         should be a fitness function or string name of a function
     return_as : str
-        must be either "function" (return the function) or "string" (return 
+        must be "function" (return the function), "vectorized" (return a 
+        version of the function that takes numpy arrays), or "string" (return 
         the string name of the function). 
 
     Returns
     -------
     result : function or str
         function or str from mapping, depending on return_as
+
+    Notes
+    -----
+    When return_as is "vectorized", functions that declare 
+    :code:`fcn.vectorized = True` (all built-in functions in ff.py) are 
+    returned as-is. Scalar-only functions are wrapped with np.vectorize. 
     """
     
     str_to_fcn = FF_AVAILABLE
@@ -49,11 +85,11 @@ def map_fitness_fcn(value,return_as):
 
     # Check return_as argument
     if not issubclass(type(return_as),str) or issubclass(type(return_as),type):
-        err = f"\nreturn_as ({return_as}) should be 'function' or 'string'\n\n"
+        err = f"\nreturn_as ({return_as}) should be 'function', 'vectorized', or 'string'\n\n"
         raise ValueError(err)
 
     # Return function if possible
-    if return_as == "function":
+    if return_as in ["function","vectorized"]:
 
         if fcn is None:
             err = f"fitness function string ('{fcn_str}') should be one of:\n"
@@ -62,6 +98,9 @@ def map_fitness_fcn(value,return_as):
             err += "\n"
             raise ValueError(err)
         
+        if return_as == "vectorized":
+            return _vectorize_fitness_fcn(fcn)
+
         return fcn
     
     # Return string. (If a function was passed in that is not in
@@ -72,5 +111,5 @@ def map_fitness_fcn(value,return_as):
     
     # Or die. 
     else:
-        err = f"\nreturn_as ({return_as}) should be 'function' or 'string'\n\n"
+        err = f"\nreturn_as ({return_as}) should be 'function', 'vectorized', or 'string'\n\n"
         raise ValueError(err)
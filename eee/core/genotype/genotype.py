@@ -3,14 +3,34 @@ Class for keeping track of genotypes during an evolutionary simulation.
 """
 
 from .single_genotype import SingleGenotype
+from .genotype_store import GenotypeStore
+from .genotype_store import GenotypeStoreView
 from eee.io.read_ddg import read_ddg
 from eee._private.check.ensemble import check_ensemble
+from eee._private.check.standard import check_int
+from eee._private.check.standard import check_bool
 
 import numpy as np
 import pandas as pd
 
+from collections import OrderedDict
+import copy
+import csv
 import os
 
+def _is_numpy_choice(choice_function):
+    """
+    Whether or not choice_function is the choice method of a numpy Generator
+    or RandomState (and thus takes size and p arguments).
+    """
+
+    owner = getattr(choice_function,"__self__",None)
+    if not issubclass(type(owner),(np.random.Generator,np.random.RandomState)):
+        return False
+    
+    return getattr(choice_function,"__name__",None) == "choice"
+
+
 class Genotype:
     """
     Class storing a collection of genotypes. It also allows mutation of one
@@ -29,9 +49,23 @@ class Genotype:
         + mut_energies: mutational energies for the genotype.
 
         + fitnesses holds the absolute fitness of each genotype.
+
+    These are read-only, dictionary-like views keyed by genotype index. The
+    genotypes themselves are held in a columnar GenotypeStore: growable arrays
+    of parent index, fitness, and energy, with mutations encoded as integer
+    ids (rows in ddg_array). Trajectories are reconstructed on demand by 
+    following parent pointers. 
     """
 
-    def __init__(self,ens,fitness_function,ddg_df,choice_function=None):
+    def __init__(self,
+                 ens,
+                 fitness_function,
+                 ddg_df,
+                 choice_function=None,
+                 fitness_function_batch=None,
+                 cache_trajectories=False,
+                 fitness_cache_size=0,
+                 canonical_genotypes=False):
         """
         Initialize class. 
 
@@ -47,12 +81,39 @@ class Genotype:
         choice_function : function, optional
             function that randomly selects elements from a list-like object 
             (i.e. np.random.choice). This can be passed in so we can use a 
-            seeded and reproducible random number generator. 
+            seeded and reproducible random number generator. It is called 
+            with a single list-like argument. If it is the choice method of a
+            numpy Generator or RandomState (including np.random.choice), 
+            mutate_many draws all of its mutations with one call.
+        fitness_function_batch : function, optional
+            function that takes a (num_genotypes x num_species) matrix of 
+            mutation energies and returns a (num_genotypes x num_conditions)
+            fitness matrix (i.e. Fitness.fitness_batch). If not specified, 
+            batch calculations call fitness_function on each genotype. 
+        cache_trajectories : bool, default=False
+            memoize trajectories as they are reconstructed from parent 
+            pointers. Speeds up repeated trajectory lookups at the cost of
+            memory. 
+        fitness_cache_size : int, default=0
+            maximum number of genotypes whose mutation energy and fitness are
+            kept in a least-recently-used cache keyed by mutation set. When 
+            the same genotype arises again (through reversion or recurrent 
+            mutation), the cached values are used rather than re-evaluating
+            the ensemble. 0 disables the cache. 
+        canonical_genotypes : bool, default=False
+            if True, a mutation that produces a genotype whose mutation set
+            is already in the object returns the index of that existing 
+            genotype rather than a new index. Recurrent mutants then collapse
+            onto one index. The trajectory and accumulated mutations of a 
+            canonical genotype are those of the first lineage that reached it;
+            every other path is recorded as an alternate parent (see 
+            alternate_parents and all_trajectories). 
         """
         
         # Fitness and ddg information
         self._ens = check_ensemble(ens,check_obs=True)
         self._fitness_function = fitness_function
+        self._fitness_function_batch = fitness_function_batch
         self._ddg_df = read_ddg(ddg_df)
     
         if choice_function is None:
@@ -61,19 +122,45 @@ class Genotype:
 
         self._create_ddg_dict()
 
+        # Least-recently-used cache of (mut_energy, fitness) keyed by the 
+        # sorted mutation ids in a genotype
+        self._fitness_cache_size = check_int(value=fitness_cache_size,
+                                             variable_name="fitness_cache_size",
+                                             minimum_allowed=0)
+        self._fitness_cache = OrderedDict()
+        self._fitness_cache_hits = 0
+        self._fitness_cache_misses = 0
+
         # Sites and mutations for generating mutations
         self._possible_sites = list(self._ddg_dict.keys())
         self._mutations_at_sites = dict([(s,list(self._ddg_dict[s].keys()))
                                          for s in self._possible_sites])
+
+        # Columnar store holding all genotypes. Add wildtype as genotype 0.
+        self._store = GenotypeStore(num_species=len(self._ens.species),
+                                    cache_paths=cache_trajectories)
+
+        wt_energy = np.zeros(len(self._ens.species),dtype=float)
+        wt_energy, wt_fitness = self._calc_fitness((),wt_energy)
+        self._store.add(parent=-1,
+                        step=-1,
+                        mutations=(),
+                        energy=wt_energy,
+                        fitness=wt_fitness)
         self._last_index = 0
+
+        # Genotype ids below this have been written out by dump_to_csv
+        self._last_flushed = 0
         
-        # Main public attributes of the class. 
-        self._genotypes = {0:SingleGenotype(self._ens,self._ddg_dict)}
-        self._trajectories = {0:[0]}
-        self._mut_energies = {0:self._genotypes[0].mut_energy}
+        # Main public attributes of the class (views into the store)
+        self._genotypes = GenotypeStoreView(self._store,self._get_single_genotype)
+        self._trajectories = GenotypeStoreView(self._store,self.trajectory)
+        self._mut_energies = GenotypeStoreView(self._store,self._get_mut_energy)
+        self._fitnesses = GenotypeStoreView(self._store,self._get_fitness)
 
-        wt_fitness = np.product(self._fitness_function(self._genotypes[0].mut_energy))
-        self._fitnesses = {0:wt_fitness}
+        # Map between sorted mutation ids and the canonical genotype index
+        self._num_merged = 0
+        self.canonical_genotypes = canonical_genotypes
 
     def _create_ddg_dict(self):
         """
@@ -103,34 +190,503 @@ class Genotype:
             
             self._ddg_dict[site][mut] = self._ens.mut_dict_to_array(mut_dict)
 
+        # Stack all mutation energies into a single (num_mutations x 
+        # num_species) array in ddg_dict order, recording the site and 
+        # mutation for each row. 
+        self._ddg_sites = []
+        self._ddg_mutations = []
+        ddg_rows = []
+        for site in self._ddg_dict:
+            for mut in self._ddg_dict[site]:
+                self._ddg_sites.append(site)
+                self._ddg_mutations.append(mut)
+                ddg_rows.append(self._ddg_dict[site][mut])
+
+        self._ddg_array = np.zeros((len(ddg_rows),len(species)),dtype=float)
+        for i, row in enumerate(ddg_rows):
+            self._ddg_array[i] = row
+
+        # Map between site/mutation and integer mutation id (row in ddg_array)
+        self._mutation_ids = {}
+        for i, site in enumerate(self._ddg_sites):
+            if site not in self._mutation_ids:
+                self._mutation_ids[site] = {}
+            self._mutation_ids[site][self._ddg_mutations[i]] = i
+
+        # Mutation ids available at each site, in ddg_dict order
+        self._site_mutation_ids = [list(self._mutation_ids[site].values())
+                                   for site in self._ddg_dict]
+
+        # ddg_array with an extra row of zeros at the end. Indexing this with
+        # -1 means "no mutation". 
+        self._ddg_array_padded = np.vstack((self._ddg_array,
+                                            np.zeros((1,len(species)),dtype=float)))
+
+        # Probability of drawing each mutation id when choosing a random site,
+        # then a random mutation at that site. 
+        num_at_site = np.array([len(self._ddg_dict[s]) for s in self._ddg_sites])
+        self._mutation_p = 1/(len(self._ddg_dict)*num_at_site)
+
+    def fitness_batch(self,mut_energy_matrix):
+        """
+        Calculate the absolute fitness of many genotypes at once. 
+
+        Parameters
+        ----------
+        mut_energy_matrix : numpy.ndarray
+            (num_genotypes x num_species) array of mutation energies. columns
+            should be in ens.species order. 
+
+        Returns
+        -------
+        fitness : numpy.ndarray
+            array of absolute fitness (product across conditions) for each
+            genotype
+        """
+
+        if self._fitness_function_batch is None:
+            fitness = [np.prod(self._fitness_function(m))
+                       for m in mut_energy_matrix]
+            return np.array(fitness,dtype=float)
+        
+        return np.prod(self._fitness_function_batch(mut_energy_matrix),axis=1)
+
+
+    def mut_energy_batch(self,mutation_ids):
+        """
+        Calculate the mutation energies of many genotypes at once. Mutation
+        energies are additive, so the energy of each genotype is the sum of 
+        its rows of ddg_array (added in the order they appear). 
+
+        Parameters
+        ----------
+        mutation_ids : numpy.ndarray
+            (num_genotypes x max_num_mutations) integer array of mutation ids
+            (rows of ddg_array) in each genotype. Rows for genotypes with 
+            fewer mutations are padded with -1. 
+
+        Returns
+        -------
+        mut_energy_matrix : numpy.ndarray
+            (num_genotypes x num_species) array of mutation energies. columns
+            are in ens.species order. 
+        """
+
+        mutation_ids = np.asarray(mutation_ids,dtype=np.int64)
+
+        # The padded ddg array has a row of zeros at the end; point -1 at it
+        padded = self._ddg_array_padded
+        ids = np.where(mutation_ids < 0,len(padded) - 1,mutation_ids)
+        
+        energy = np.zeros((len(mutation_ids),padded.shape[1]),dtype=float)
+        for k in range(mutation_ids.shape[1]):
+            energy += padded[ids[:,k]]
+
+        return energy
 
-    def _add_genotype(self,new_genotype,prev_index):
+    def _get_single_genotype(self,index):
         """
-        Add a newly created genotype to the object. Updates _genotypes, 
-        _mut_energies, _trajectories, and _fitnesses. Returns the key pointing
-        to the new genotype.
+        Build a SingleGenotype instance describing genotype index from the 
+        store. 
         """
 
-        # Get index for new genotype
-        new_index = self._last_index + 1
-        self._last_index += 1
+        row = self._store.get_row(index)
+        mutations = self._store.mutations[row]
+
+        return SingleGenotype(self._ens,
+                              self._ddg_dict,
+                              sites=[self._ddg_sites[m] for m in mutations],
+                              mutations=[self._ddg_mutations[m] for m in mutations],
+                              mutations_accumulated=self._store.get_steps(index),
+                              mut_energy=self._store.energy[row])
+
+    def _get_mut_energy(self,index):
+        """
+        Mutation energy array for genotype index. (Returns a copy so callers
+        cannot modify the store).
+        """
+        return self._store.energy[self._store.get_row(index)].copy()
+
+    def _get_fitness(self,index):
+        """
+        Absolute fitness of genotype index.
+        """
+        return self._store.fitness[self._store.get_row(index)]
+
+    def trajectory(self,index):
+        """
+        Get the trajectory taken to reach genotype index, reconstructed from
+        parent pointers.
+
+        Parameters
+        ----------
+        index : int
+            genotype index
+        
+        Returns
+        -------
+        trajectory : list
+            genotype indexes from wildtype (0) to index
+        """
+
+        if not self._store.contains(index):
+            err = f"\nindex ({index}) is not in genotypes\n\n"
+            raise IndexError(err)
+
+        return self._store.get_ancestors(index)
+
+    def alternate_parents(self,index):
+        """
+        Get the other steps that reached genotype index when recurrent mutants 
+        collapsed onto it (canonical_genotypes mode). 
+
+        Parameters
+        ----------
+        index : int
+            genotype index
+        
+        Returns
+        -------
+        alternate_parents : list
+            list of (parent index, mutation step name) tuples, excluding the
+            parent in trajectory(index)
+        """
+
+        if not self._store.contains(index):
+            err = f"\nindex ({index}) is not in genotypes\n\n"
+            raise IndexError(err)
+        
+        step_names = self._store.step_names
+        return [(p,step_names[s]) for p, s in self._store.get_alternate_parents(index)]
+
+    def all_trajectories(self,index):
+        """
+        Get every trajectory that reached genotype index, following both 
+        parent pointers and alternate parents. Trajectories never visit the 
+        same genotype twice. 
+
+        Parameters
+        ----------
+        index : int
+            genotype index
+        
+        Returns
+        -------
+        trajectories : list
+            list of trajectories (lists of genotype indexes ending in index).
+            The first is trajectory(index). 
+        """
+
+        if not self._store.contains(index):
+            err = f"\nindex ({index}) is not in genotypes\n\n"
+            raise IndexError(err)
+        
+        store = self._store
+        out = []
+
+        # Depth-first walk back from index. Each stack entry is a partial
+        # trajectory, stored from index backwards. 
+        stack = [[int(index)]]
+        while len(stack) > 0:
+
+            path = stack.pop()
+            current = path[-1]
+
+            # Reached the root of a lineage
+            parent = int(store.get_parent([current])[0])
+            if parent < 0:
+                out.append(path[::-1])
+
+            parents = []
+            if parent >= 0:
+                parents.append(parent)
+            parents.extend([p for p, _ in store.get_alternate_parents(current)])
+
+            # Push in reverse so the parent pointer is explored first
+            for p in parents[::-1]:
+                if p not in path:
+                    stack.append(path + [p])
+
+        return out
+
+    def get_fitnesses(self,indexes):
+        """
+        Get the absolute fitness of many genotypes at once.
+
+        Parameters
+        ----------
+        indexes : list-like
+            genotype indexes
+        
+        Returns
+        -------
+        fitnesses : numpy.ndarray
+            fitness of each genotype in indexes
+        """
+        return self._store.fitness[self._store.get_rows(indexes)]
+    
+    def get_num_accumulated(self,indexes):
+        """
+        Get the number of mutations accumulated (including multiple mutations
+        at the same site) for many genotypes at once.
+
+        Parameters
+        ----------
+        indexes : list-like
+            genotype indexes
+        
+        Returns
+        -------
+        num_accumulated : numpy.ndarray
+            number of mutations accumulated by each genotype in indexes
+        """
+
+        # get_rows raises a KeyError if any genotype is not in the store
+        self._store.get_rows(indexes)
+        return self._store.get_depth(indexes)
+
+    def _mutate_set(self,mutations,mut_id):
+        """
+        Work out the mutations present after introducing mutation mut_id into 
+        a genotype carrying mutations. If this mutation has already occurred
+        at this site, treat as a reversion. Returns the new mutation tuple, 
+        the id of the mutation previously at the site (-1 if none), and the
+        name of the mutation step. (Mirrors SingleGenotype.mutate). 
+        """
+
+        mutations = list(mutations)
+        site = self._ddg_sites[mut_id]
+        mutation = self._ddg_mutations[mut_id]
+
+        # If the site was already mutated, we need to mutate site back to wt
+        # before mutating to new genotype
+        prev_id = -1
+        for i, m in enumerate(mutations):
+            if self._ddg_sites[m] == site:
+                prev_id = mutations.pop(i)
+                break
+        
+        # Mutation differs from what was at the site: add it. 
+        if mut_id != prev_id:
+            mutations.append(mut_id)
+
+            step_name = mutation[:]
+            if prev_id >= 0:
+                prev_mut = self._ddg_mutations[prev_id]
+                step_name = f"{prev_mut[-1]}{mutation[1:]}"
+
+        # Same as previous mutation: reversion to wildtype at this site
+        else:
+            step_name = f"{mutation[-1]}{mutation[1:-1]}{mutation[0]}"
+
+        return tuple(mutations), prev_id, step_name
+
+    def _apply_mutation(self,index,site,mutation):
+        """
+        Work out the result of introducing mutation at site into genotype index.
+        Returns the mutation tuple and energy of the new genotype and the name
+        of the mutation step.
+        """
+
+        row = self._store.get_row(index)
+        mut_id = self._mutation_ids[site][mutation]
+
+        mutations, prev_id, step_name = self._mutate_set(self._store.mutations[row],
+                                                         mut_id)
+
+        # Remove the energetic effect of the previous mutation, then add the 
+        # new one (unless this was a reversion)
+        mut_energy = self._store.energy[row].copy()
+        if prev_id >= 0:
+            mut_energy -= self._ddg_array[prev_id]
+        if mut_id != prev_id:
+            mut_energy += self._ddg_array[mut_id]
+
+        return mutations, mut_energy, step_name
+
+    def _calc_fitness(self,mutations,mut_energy):
+        """
+        Calculate the fitness of a genotype with mutations and mut_energy. 
+        If the fitness cache is on and this mutation set has been seen, return
+        the cached mutation energy and fitness. Returns mut_energy, fitness.
+        """
+
+        if self._fitness_cache_size == 0:
+            return mut_energy, np.prod(self._fitness_function(mut_energy))
+        
+        key = tuple(sorted(mutations))
+        if key in self._fitness_cache:
+            self._fitness_cache.move_to_end(key)
+            self._fitness_cache_hits += 1
+
+            mut_energy, fitness = self._fitness_cache[key]
+            return mut_energy.copy(), fitness
+        
+        self._fitness_cache_misses += 1
+        fitness = np.prod(self._fitness_function(mut_energy))
+
+        # Record in the cache, dropping the least recently used genotype if
+        # the cache is full
+        self._fitness_cache[key] = (mut_energy.copy(),fitness)
+        if len(self._fitness_cache) > self._fitness_cache_size:
+            self._fitness_cache.popitem(last=False)
+
+        return mut_energy, fitness
 
-        # Record the new genotype
-        self._genotypes[new_index] = new_genotype
+    def _calc_fitness_many(self,mutations,mut_energy_matrix):
+        """
+        Calculate the fitness of many genotypes with one batched fitness call.
+        mutations is a list of mutation tuples; mut_energy_matrix is the 
+        (num_genotypes x num_species) matrix of their energies. Genotypes
+        found in the fitness cache are not recalculated. Returns 
+        mut_energy_matrix, fitness. 
+        """
 
-        # Record the trajectory taken to reach the current genotype
-        new_trajectory = self._trajectories[prev_index][:]
-        new_trajectory.append(new_index)
-        self._trajectories[new_index] = new_trajectory
+        if self._fitness_cache_size == 0:
+            return mut_energy_matrix, self.fitness_batch(mut_energy_matrix)
+        
+        fitness = np.zeros(len(mutations),dtype=float)
+        to_calc = {}
+        repeats = []
+        for i, muts in enumerate(mutations):
+            key = tuple(sorted(muts))
+            if key in self._fitness_cache:
+                self._fitness_cache.move_to_end(key)
+                self._fitness_cache_hits += 1
+                mut_energy_matrix[i], fitness[i] = self._fitness_cache[key]
+            elif key in to_calc:
+                repeats.append((i,to_calc[key]))
+            else:
+                to_calc[key] = i
         
-        self._mut_energies[new_index] = new_genotype.mut_energy
+        # Calculate each new mutation set once
+        if len(to_calc) > 0:
+            self._fitness_cache_misses += len(to_calc)
+            idx = list(to_calc.values())
+            fitness[idx] = self.fitness_batch(mut_energy_matrix[idx])
+            for key, i in to_calc.items():
+                self._fitness_cache[key] = (mut_energy_matrix[i].copy(),fitness[i])
+                if len(self._fitness_cache) > self._fitness_cache_size:
+                    self._fitness_cache.popitem(last=False)
+
+        # Mutation sets that appeared more than once in this batch
+        self._fitness_cache_hits += len(repeats)
+        for i, j in repeats:
+            mut_energy_matrix[i] = mut_energy_matrix[j]
+            fitness[i] = fitness[j]
+        
+        return mut_energy_matrix, fitness
+
+    def _add_genotype(self,prev_index,mutations,mut_energy,step_name,fitness=None):
+        """
+        Add a newly created genotype to the object. Returns the key pointing
+        to the new genotype. If fitness is not specified, calculate it from
+        mut_energy. 
+        """
 
         # Record the fitness of this genotype
-        new_fitness = np.product(self._fitness_function(new_genotype.mut_energy))
-        self._fitnesses[new_index] = new_fitness
+        if fitness is None:
+            mut_energy, fitness = self._calc_fitness(mutations,mut_energy)
+
+        new_index = self._store.add(parent=prev_index,
+                                    step=self._store.get_step_code(step_name),
+                                    mutations=mutations,
+                                    energy=mut_energy,
+                                    fitness=fitness)
+        self._last_index = new_index
+
+        if self._canonical_genotypes:
+            self._canonical_index[tuple(sorted(mutations))] = new_index
 
         return new_index
 
+    def _export(self,indexes):
+        """
+        Copy the mutations, energies, fitnesses, and number of accumulated 
+        mutations of the genotypes in indexes into a dictionary that can be 
+        loaded into a new object with _fork. 
+        """
+
+        indexes = np.asarray(indexes,dtype=np.int64)
+        rows = self._store.get_rows(indexes)
+
+        genotypes = {"mutations":[self._store.mutations[r] for r in rows],
+                     "energy":self._store.energy[rows].copy(),
+                     "fitness":self._store.fitness[rows].copy(),
+                     "depth":self._store.get_depth(indexes).copy()}
+        
+        return genotypes
+
+    def _fork(self,genotypes,choice_function=None):
+        """
+        Create a new Genotype object that shares the ensemble, fitness function,
+        and mutation effects of this object, but only holds genotypes (a 
+        dictionary created by _export). These become genotypes 0 through 
+        len(genotypes["fitness"]) - 1 in the new object. They have no 
+        lineage, but keep their number of accumulated mutations. 
+        """
+
+        new = copy.copy(self)
+
+        new._store = GenotypeStore(num_species=len(self._ens.species),
+                                   cache_paths=self._store._cache_paths)
+        for i in range(len(genotypes["fitness"])):
+            new._store.add(parent=-1,
+                           step=-1,
+                           mutations=genotypes["mutations"][i],
+                           energy=genotypes["energy"][i],
+                           fitness=genotypes["fitness"][i],
+                           depth=genotypes["depth"][i])
+        new._last_index = new._store.num_ids - 1
+        new._last_flushed = 0
+
+        if choice_function is not None:
+            new._choice_function = choice_function
+
+        new._fitness_cache = OrderedDict()
+        new._fitness_cache_hits = 0
+        new._fitness_cache_misses = 0
+
+        new._genotypes = GenotypeStoreView(new._store,new._get_single_genotype)
+        new._trajectories = GenotypeStoreView(new._store,new.trajectory)
+        new._mut_energies = GenotypeStoreView(new._store,new._get_mut_energy)
+        new._fitnesses = GenotypeStoreView(new._store,new._get_fitness)
+
+        new._num_merged = 0
+        new.canonical_genotypes = self._canonical_genotypes
+
+        return new
+
+    def _get_canonical(self,mutations):
+        """
+        Return the index of the live genotype with the same mutation set as 
+        mutations, or None if there is no such genotype (or canonical mode is
+        off). 
+        """
+
+        if not self._canonical_genotypes:
+            return None
+
+        index = self._canonical_index.get(tuple(sorted(mutations)))
+        if index is not None and self._store.contains(index):
+            return index
+
+        return None
+
+    def _merge(self,index,prev_index,step_name):
+        """
+        Collapse a mutation of prev_index (step_name) onto existing genotype
+        index, recording the step as an alternate parent of index. Returns 
+        index. 
+        """
+
+        self._store.add_alternate_parent(index,
+                                         parent=prev_index,
+                                         step=self._store.get_step_code(step_name))
+        self._num_merged += 1
+
+        return index
+
     def mutate(self,index,site=None,mutation=None):
         """
         Mutate the genotype with "index" to a new genotype, returning the 
@@ -154,13 +710,10 @@ class Genotype:
         """
 
         # Sanity check
-        if index not in self._genotypes:
+        if not self._store.contains(index):
             err = f"\nindex ({index}) is not in genotypes\n\n"
             raise IndexError(err)
         
-        # Create a new genotype and mutate
-        new_genotype = self._genotypes[index].copy()
-
         # If not specified, randomly choose a site
         if site is None:
             site = self._choice_function(self._possible_sites)
@@ -170,10 +723,140 @@ class Genotype:
             mutation = self._choice_function(self._mutations_at_sites[site])
 
         # Introduce mutation
-        new_genotype.mutate(site,mutation)
+        mutations, mut_energy, step_name = self._apply_mutation(index,
+                                                                site,
+                                                                mutation)
         
-        return self._add_genotype(new_genotype,index)
+        # Return existing genotype if we are collapsing recurrent mutants
+        existing = self._get_canonical(mutations)
+        if existing is not None:
+            return self._merge(existing,index,step_name)
 
+        return self._add_genotype(prev_index=index,
+                                  mutations=mutations,
+                                  mut_energy=mut_energy,
+                                  step_name=step_name)
+
+
+    def _draw_mutations(self,num_to_mutate):
+        """
+        Draw num_to_mutate random mutation ids (random site, then random 
+        mutation at that site). 
+        """
+
+        # numpy choice: draw everything at once. The probability of each 
+        # mutation is the probability of choosing its site times the 
+        # probability of choosing it from the mutations at that site. 
+        if _is_numpy_choice(self._choice_function):
+            mut_ids = self._choice_function(len(self._mutation_p),
+                                            size=num_to_mutate,
+                                            p=self._mutation_p)
+            return np.asarray(mut_ids,dtype=np.int64)
+
+        # Any other choice function: call with a single list-like, as in 
+        # mutate
+        mut_ids = np.zeros(num_to_mutate,dtype=np.int64)
+        for i in range(num_to_mutate):
+            site = self._choice_function(self._possible_sites)
+            mutation = self._choice_function(self._mutations_at_sites[site])
+            mut_ids[i] = self._mutation_ids[site][mutation]
+
+        return mut_ids
+
+    def mutate_many(self,parent_indexes):
+        """
+        Mutate many genotypes at once, returning the indexes of the new 
+        genotypes. Each parent gets one random mutation (random site, then 
+        random mutation at that site, as in mutate). If choice_function is a
+        numpy choice method, all mutations are drawn with a single call. All
+        child energies are built 
+        with one array operation, and all children are scored with one batched
+        fitness calculation. 
+
+        Parameters
+        ----------
+        parent_indexes : list-like
+            indexes of genotypes to mutate. An index can appear more than once;
+            each occurrence is mutated independently.
+
+        Returns
+        -------
+        new_indexes : numpy.ndarray
+            indexes of the newly generated genotypes, in parent_indexes order
+        """
+
+        parent_indexes = np.asarray(parent_indexes,dtype=np.int64)
+        num_to_mutate = len(parent_indexes)
+        if num_to_mutate == 0:
+            return np.zeros(0,dtype=np.int64)
+
+        # Sanity check
+        for index in np.unique(parent_indexes):
+            if not self._store.contains(index):
+                err = f"\nindex ({index}) is not in genotypes\n\n"
+                raise IndexError(err)
+        rows = self._store.get_rows(parent_indexes)
+        
+        mut_ids = self._draw_mutations(num_to_mutate)
+
+        # Work out mutation sets and step names for all children
+        mutations = []
+        prev_ids = np.zeros(num_to_mutate,dtype=np.int64)
+        step_names = []
+        for i in range(num_to_mutate):
+            muts, prev_ids[i], step_name = self._mutate_set(self._store.mutations[rows[i]],
+                                                            int(mut_ids[i]))
+            mutations.append(muts)
+            step_names.append(step_name)
+
+        # Child energies: parent energy minus the previous mutation at the site
+        # plus the new mutation (unless a reversion). Index -1 in the padded
+        # array is zero. 
+        add_ids = np.where(mut_ids == prev_ids,-1,mut_ids)
+        mut_energy = self._store.energy[rows] - self._ddg_array_padded[prev_ids]
+        mut_energy = mut_energy + self._ddg_array_padded[add_ids]
+
+        # Children that already exist do not need fitness calculations. If
+        # we are collapsing recurrent mutants, children with the same mutation
+        # set as an earlier child in this batch become that child. 
+        new_indexes = -np.ones(num_to_mutate,dtype=np.int64)
+        to_add = []
+        first_seen = {}
+        repeats = []
+        for i in range(num_to_mutate):
+            existing = self._get_canonical(mutations[i])
+            if existing is not None:
+                new_indexes[i] = self._merge(existing,
+                                             parent_indexes[i],
+                                             step_names[i])
+                continue
+            
+            if self._canonical_genotypes:
+                key = tuple(sorted(mutations[i]))
+                if key in first_seen:
+                    repeats.append((i,first_seen[key]))
+                    continue
+                first_seen[key] = i
+            
+            to_add.append(i)
+        
+        if len(to_add) > 0:
+            energy, fitness = self._calc_fitness_many([mutations[i] for i in to_add],
+                                                      mut_energy[to_add])
+            
+        for j, i in enumerate(to_add):
+            new_indexes[i] = self._add_genotype(prev_index=parent_indexes[i],
+                                                mutations=mutations[i],
+                                                mut_energy=energy[j],
+                                                step_name=step_names[i],
+                                                fitness=fitness[j])
+        
+        for i, j in repeats:
+            new_indexes[i] = self._merge(new_indexes[j],
+                                         parent_indexes[i],
+                                         step_names[i])
+
+        return new_indexes
 
     def conditional_mutate(self,
                            index,
@@ -207,81 +890,121 @@ class Genotype:
         """
         
         # Sanity check
-        if index not in self._genotypes:
+        if not self._store.contains(index):
             err = f"\nindex ({index}) is not in genotypes\n\n"
             raise IndexError(err)
                            
-        # Create a new genotype and mutate
-        new_genotype = self._genotypes[index].copy()
-
         # Introduce mutation
-        new_genotype.mutate(site,mutation)
-
-        new_fitness = np.product(self._fitness_function(new_genotype.mut_energy))
-
-        if condition_fcn(new_fitness,self._fitnesses[index]):
-            return self._add_genotype(new_genotype,index)
+        mutations, mut_energy, step_name = self._apply_mutation(index,
+                                                                site,
+                                                                mutation)
+
+        # Existing genotype if we are collapsing recurrent mutants
+        existing = self._get_canonical(mutations)
+        if existing is not None:
+            if condition_fcn(self._get_fitness(existing),self._get_fitness(index)):
+                return self._merge(existing,index,step_name)
+            return -1
+
+        mut_energy, new_fitness = self._calc_fitness(mutations,mut_energy)
+
+        if condition_fcn(new_fitness,self._get_fitness(index)):
+            return self._add_genotype(prev_index=index,
+                                      mutations=mutations,
+                                      mut_energy=mut_energy,
+                                      step_name=step_name,
+                                      fitness=new_fitness)
         
         return -1
         
 
 
+    def _snapshot(self,rows=None):
+        """
+        Copy everything needed to build df for the live genotypes in rows
+        (default: all live genotypes) into a dictionary. The snapshot does not
+        share memory with the store, so it can be turned into a dataframe
+        (_snapshot_to_df) after the store has changed or on another thread. 
+        """
+
+        store = self._store
+        if rows is None:
+            rows = np.arange(len(store))
+        rows = np.asarray(rows,dtype=np.int64)
+
+        ids = store.ids[rows]
+
+        # Walk all parent pointers at once. Column 0 is the root; the steps
+        # that created columns 1...depth are the accumulated mutations. 
+        ancestors, depth = store.get_ancestor_matrix(ids)
+        steps = -np.ones(ancestors[:,1:].shape,dtype=np.int64)
+        has_step = ancestors[:,1:] >= 0
+        steps[has_step] = store.get_step(ancestors[:,1:][has_step])
+
+        snapshot = {"genotype":ids.copy(),
+                    "mutations":[store.mutations[r] for r in rows],
+                    "ancestors":ancestors,
+                    "depth":depth,
+                    "steps":steps,
+                    "step_names":list(store.step_names),
+                    "parent":store.get_parent(ids).copy(),
+                    "energy":store.energy[rows].copy(),
+                    "fitness":store.fitness[rows].copy(),
+                    "species":list(self._ens.species),
+                    "mutation_names":self._ddg_mutations}
+
+        return snapshot
+
     def dump_to_csv(self,
                     filename,
-                    keep_genotypes=None):
+                    keep_genotypes=None,
+                    writer=None):
         """
         Dump genotypes into a csv file. This appends to the filename if the
-        csv already exists. The dump removes the genotypes from the object. This
-        is to allow long evolutionary simulations that could potentially take 
-        a large amount of memory. If run without keep_genotypes specified, the
-        resulting Genotype instance will be empty. 
+        csv already exists. Only genotypes created since the last dump are 
+        written, so each genotype is written exactly once. The dump removes the
+        genotypes from the object. This is to allow long evolutionary 
+        simulations that could potentially take a large amount of memory. If
+        run without keep_genotypes specified, the resulting Genotype instance
+        will be empty. 
         
         Parameters
         ----------
         filename : str
             csv file to write to
         keep_genotypes : list, optional
-            list of genotypes to keep. These should be keys in self.genotypes    
+            list of genotypes to keep in the object after the dump. These 
+            should be keys in self.genotypes. They are written out (if new) but
+            remain available for mutation. 
+        writer : eee.io.background_writer.BackgroundWriter, optional
+            if specified, hand a snapshot of the genotypes to this writer
+            rather than writing them here. The genotypes are dropped from the
+            object immediately. 
         """
 
-        # Get a dataframe describing the genotypes
-        df = self.df
-
-        # Create a genotype that only has genotypes to remove
-        if keep_genotypes is not None:
-            to_write = np.logical_not(df["genotype"].isin(keep_genotypes))
-            df = df.loc[to_write,:]
+        # Live ids are in increasing order, so the genotypes added since the
+        # last flush are the rows at the end of the store.
+        store = self._store
+        first_row = np.searchsorted(store.ids,self._last_flushed)
+        rows = np.arange(first_row,len(store))
 
-         # Write out, either appending or creating a new file
-        if os.path.isfile(filename):
-            df.to_csv(filename,
-                      mode="a",
-                      header=False,
-                      index=False)
+        snapshot = self._snapshot(rows)
+        if writer is None:
+            _write_snapshot_csv(filename,snapshot)
         else:
-            df.to_csv(filename,
-                      mode="w",
-                      header=True,
-                      index=False)
-
-        # Update genotypes, trajectories, mut_energies, and fitnesses. Default
-        # is to drop all genotypes. Save those in keep_genotypes. 
-        genotypes = {}
-        trajectories = {}
-        mut_energies = {}
-        fitnesses = {}
-        if keep_genotypes is not None:
-
-            for g in keep_genotypes:
-                genotypes[g] = self._genotypes[g]
-                trajectories[g] = self._trajectories[g]
-                mut_energies[g] = self._mut_energies[g]
-                fitnesses[g] = self._fitnesses[g]
-            
-        self._genotypes = genotypes
-        self._trajectories = trajectories
-        self._mut_energies = mut_energies
-        self._fitnesses = fitnesses
+            writer.submit(_write_snapshot_csv,filename,snapshot)
+
+        self._last_flushed = store.num_ids
+
+        # Drop genotypes from the store. Default is to drop all genotypes. 
+        # Save those in keep_genotypes. (Lineage is retained so trajectories
+        # of kept genotypes can still be reconstructed.)
+        self._store.keep(keep_genotypes)
+
+        # Forget canonical genotypes that were dropped
+        if self._canonical_genotypes:
+            self._canonical_index = dict([(k,v) for k, v in self._canonical_index.items()
+                                          if self._store.contains(v)])
 
     def to_dict(self):
         """
@@ -296,41 +1019,7 @@ class Genotype:
         Genotypes, trajectories, energies, and fitnesses as a pandas Dataframe.
         """
 
-        genotypes = list(self._genotypes.keys())
-        mutations = ["/".join(self._genotypes[g].mutations) for g in genotypes]
-        num_mutations = [len(self._genotypes[g].mutations) for g in genotypes]
-        accum_mutations = ["/".join(self._genotypes[g].mutations_accumulated)
-                           for g in genotypes]
-        num_accum_mut = [len(self._genotypes[g].mutations_accumulated)
-                         for g in genotypes]
-
-        parent = [self._trajectories[t][-2]
-                  for t in list(self._trajectories.keys())[1:]]
-        parent.insert(0,pd.NA)
-
-        out = {"genotype":genotypes,
-               "mutations":mutations,
-               "num_mutations":num_mutations,
-               "accum_mut":accum_mutations,
-               "num_accum_mut":num_accum_mut,
-               "parent":parent,
-               "trajectory":[self._trajectories[t] for t in self._trajectories]}
-
-        # Get mutation energies
-        mut_energy_out = {}
-        for name in self._ens.species:
-            mut_energy_out[name] = []
-
-        for i in self._genotypes:
-            for j, name in enumerate(self._ens.species):
-                mut_energy_out[name].append(self._mut_energies[i][j])
-
-        for k in mut_energy_out:
-            out[f"{k}_ddg"] = mut_energy_out[k]
-
-        out["fitness"] = [self._fitnesses[f] for f in self._fitnesses]
-        
-        return pd.DataFrame(out)
+        return _snapshot_to_df(self._snapshot())
 
     @property
     def wt_sequence(self):
@@ -373,6 +1062,50 @@ class Genotype:
         """
         return self._fitnesses
     
+    @property
+    def canonical_genotypes(self):
+        """
+        Whether or not recurrent mutants collapse onto one genotype index.
+        """
+        return self._canonical_genotypes
+    
+    @canonical_genotypes.setter
+    def canonical_genotypes(self,canonical_genotypes):
+        
+        self._canonical_genotypes = check_bool(value=canonical_genotypes,
+                                               variable_name="canonical_genotypes")
+        
+        # Index genotypes already in the object. The earliest genotype with a
+        # given mutation set is canonical. 
+        self._canonical_index = {}
+        if self._canonical_genotypes:
+            for i in range(len(self._store.ids) - 1,-1,-1):
+                key = tuple(sorted(self._store.mutations[i]))
+                self._canonical_index[key] = int(self._store.ids[i])
+
+    @property
+    def num_merged(self):
+        """
+        Number of mutations that produced an existing genotype and were thus
+        collapsed onto that genotype's index (canonical_genotypes mode). 
+        """
+        return self._num_merged
+
+    @property
+    def fitness_cache_hits(self):
+        """
+        Number of fitness calculations answered by the fitness cache.
+        """
+        return self._fitness_cache_hits
+    
+    @property
+    def fitness_cache_misses(self):
+        """
+        Number of fitness calculations that missed the fitness cache and 
+        required evaluating the ensemble. 
+        """
+        return self._fitness_cache_misses
+
     @property
     def ddg_dict(self):
         """
@@ -384,9 +1117,121 @@ class Genotype:
         """
         return self._ddg_dict
 
+    @property
+    def ddg_array(self):
+        """
+        (num_mutations x num_species) array holding the energetic effects of 
+        every mutation, in the order of ddg_sites and ddg_mutations.
+        """
+        return self._ddg_array
+    
+    @property
+    def site_mutation_ids(self):
+        """
+        List holding the mutation ids (rows of ddg_array) available at each 
+        site, with sites in ddg_dict order.
+        """
+        return self._site_mutation_ids
 
+    @property
+    def ddg_sites(self):
+        """
+        Site for each row in ddg_array.
+        """
+        return self._ddg_sites
+    
+    @property
+    def ddg_mutations(self):
+        """
+        Mutation for each row in ddg_array.
+        """
+        return self._ddg_mutations
 
         
 
 
-    
\ No newline at end of file
+    
+
+
+def _snapshot_to_df(snapshot):
+    """
+    Build the genotype dataframe (see Genotype.df) from a snapshot created by
+    Genotype._snapshot.
+    """
+
+    mutation_names = snapshot["mutation_names"]
+    mutations = ["/".join([mutation_names[m] for m in muts])
+                 for muts in snapshot["mutations"]]
+    num_mutations = [len(muts) for muts in snapshot["mutations"]]
+
+    ancestors = snapshot["ancestors"]
+    depth = snapshot["depth"]
+    trajectories = [a[:d+1].tolist() for a, d in zip(ancestors,depth)]
+
+    step_names = np.array(snapshot["step_names"] + [""],dtype=object)
+    accum_mutations = ["/".join(s[:d]) for s, d in zip(step_names[snapshot["steps"]],depth)]
+    num_accum_mut = depth.tolist()
+
+    parent = pd.array(snapshot["parent"],dtype="Int64")
+    parent[parent < 0] = pd.NA
+
+    out = {"genotype":snapshot["genotype"].tolist(),
+           "mutations":mutations,
+           "num_mutations":num_mutations,
+           "accum_mut":accum_mutations,
+           "num_accum_mut":num_accum_mut,
+           "parent":parent,
+           "trajectory":trajectories}
+
+    # Get mutation energies
+    for i, name in enumerate(snapshot["species"]):
+        out[f"{name}_ddg"] = snapshot["energy"][:,i]
+
+    out["fitness"] = snapshot["fitness"]
+    
+    return pd.DataFrame(out)
+
+def _write_snapshot_csv(filename,snapshot):
+    """
+    Write a snapshot created by Genotype._snapshot to a csv file, appending if
+    the file already exists. Rows are formatted directly from the snapshot
+    arrays (matching the output of Genotype.df.to_csv) rather than going 
+    through a dataframe.
+    """
+
+    mutation_names = snapshot["mutation_names"]
+    step_names = np.array(snapshot["step_names"] + [""],dtype=object)
+    depth = snapshot["depth"]
+
+    columns = ["genotype","mutations","num_mutations","accum_mut",
+               "num_accum_mut","parent","trajectory"]
+    columns.extend([f"{name}_ddg" for name in snapshot["species"]])
+    columns.append("fitness")
+
+    # Convert to lists up front; indexing numpy arrays one element at a time 
+    # is slow. 
+    mutations = ["/".join([mutation_names[m] for m in muts])
+                 for muts in snapshot["mutations"]]
+    num_mutations = [len(muts) for muts in snapshot["mutations"]]
+    depth = depth.tolist()
+    accum_mut = ["/".join(s[:d]) for s, d in zip(step_names[snapshot["steps"]].tolist(),depth)]
+    parents = ["" if p < 0 else p for p in snapshot["parent"].tolist()]
+    trajectories = [f"{a[:d+1]}" for a, d in zip(snapshot["ancestors"].tolist(),depth)]
+
+    rows = zip(snapshot["genotype"].tolist(),
+               mutations,
+               num_mutations,
+               accum_mut,
+               depth,
+               parents,
+               trajectories,
+               *snapshot["energy"].T.tolist(),
+               snapshot["fitness"].tolist())
+
+    # Write out, either appending or creating a new file
+    write_header = not os.path.isfile(filename)
+    with open(filename,"a",newline="") as f:
+        w = csv.writer(f,lineterminator=os.linesep)
+        if write_header:
+            w.writerow(columns)
+        w.writerows(rows)
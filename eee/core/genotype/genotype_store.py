@@ -0,0 +1,567 @@
+"""
+Columnar storage for the genotypes seen during an evolutionary simulation.
+"""
+
+import numpy as np
+
+from collections.abc import Mapping
+
+def _grow(array,min_size):
+    """
+    Return a copy of array with its first dimension at least min_size long.
+    Capacity doubles so repeated appends are amortized O(1).
+    """
+
+    if len(array) >= min_size:
+        return array
+
+    new_size = max(min_size,2*len(array),16)
+    new_array = np.zeros((new_size,) + array.shape[1:],dtype=array.dtype)
+    new_array[:len(array)] = array
+
+    return new_array
+
+
+class GenotypeStore:
+    """
+    Store genotypes in growable numpy arrays rather than as individual Python
+    objects. Generally this will be initialized by Genotype.
+
+    Two tables are kept:
+
+        + lineage (indexed by slot, in increasing genotype id order): genotype
+          id, parent id, depth (number of mutations accumulated), the code of 
+          the mutation step that created the genotype, and the row of the 
+          genotype in the live table (-1 if the genotype has been dropped).
+          keep compacts the lineage table to the live genotypes and their 
+          ancestors, so trajectories of live genotypes can always be 
+          reconstructed by following parent pointers, while lineage memory 
+          follows the surviving lineages rather than every genotype ever
+          created. Genotype ids are never reused or renumbered.
+
+        + live (indexed by row): genotype id, fitness, an (N x num_species)
+          energy block, and the mutations present (a tuple of integer mutation
+          ids, in the order they were introduced).
+
+    Mutation step names (i.e. "A1V", "V1P") are interned as integer codes.
+
+    When more than one path reaches the same genotype (recurrent mutants 
+    collapsed onto one id), the first path defines the parent pointer. Every
+    other (parent, step) edge into the genotype is recorded as an alternate
+    parent (add_alternate_parent), so the other lineages are not lost. 
+
+    Trajectories are never stored as lists. They are reconstructed by walking
+    parent pointers, either one at a time (get_ancestors) or for many 
+    genotypes at once (get_ancestor_matrix). If cache_paths is True, paths
+    reconstructed by get_ancestors are memoized; later walks stop as soon as
+    they reach a cached ancestor. 
+    """
+
+    def __init__(self,num_species,cache_paths=False):
+        """
+        Initialize an empty store.
+
+        Parameters
+        ----------
+        num_species : int
+            number of species in the ensemble (width of the energy block)
+        cache_paths : bool, default=False
+            memoize trajectories reconstructed by get_ancestors. This trades
+            memory for speed when the same lineages are queried repeatedly.
+        """
+
+        self._num_species = num_species
+
+        self._cache_paths = bool(cache_paths)
+        self._path_cache = {}
+
+        # Lineage table
+        self._lineage_ids = np.zeros(0,dtype=np.int64)
+        self._num_lineage = 0
+        self._parent = np.zeros(0,dtype=np.int64)
+        self._depth = np.zeros(0,dtype=np.int32)
+        self._step = np.zeros(0,dtype=np.int32)
+        self._row = np.zeros(0,dtype=np.int64)
+        self._num_ids = 0
+
+        # Live table
+        self._ids = np.zeros(0,dtype=np.int64)
+        self._fitness = np.zeros(0,dtype=float)
+        self._energy = np.zeros((0,num_species),dtype=float)
+        self._mutations = []
+        self._num_rows = 0
+
+        # Alternate (parent, step) edges, keyed by genotype id
+        self._alt_parents = {}
+
+        # Interned mutation step names
+        self._step_names = []
+        self._step_codes = {}
+
+    def get_step_code(self,step_name):
+        """
+        Get the integer code for a mutation step name, creating a new code if
+        this name has not been seen.
+        """
+
+        if step_name not in self._step_codes:
+            self._step_codes[step_name] = len(self._step_names)
+            self._step_names.append(step_name)
+
+        return self._step_codes[step_name]
+
+    def add(self,parent,step,mutations,energy,fitness,depth=None):
+        """
+        Add a new genotype to the store.
+
+        Parameters
+        ----------
+        parent : int
+            id of the parent genotype (-1 for a genotype with no parent)
+        step : int
+            code of the mutation step that created this genotype (-1 for none)
+        mutations : tuple
+            integer ids of mutations present in the genotype
+        energy : numpy.ndarray
+            energetic effects of the mutations on each species
+        fitness : float
+            absolute fitness of the genotype
+        depth : int, optional
+            number of mutations accumulated by a genotype with no parent (for 
+            genotypes copied from another store). Ignored if parent is 
+            specified. 
+
+        Returns
+        -------
+        new_id : int
+            id of the new genotype
+        """
+
+        new_id = self._num_ids
+        slot = self._num_lineage
+        row = self._num_rows
+
+        # Make sure we have room
+        self._lineage_ids = _grow(self._lineage_ids,slot + 1)
+        self._parent = _grow(self._parent,slot + 1)
+        self._depth = _grow(self._depth,slot + 1)
+        self._step = _grow(self._step,slot + 1)
+        self._row = _grow(self._row,slot + 1)
+        self._ids = _grow(self._ids,row + 1)
+        self._fitness = _grow(self._fitness,row + 1)
+        self._energy = _grow(self._energy,row + 1)
+
+        # Record lineage
+        self._lineage_ids[slot] = new_id
+        self._parent[slot] = parent
+        if parent < 0:
+            if depth is None:
+                depth = 0
+            self._depth[slot] = depth
+        else:
+            self._depth[slot] = self._depth[self._get_slot(parent)] + 1
+        self._step[slot] = step
+        self._row[slot] = row
+
+        # Record live genotype
+        self._ids[row] = new_id
+        self._fitness[row] = fitness
+        self._energy[row] = energy
+        self._mutations.append(mutations)
+
+        self._num_ids += 1
+        self._num_lineage += 1
+        self._num_rows += 1
+
+        return new_id
+
+    def add_alternate_parent(self,index,parent,step):
+        """
+        Record that genotype index was also reached from genotype parent by 
+        mutation step (code). Edges matching the parent pointer of index, or
+        already recorded, are ignored. 
+
+        Returns
+        -------
+        added : bool
+            whether or not a new edge was recorded
+        """
+
+        index = int(index)
+        edge = (int(parent),int(step))
+
+        slot = self._get_slot(index)
+        if (self._parent[slot],self._step[slot]) == edge:
+            return False
+        
+        # Make sure the parent is in the lineage
+        self._get_slot(edge[0])
+
+        edges = self._alt_parents.setdefault(index,[])
+        if edge in edges:
+            return False
+        
+        edges.append(edge)
+        return True
+    
+    def get_alternate_parents(self,index):
+        """
+        Get the alternate (parent id, step code) edges into genotype index.
+        """
+        return list(self._alt_parents.get(int(index),[]))
+
+    def _find_slots(self,indexes):
+        """
+        Get the slots in the lineage table for an array of genotype ids. 
+        Returns -1 for ids that are not in the lineage table.
+        """
+
+        indexes = np.asarray(indexes,dtype=np.int64)
+        lineage_ids = self._lineage_ids[:self._num_lineage]
+
+        # Nothing has been compacted away: slot is the id
+        if self._num_lineage == self._num_ids:
+            return np.where(np.logical_and(indexes >= 0,indexes < self._num_ids),
+                            indexes,-1)
+
+        slots = np.searchsorted(lineage_ids,indexes)
+        slots = np.minimum(slots,max(self._num_lineage - 1,0))
+        found = np.zeros(indexes.shape,dtype=bool)
+        if self._num_lineage > 0:
+            found = lineage_ids[slots] == indexes
+        
+        return np.where(found,slots,-1)
+
+    def _get_slots(self,indexes):
+        """
+        Get the slots in the lineage table for an array of genotype ids. Raises
+        a KeyError if any genotype is not in the lineage table.
+        """
+
+        indexes = np.asarray(indexes,dtype=np.int64)
+        slots = self._find_slots(indexes)
+        if np.any(slots < 0):
+            err = f"\ngenotype(s) {indexes[slots < 0]} are not in the lineage\n\n"
+            raise KeyError(err)
+        
+        return slots
+    
+    def _get_slot(self,index):
+        """
+        Get the slot in the lineage table for genotype id index. 
+        """
+
+        return int(self._get_slots([int(index)])[0])
+
+    def contains(self,index):
+        """
+        Whether or not genotype id index is live in the store.
+        """
+
+        try:
+            index = int(index)
+        except (TypeError,ValueError):
+            return False
+
+        slot = self._find_slots([index])[0]
+        if slot < 0:
+            return False
+
+        return self._row[slot] >= 0
+
+    def get_rows(self,indexes):
+        """
+        Get the rows in the live table for an array of genotype ids. Raises a
+        KeyError if any genotype is not live.
+        """
+
+        indexes = np.asarray(indexes,dtype=np.int64)
+        slots = self._find_slots(indexes)
+        if np.any(slots < 0):
+            err = f"\ngenotype(s) {indexes[slots < 0]} are not in the store\n\n"
+            raise KeyError(err)
+
+        rows = self._row[slots]
+        if np.any(rows < 0):
+            err = f"\ngenotype(s) {indexes[rows < 0]} are not in the store\n\n"
+            raise KeyError(err)
+
+        return rows
+
+    def get_row(self,index):
+        """
+        Get the row in the live table for genotype id index. Raises a KeyError
+        if the genotype is not live.
+        """
+
+        if not self.contains(index):
+            err = f"\ngenotype {index} is not in the store\n\n"
+            raise KeyError(err)
+
+        return self._row[self._get_slot(index)]
+
+    def get_ancestors(self,index):
+        """
+        Return the list of genotype ids leading to index, starting at the
+        root of its lineage and ending with index.
+        """
+
+        index = int(index)
+        if index in self._path_cache:
+            return list(self._path_cache[index])
+
+        # Walk back until we hit the root or a memoized ancestor
+        out = [index]
+        prefix = ()
+        parent = int(self._parent[self._get_slot(index)])
+        while parent >= 0:
+            if parent in self._path_cache:
+                prefix = self._path_cache[parent]
+                break
+            out.append(parent)
+            parent = int(self._parent[self._get_slot(parent)])
+
+        path = list(prefix) + out[::-1]
+        if self._cache_paths:
+            self._path_cache[index] = tuple(path)
+
+        return path
+
+    def get_ancestor_matrix(self,indexes):
+        """
+        Reconstruct the trajectories of many genotypes at once by walking all
+        parent pointers in lock-step. 
+
+        Parameters
+        ----------
+        indexes : list-like
+            genotype ids
+        
+        Returns
+        -------
+        ancestors : numpy.ndarray
+            (num_indexes x max_depth + 1) array. Row i holds the trajectory to
+            indexes[i] (root first), padded on the right with -1.
+        depth : numpy.ndarray
+            depth of each genotype. The trajectory to indexes[i] is
+            ancestors[i,:depth[i] + 1]. 
+        """
+
+        indexes = np.asarray(indexes,dtype=np.int64)
+        depth = self._depth[self._get_slots(indexes)].astype(np.int64)
+
+        max_depth = 0
+        if len(indexes) > 0:
+            max_depth = int(np.max(depth))
+
+        ancestors = -np.ones((len(indexes),max_depth + 1),dtype=np.int64)
+        rows = np.arange(len(indexes))
+
+        # Each pass writes the current node into its slot, then steps every
+        # walk one generation back. 
+        current = indexes.copy()
+        for k in range(max_depth + 1):
+            active = depth >= k
+            ancestors[rows[active],depth[active] - k] = current[active]
+            
+            # Roots of a lineage have parent -1; stop walking them
+            active = np.logical_and(active,current >= 0)
+            current[active] = self._parent[self._get_slots(current[active])]
+
+        return ancestors, depth
+
+    def get_steps(self,index):
+        """
+        Return the list of mutation step names that led to genotype index.
+        """
+
+        trajectory = self.get_ancestors(index)
+        steps = self.get_step(trajectory)
+        return [self._step_names[s] for s in steps if s >= 0]
+
+    def get_parent(self,indexes):
+        """
+        Get the parent ids of an array of genotype ids (-1 if none). 
+        """
+        return self._parent[self._get_slots(indexes)]
+
+    def get_depth(self,indexes):
+        """
+        Get the number of mutations accumulated for an array of genotype ids.
+        """
+        return self._depth[self._get_slots(indexes)]
+
+    def get_step(self,indexes):
+        """
+        Get the code of the mutation step that created each genotype id in an
+        array (-1 if none).
+        """
+        return self._step[self._get_slots(indexes)]
+
+    def keep(self,keep_ids=None):
+        """
+        Drop all live genotypes except those in keep_ids. Lineage information
+        is retained for the kept genotypes and all of their ancestors 
+        (following both parent pointers and alternate parents); the lineage of
+        every other genotype is dropped. 
+
+        Parameters
+        ----------
+        keep_ids : list-like, optional
+            genotype ids to keep. If None, drop all genotypes.
+        """
+
+        if keep_ids is None:
+            keep_ids = []
+
+        keep_rows = self.get_rows(keep_ids)
+        keep_rows = np.unique(keep_rows)
+
+        # Genotypes whose lineage must survive: kept genotypes and everything
+        # on the paths back to their roots
+        lineage_set = set()
+        to_walk = self._ids[keep_rows]
+        while len(to_walk) > 0:
+            
+            ancestors, _ = self.get_ancestor_matrix(to_walk)
+            new_ids = set(ancestors[ancestors >= 0].tolist()) - lineage_set
+            lineage_set.update(new_ids)
+
+            # Follow alternate parents we have not seen yet
+            alt = set()
+            for i in new_ids:
+                for parent, _ in self._alt_parents.get(i,[]):
+                    if parent not in lineage_set:
+                        alt.add(parent)
+            to_walk = np.array(sorted(alt),dtype=np.int64)
+
+        lineage_keep = np.array(sorted(lineage_set),dtype=np.int64)
+        keep_slots = self._get_slots(lineage_keep)
+
+        self._alt_parents = dict([(k,v) for k, v in self._alt_parents.items()
+                                  if k in lineage_set])
+
+        self._lineage_ids = self._lineage_ids[keep_slots].copy()
+        self._parent = self._parent[keep_slots].copy()
+        self._depth = self._depth[keep_slots].copy()
+        self._step = self._step[keep_slots].copy()
+        self._row = self._row[keep_slots].copy()
+        self._num_lineage = len(keep_slots)
+
+        if len(self._path_cache) > 0:
+            self._path_cache = dict([(k,v) for k, v in self._path_cache.items()
+                                     if k in lineage_set])
+
+        # Mark everything as dropped, then record new rows for kept genotypes
+        self._row[:] = -1
+
+        self._ids = self._ids[keep_rows].copy()
+        self._fitness = self._fitness[keep_rows].copy()
+        self._energy = self._energy[keep_rows].copy()
+        self._mutations = [self._mutations[r] for r in keep_rows]
+        self._num_rows = len(keep_rows)
+
+        self._row[self._get_slots(self._ids)] = np.arange(self._num_rows,dtype=np.int64)
+
+    def __len__(self):
+        return self._num_rows
+
+    @property
+    def ids(self):
+        """
+        Live genotype ids (in the order they were added).
+        """
+        return self._ids[:self._num_rows]
+
+    @property
+    def fitness(self):
+        """
+        Fitness of live genotypes (row order).
+        """
+        return self._fitness[:self._num_rows]
+
+    @property
+    def energy(self):
+        """
+        (num_live x num_species) mutation energies of live genotypes (row order).
+        """
+        return self._energy[:self._num_rows]
+
+    @property
+    def mutations(self):
+        """
+        List of tuples holding integer mutation ids for live genotypes (row
+        order).
+        """
+        return self._mutations
+
+    @property
+    def lineage_ids(self):
+        """
+        Genotype ids in the lineage table (increasing order). 
+        """
+        return self._lineage_ids[:self._num_lineage]
+
+    @property
+    def parent(self):
+        """
+        Parent id for every genotype in the lineage table (lineage_ids order;
+        -1 if none).
+        """
+        return self._parent[:self._num_lineage]
+
+    @property
+    def depth(self):
+        """
+        Number of mutations accumulated for every genotype in the lineage 
+        table (lineage_ids order).
+        """
+        return self._depth[:self._num_lineage]
+
+    @property
+    def step(self):
+        """
+        Code of the mutation step that created every genotype in the lineage
+        table (lineage_ids order; -1 if none).
+        """
+        return self._step[:self._num_lineage]
+
+    @property
+    def step_names(self):
+        """
+        Mutation step names, indexed by step code.
+        """
+        return self._step_names
+
+    @property
+    def num_ids(self):
+        """
+        Number of genotype ids ever added.
+        """
+        return self._num_ids
+
+
+class GenotypeStoreView(Mapping):
+    """
+    Read-only, dictionary-like view of the live genotypes in a GenotypeStore.
+    Keys are genotype ids; values are generated on demand by getter, a
+    function that takes a genotype id.
+    """
+
+    def __init__(self,store,getter):
+        self._store = store
+        self._getter = getter
+
+    def __getitem__(self,index):
+        if not self._store.contains(index):
+            raise KeyError(index)
+        return self._getter(int(index))
+
+    def __contains__(self,index):
+        return self._store.contains(index)
+
+    def __iter__(self):
+        return iter(self._store.ids.tolist())
+
+    def __len__(self):
+        return len(self._store)
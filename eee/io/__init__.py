@@ -12,4 +12,11 @@ from .write_pdb import write_pdb
 from .write_fasta import write_fasta
 
 from .read_tree import read_tree
-from .write_tree import write_tree
\ No newline at end of file
+from .write_tree import write_tree
+
+from .generations import write_generations
+from .generations import read_generations
+from .generations import read_generation_block
+from .generations import read_genotype_history
+
+from .exhaustive import read_exhaustive
@@ -0,0 +1,157 @@
+"""
+Write simulation outputs on a background thread so a simulation and its file
+I/O can overlap.
+"""
+
+import queue
+import threading
+
+class BackgroundWriterException(Exception):
+    pass
+
+class BackgroundWriter:
+    """
+    Run write jobs, in the order they were submitted, on a single background
+    thread.
+
+    Jobs wait in a bounded queue. If the queue is full, submit blocks until
+    the writer catches up (back-pressure), so a simulation can never get more
+    than max_queue_size dumps ahead of the disk. If a job raises an exception,
+    the writer stops running jobs (anything still queued is dropped) and the
+    exception is re-raised (wrapped in a BackgroundWriterException) on the
+    next call to check, submit, or close. check is a cheap attribute test, so
+    a long-running caller can call it every iteration to stop promptly. Jobs
+    should only be handed snapshots that the caller will not modify.
+
+    Usage:
+
+    with BackgroundWriter() as writer:
+        writer.submit(some_write_function,*args,**kwargs)
+        ...
+
+    Leaving the context waits for all submitted jobs to finish. If threaded
+    is False, jobs run immediately on the calling thread.
+    """
+
+    def __init__(self,max_queue_size=2,threaded=True):
+        """
+        Parameters
+        ----------
+        max_queue_size : int, default=2
+            maximum number of jobs waiting to be written
+        threaded : bool, default=True
+            run jobs on a background thread. If False, run each job as it is
+            submitted.
+        """
+
+        self._threaded = bool(threaded)
+        self._error = None
+        self._closed = False
+
+        self._queue = None
+        self._thread = None
+        if self._threaded:
+            self._queue = queue.Queue(maxsize=max_queue_size)
+            self._thread = threading.Thread(target=self._worker,daemon=True)
+            self._thread.start()
+
+    def _worker(self):
+        """
+        Pull jobs off the queue until we get the None sentinel. After a
+        failure, keep draining the queue (without running jobs) so submit
+        never blocks forever.
+        """
+
+        while True:
+
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+
+            if self._error is None:
+                fcn, args, kwargs = job
+                try:
+                    fcn(*args,**kwargs)
+                except Exception as e:
+                    self._error = e
+
+            self._queue.task_done()
+
+    def _check_error(self):
+        """
+        Raise an exception if a job has failed.
+        """
+
+        if self._error is not None:
+            err = "\n\nA background write failed. Check error stack for cause of\n"
+            err += "this error.\n\n"
+            raise BackgroundWriterException(err) from self._error
+
+    def check(self):
+        """
+        Raise a BackgroundWriterException if a job has failed. Does not wait
+        for queued jobs.
+        """
+
+        self._check_error()
+
+    def submit(self,fcn,*args,**kwargs):
+        """
+        Queue fcn(*args,**kwargs) to run on the writer thread. Blocks if the
+        queue is full.
+        """
+
+        if self._closed:
+            err = "\nthis writer has been closed\n\n"
+            raise RuntimeError(err)
+
+        self._check_error()
+
+        if not self._threaded:
+            try:
+                fcn(*args,**kwargs)
+            except Exception as e:
+                self._error = e
+                self._check_error()
+            return
+
+        self._queue.put((fcn,args,kwargs))
+
+    def close(self):
+        """
+        Wait for all submitted jobs to finish and stop the writer thread.
+        Raises a BackgroundWriterException if any job failed.
+        """
+
+        if not self._closed:
+            self._closed = True
+            if self._threaded:
+                self._queue.put(None)
+                self._thread.join()
+
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+
+        # If the with block is already raising, finish up but do not mask
+        # that exception with one from the writer.
+        if exc_type is not None:
+            try:
+                self.close()
+            except BackgroundWriterException:
+                pass
+            return False
+
+        self.close()
+        return False
+
+    @property
+    def error(self):
+        """
+        Exception raised by a failed job (None if no job has failed).
+        """
+        return self._error
@@ -0,0 +1,176 @@
+"""
+Read and write the output of an exhaustive (deep mutational) scan.
+
+Scans are written one batch of genotypes at a time, either appended to a csv
+file or as compressed, columnar numpy .npz blocks in a directory. A block
+holds:
+
+    + genotype: genotype number
+    + mutations: (num_genotypes x max_depth) integer mutation ids (rows of
+      the ddg array), padded on the right with -1
+    + energy: (num_genotypes x num_species) mutation energies
+    + fitness: absolute fitness of each genotype
+
+The directory also holds metadata.npz with the mutation names (indexed by
+mutation id) and species names.
+"""
+
+import numpy as np
+import pandas as pd
+
+import csv
+import glob
+import os
+
+def _mutation_strings(mutations,mutation_names):
+    """
+    Convert a padded mutation id matrix into "/"-joined mutation strings.
+    """
+
+    return ["/".join([mutation_names[m] for m in row if m >= 0])
+            for row in mutations.tolist()]
+
+
+def exhaustive_block_to_df(block):
+    """
+    Convert a block of exhaustive scan output into a dataframe.
+
+    Parameters
+    ----------
+    block : dict
+        dictionary with genotype, mutations, energy, fitness, mutation_names
+        and species keys
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        dataframe with genotype, mutations, num_mutations, {species}_ddg and
+        fitness columns
+    """
+
+    out = {"genotype":block["genotype"],
+           "mutations":_mutation_strings(block["mutations"],
+                                         block["mutation_names"]),
+           "num_mutations":np.sum(block["mutations"] >= 0,axis=1)}
+    for i, name in enumerate(block["species"]):
+        out[f"{name}_ddg"] = block["energy"][:,i]
+    out["fitness"] = block["fitness"]
+
+    return pd.DataFrame(out)
+
+
+def append_exhaustive_csv(filename,block):
+    """
+    Append a block of exhaustive scan output to a csv file, writing a header
+    if the file does not exist yet. The first column holds the row number
+    (equal to the genotype number), matching the output of 
+    exhaustive_block_to_df(block).to_csv(filename) for a complete scan.
+
+    Parameters
+    ----------
+    filename : str
+        csv file to write
+    block : dict
+        dictionary with genotype, mutations, energy, fitness, mutation_names
+        and species keys
+    """
+
+    columns = ["","genotype","mutations","num_mutations"]
+    columns.extend([f"{name}_ddg" for name in block["species"]])
+    columns.append("fitness")
+
+    genotype = block["genotype"].tolist()
+    rows = zip(genotype,
+               genotype,
+               _mutation_strings(block["mutations"],block["mutation_names"]),
+               np.sum(block["mutations"] >= 0,axis=1).tolist(),
+               *block["energy"].T.tolist(),
+               block["fitness"].tolist())
+
+    write_header = not os.path.isfile(filename)
+    with open(filename,"a",newline="") as f:
+        w = csv.writer(f,lineterminator=os.linesep)
+        if write_header:
+            w.writerow(columns)
+        w.writerows(rows)
+
+
+def write_exhaustive_block(directory,counter,block):
+    """
+    Write a block of exhaustive scan output as a compressed npz file in
+    directory. The first block (counter == 0) also writes metadata.npz.
+
+    Parameters
+    ----------
+    directory : str
+        output directory (created if it does not exist)
+    counter : int
+        block number
+    block : dict
+        dictionary with genotype, mutations, energy, fitness, mutation_names
+        and species keys
+    """
+
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+
+    if counter == 0:
+        with open(os.path.join(directory,"metadata.npz"),"wb") as f:
+            np.savez_compressed(f,
+                                mutation_names=np.array(block["mutation_names"],dtype=str),
+                                species=np.array(block["species"],dtype=str))
+
+    with open(os.path.join(directory,f"block_{counter:06d}.npz"),"wb") as f:
+        np.savez_compressed(f,
+                            genotype=block["genotype"],
+                            mutations=block["mutations"],
+                            energy=block["energy"],
+                            fitness=block["fitness"])
+
+
+def read_exhaustive(output):
+    """
+    Read the output of an exhaustive scan.
+
+    Parameters
+    ----------
+    output : str
+        csv file or directory of npz blocks written by exhaustive
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        dataframe with genotype, mutations, num_mutations, {species}_ddg and
+        fitness columns
+    """
+
+    if not os.path.isdir(output):
+        df = pd.read_csv(output,index_col=0)
+        df["mutations"] = df["mutations"].fillna("")
+        return df
+
+    with np.load(os.path.join(output,"metadata.npz")) as data:
+        mutation_names = list(data["mutation_names"])
+        species = list(data["species"])
+
+    block_files = glob.glob(os.path.join(output,"block_*.npz"))
+    block_files.sort()
+
+    dfs = []
+    for block_file in block_files:
+        with np.load(block_file) as data:
+            block = {k:data[k] for k in data.files}
+        block["mutation_names"] = mutation_names
+        block["species"] = species
+        dfs.append(exhaustive_block_to_df(block))
+
+    if len(dfs) == 0:
+        block = {"genotype":np.zeros(0,dtype=int),
+                 "mutations":np.zeros((0,1),dtype=int),
+                 "energy":np.zeros((0,len(species)),dtype=float),
+                 "fitness":np.zeros(0,dtype=float),
+                 "mutation_names":mutation_names,
+                 "species":species}
+        return exhaustive_block_to_df(block)
+
+    return pd.concat(dfs,ignore_index=True)
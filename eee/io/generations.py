@@ -0,0 +1,270 @@
+"""
+Read and write the populations recorded over generations of a Wright-Fisher
+simulation.
+
+Generations can be stored as pickled lists of {genotype:count} dictionaries
+(the original format) or as compressed, columnar numpy .npz blocks. Records
+in a block are split into chunks of consecutive generations, each stored as
+its own compressed arrays. A block holds:
+
+    + generation: generation number of each generation in the block
+    + offsets: offsets[i]:offsets[i+1] are the records holding generation i
+    + chunks: chunks[j]:chunks[j+1] are the generations stored in chunk j
+    + genotype_{j}: genotype index for each (generation, genotype) record in
+      chunk j
+    + count_{j}: number of individuals with genotype in that generation for
+      each record in chunk j
+
+Arrays in an npz file are decompressed independently when accessed. The 
+generation, offsets, and chunks arrays are an index from generation to chunk
+and record, so reading a range of generations only decompresses the chunks
+that hold them. Reading a genotype's history scans the genotype arrays and
+only decompresses counts for chunks where the genotype appears. 
+"""
+
+import numpy as np
+
+import pickle
+import os
+
+def _chunk_name(column,chunk):
+    """
+    Name of the array holding column for chunk in an npz block. 
+    """
+
+    return f"{column}_{chunk:06d}"
+
+def _read_chunks(data,first,last):
+    """
+    Read the records for generations first:last (indexes within the block)
+    from an open npz block (data). Only the chunks holding those generations
+    are decompressed. Returns genotypes, counts, and offsets (relative to the
+    first record returned). 
+    """
+
+    offsets = data["offsets"]
+    if last <= first:
+        empty = np.zeros(0,dtype=np.int64)
+        return empty, empty.copy(), np.zeros(1,dtype=np.int64)
+
+    chunks = data["chunks"]
+    first_chunk = np.searchsorted(chunks,first,side="right") - 1
+    last_chunk = np.searchsorted(chunks,last - 1,side="right") - 1
+
+    genotypes = []
+    counts = []
+    for j in range(first_chunk,last_chunk + 1):
+        genotypes.append(data[_chunk_name("genotype",j)])
+        counts.append(data[_chunk_name("count",j)])
+    genotypes = np.concatenate(genotypes)
+    counts = np.concatenate(counts)
+
+    # Trim records outside of first:last
+    base = offsets[chunks[first_chunk]]
+    a = offsets[first] - base
+    b = offsets[last] - base
+
+    return genotypes[a:b], counts[a:b], offsets[first:last + 1] - offsets[first]
+
+def write_generations(filename,
+                      generations,
+                      first_generation=0,
+                      chunk_size=100):
+    """
+    Write generations to a compressed, columnar npz block.
+
+    Parameters
+    ----------
+    filename : str
+        file to write. Should end in ".npz".
+    generations : list
+        list of generations. Each entry is either a (genotypes, counts) tuple
+        of arrays or a {genotype:count} dictionary.
+    first_generation : int, default=0
+        generation number of the first generation in generations
+    chunk_size : int, default=100
+        number of generations to compress together. Reading any generation
+        decompresses its whole chunk. 
+    """
+
+    genotypes = []
+    counts = []
+    offsets = np.zeros(len(generations) + 1,dtype=np.int64)
+    for i, g in enumerate(generations):
+
+        if issubclass(type(g),dict):
+            g = (list(g.keys()),list(g.values()))
+
+        genotypes.append(np.asarray(g[0],dtype=np.int64))
+        counts.append(np.asarray(g[1],dtype=np.int64))
+        offsets[i+1] = offsets[i] + len(genotypes[-1])
+
+    if len(generations) > 0:
+        genotypes = np.concatenate(genotypes)
+        counts = np.concatenate(counts)
+    else:
+        genotypes = np.zeros(0,dtype=np.int64)
+        counts = np.zeros(0,dtype=np.int64)
+
+    generation = np.arange(first_generation,
+                           first_generation + len(generations),
+                           dtype=np.int64)
+
+    chunks = np.arange(0,len(generations),chunk_size,dtype=np.int64)
+    chunks = np.append(chunks,len(generations))
+
+    arrays = {"generation":generation,
+              "offsets":offsets,
+              "chunks":chunks}
+    for j in range(len(chunks) - 1):
+        a = offsets[chunks[j]]
+        b = offsets[chunks[j+1]]
+        arrays[_chunk_name("genotype",j)] = genotypes[a:b]
+        arrays[_chunk_name("count",j)] = counts[a:b]
+
+    with open(filename,"wb") as f:
+        np.savez_compressed(f,**arrays)
+
+
+def read_generations(filename,
+                     start=None,
+                     stop=None):
+    """
+    Read generations from a pickle or npz file.
+
+    Parameters
+    ----------
+    filename : str
+        file to read (pickle file or npz block)
+    start : int, optional
+        first generation to read, counting from the first generation in the
+        file
+    stop : int, optional
+        read up to (but not including) this generation, counting from the
+        first generation in the file
+
+    Returns
+    -------
+    generations : list
+        list of {genotype:count} dictionaries
+    """
+
+    if os.path.splitext(filename)[1] != ".npz":
+        with open(filename,"rb") as f:
+            generations = pickle.load(f)
+        return generations[start:stop]
+
+    genotypes, counts, offsets = read_generation_block(filename,
+                                                       start=start,
+                                                       stop=stop)
+
+    generations = []
+    for i in range(len(offsets) - 1):
+        a = offsets[i]
+        b = offsets[i+1]
+        generations.append(dict(zip(genotypes[a:b].tolist(),
+                                    counts[a:b].tolist())))
+
+    return generations
+
+
+def read_generation_block(filename,
+                          start=None,
+                          stop=None):
+    """
+    Read generations in a pickle or npz file as flat arrays.
+
+    Parameters
+    ----------
+    filename : str
+        file to read (pickle file or npz block)
+    start : int, optional
+        first generation to read, counting from the first generation in the
+        file
+    stop : int, optional
+        read up to (but not including) this generation, counting from the
+        first generation in the file
+
+    Returns
+    -------
+    genotypes : numpy.ndarray
+        genotype index for each (generation, genotype) record
+    counts : numpy.ndarray
+        number of individuals for each record
+    offsets : numpy.ndarray
+        offsets[i]:offsets[i+1] are the records for the ith generation read
+    """
+
+    if os.path.splitext(filename)[1] == ".npz":
+        with np.load(filename) as data:
+            num_generations = len(data["generation"])
+            first, last, _ = slice(start,stop).indices(num_generations)
+            return _read_chunks(data,first,last)
+
+    with open(filename,"rb") as f:
+        generations = pickle.load(f)
+    generations = generations[start:stop]
+
+    offsets = np.zeros(len(generations) + 1,dtype=np.int64)
+    offsets[1:] = np.cumsum([len(g) for g in generations])
+
+    genotypes = np.zeros(offsets[-1],dtype=np.int64)
+    counts = np.zeros(offsets[-1],dtype=np.int64)
+    for i, g in enumerate(generations):
+        genotypes[offsets[i]:offsets[i+1]] = list(g.keys())
+        counts[offsets[i]:offsets[i+1]] = list(g.values())
+
+    return genotypes, counts, offsets
+
+
+def read_genotype_history(filenames,
+                          genotype):
+    """
+    Get the number of individuals with a given genotype over generations
+    stored in npz blocks.
+
+    Parameters
+    ----------
+    filenames : list
+        npz files to read (in order)
+    genotype : int
+        genotype index
+
+    Returns
+    -------
+    generation : numpy.ndarray
+        generation numbers
+    count : numpy.ndarray
+        number of individuals with genotype in each generation (0 if absent)
+    """
+
+    all_generations = []
+    all_counts = []
+    for filename in filenames:
+
+        with np.load(filename) as data:
+
+            generation = data["generation"]
+            offsets = data["offsets"]
+            chunks = data["chunks"]
+
+            counts = np.zeros(len(generation),dtype=np.int64)
+            for j in range(len(chunks) - 1):
+
+                # Only decompress counts for chunks holding genotype
+                rows = np.flatnonzero(data[_chunk_name("genotype",j)] == genotype)
+                if len(rows) == 0:
+                    continue
+                found = data[_chunk_name("count",j)][rows]
+
+                # Map rows back onto the generation they came from
+                rows = rows + offsets[chunks[j]]
+                counts[np.searchsorted(offsets,rows,side="right") - 1] = found
+
+        all_generations.append(generation)
+        all_counts.append(counts)
+
+    if len(filenames) == 0:
+        return np.zeros(0,dtype=np.int64), np.zeros(0,dtype=np.int64)
+
+    return np.concatenate(all_generations), np.concatenate(all_counts)
@@ -141,7 +141,9 @@ def read_json(json_file,
         ddg loaded.
     calc_params : dict
         dictionary with run parameters. sc.run(**calc_params) will run the 
-        calculation. 
+        calculation. If the json file was written by run_replicates, 
+        calc_params also has num_replicates and num_workers keys and 
+        sc.run_replicates(**calc_params) will run the calculation. 
     """
 
     # Read json file
@@ -233,9 +235,19 @@ def read_json(json_file,
     # Set up the calculation class. 
     sc = calc_class(**setup_kwargs)
 
+    # Calculations run as replicates store num_replicates and num_workers 
+    # (arguments to run_replicates) alongside the arguments to run. 
+    run_kwargs = dict(calc_input["calc_params"])
+    replicate_kwargs = {}
+    if hasattr(sc,"run_replicates"):
+        for k in ["num_replicates","num_workers"]:
+            if k in run_kwargs:
+                replicate_kwargs[k] = run_kwargs.pop(k)
+
     calc_params = _validate_calc_kwargs(calc_type=calc_type,
                                         calc_function=sc.run,
-                                        kwargs=calc_input["calc_params"])
+                                        kwargs=run_kwargs)
+    calc_params.update(replicate_kwargs)
 
     return sc, calc_params
 
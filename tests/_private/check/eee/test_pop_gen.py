@@ -6,6 +6,8 @@ from eee._private.check.eee.pop_gen import check_population_size
 from eee._private.check.eee.pop_gen import check_num_generations
 from eee._private.check.eee.pop_gen import check_burn_in_generations
 from eee._private.check.eee.pop_gen import check_num_mutations
+from eee._private.check.eee.pop_gen import check_step_mode
+from eee._private.check.eee.pop_gen import check_output_format
 
 
 def test_check_mutation_rate(variable_types):
@@ -103,4 +105,21 @@ def test_check_num_mutations(variable_types):
         
         with pytest.raises(ValueError):
             check_num_mutations(num_mutations=v)
-    
\ No newline at end of file
+
+def test_check_step_mode():
+
+    for v in ["individual","multinomial"]:
+        assert check_step_mode(step_mode=v) == v
+
+    for v in ["not_a_mode",None,1,"Individual"]:
+        with pytest.raises(ValueError):
+            check_step_mode(step_mode=v)
+
+def test_check_output_format():
+
+    for v in ["pickle","npz"]:
+        assert check_output_format(output_format=v) == v
+
+    for v in ["not_a_format",None,1,"csv"]:
+        with pytest.raises(ValueError):
+            check_output_format(output_format=v)
@@ -0,0 +1,219 @@
+import pytest
+
+from eee.analysis.wf.summary import _get_fitness_lookup
+from eee.analysis.wf.summary import _HeavyHitters
+from eee.analysis.wf.summary import _weighted_fitness_stats
+from eee.analysis.wf.summary import summarize_generations
+from eee.analysis.wf.summary import fitness_and_variance
+from eee.analysis.wf.summary import extract_key_trajectories
+from eee.io.generations import write_generations
+
+import numpy as np
+import pandas as pd
+
+import os
+import pickle
+
+def _random_generations(num_generations,num_genotypes,population_size,seed):
+    """
+    Generate random generations (list of dicts) for testing.
+    """
+
+    rng = np.random.Generator(np.random.PCG64(seed))
+    generations = []
+    for _ in range(num_generations):
+        seen = rng.choice(num_genotypes,
+                          size=rng.integers(1,num_genotypes),
+                          replace=False)
+        seen.sort()
+        counts = rng.multinomial(population_size - len(seen),
+                                 np.ones(len(seen))/len(seen)) + 1
+        generations.append(dict(zip(seen.tolist(),counts.tolist())))
+
+    return generations
+
+def test__get_fitness_lookup():
+
+    genotypes = pd.DataFrame({"genotype":[0,2,5],
+                              "fitness":[1.0,0.5,0.25]}).set_index("genotype")
+    lookup = _get_fitness_lookup(genotypes)
+    assert len(lookup) == 6
+    assert lookup[0] == 1.0
+    assert lookup[2] == 0.5
+    assert lookup[5] == 0.25
+    assert np.isnan(lookup[1])
+
+def test__HeavyHitters():
+
+    # Exact when we have room for all genotypes
+    sketch = _HeavyHitters(max_tracked=10)
+    sketch.update(genotypes=np.array([0,1,0,2]),
+                  counts=np.array([5,5,8,2]),
+                  generation=np.array([0,0,1,1]))
+    sketch.update(genotypes=np.array([3,0]),
+                  counts=np.array([4,6]),
+                  generation=np.array([2,2]))
+    assert np.array_equal(sketch.genotypes,[0,1,2,3])
+    assert np.array_equal(sketch.counts,[19,5,2,4])
+    assert np.array_equal(sketch.first_seen,[0,0,1,2])
+    assert sketch.history.shape == (3,6)
+
+    # Bounded. Rare genotypes dropped along with their history. 
+    sketch = _HeavyHitters(max_tracked=2)
+    sketch.update(genotypes=np.array([0,1,0,2]),
+                  counts=np.array([5,5,8,2]),
+                  generation=np.array([0,0,1,1]))
+    assert np.array_equal(sketch.genotypes,[0,1])
+    assert np.array_equal(sketch.counts,[11,3])
+    sketch.update(genotypes=np.array([3,0]),
+                  counts=np.array([4,6]),
+                  generation=np.array([2,2]))
+    assert len(sketch.genotypes) <= 2
+    assert 0 in sketch.genotypes
+    assert np.all(np.isin(sketch.history[1],sketch.genotypes))
+
+def test_summarize_generations(tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    population_size = 100
+    generations = _random_generations(num_generations=50,
+                                      num_genotypes=20,
+                                      population_size=population_size,
+                                      seed=0)
+    fitness = np.random.Generator(np.random.PCG64(1)).random(20)
+    genotypes = pd.DataFrame({"genotype":np.arange(20),
+                              "fitness":fitness}).set_index("genotype")
+
+    # Write as pickle and npz blocks
+    pickle_files = []
+    npz_files = []
+    for i in range(5):
+        block = generations[i*10:(i+1)*10]
+        with open(f"test_{i}.pickle","wb") as f:
+            pickle.dump(block,f)
+        write_generations(f"test_{i}.npz",block,first_generation=i*10)
+        pickle_files.append(f"test_{i}.pickle")
+        npz_files.append(f"test_{i}.npz")
+
+    # Brute-force fitness mean, standard deviation, and median
+    mu = []
+    std = []
+    median = []
+    for g in generations:
+        fitness_vector = []
+        for k in g:
+            fitness_vector.extend([fitness[k] for _ in range(g[k])])
+        mu.append(np.mean(fitness_vector))
+        std.append(np.std(fitness_vector))
+        median.append(np.quantile(fitness_vector,0.5,method="inverted_cdf"))
+
+    # Brute-force frequencies
+    freq = np.zeros((50,20))
+    for i, g in enumerate(generations):
+        for k in g:
+            freq[i,k] = g[k]/population_size
+
+    for files in [pickle_files,npz_files]:
+
+        fit_df, traj_df = summarize_generations(pickle_files=files,
+                                                genotypes=genotypes,
+                                                key_genotype_cutoff=0,
+                                                verbose=False)
+        
+        assert np.allclose(fit_df["mu"],mu)
+        assert np.allclose(fit_df["std"],std)
+        assert np.allclose(fit_df["median"],median)
+        assert list(fit_df.columns) == ["mu","std","skew","kurtosis",
+                                        "median","p5","p95"]
+        
+        assert len(traj_df) == 50
+        for c in traj_df.columns:
+            if c == "other":
+                continue
+            assert np.allclose(traj_df[c],freq[:,int(c)])
+        assert np.allclose(traj_df["other"],0)
+
+        # Columns in the order genotypes first appear
+        first_seen = []
+        for g in generations:
+            for k in g:
+                if f"{k}" not in first_seen:
+                    first_seen.append(f"{k}")
+        assert list(traj_df.columns[:-1]) == first_seen
+
+        # Filter out rare genotypes; those go into other
+        _, traj_df = summarize_generations(pickle_files=files,
+                                           key_genotype_cutoff=0.2,
+                                           verbose=False)
+        assert len(traj_df.columns) < 21
+        assert np.allclose(np.sum(traj_df,axis=1),1)
+        assert np.all(traj_df["other"] >= 0)
+        assert np.sum(traj_df["other"]) > 0
+
+        # Wrappers
+        fit_df = fitness_and_variance(genotypes=genotypes,
+                                      pickle_files=files,
+                                      verbose=False)
+        assert np.allclose(fit_df["mu"],mu)
+
+        traj_df = extract_key_trajectories(pickle_files=files,
+                                           key_genotype_cutoff=0,
+                                           verbose=False)
+        assert len(traj_df.columns) == 21
+
+    # Bounded number of tracked genotypes. Still gets frequencies of most
+    # common genotypes. 
+    _, traj_df = summarize_generations(pickle_files=npz_files,
+                                       key_genotype_cutoff=0,
+                                       max_tracked_genotypes=5,
+                                       verbose=False)
+    assert len(traj_df.columns) <= 6
+
+    os.chdir(current_dir)
+
+def test__weighted_fitness_stats():
+
+    rng = np.random.Generator(np.random.PCG64(2))
+
+    num_generations = 20
+    local_gen = np.repeat(np.arange(num_generations),rng.integers(1,10,size=num_generations))
+    fitness = np.round(rng.random(len(local_gen)),2)
+    counts = rng.integers(0,50,size=len(local_gen))
+    counts[0] = 1
+
+    stats = _weighted_fitness_stats(fitness=fitness,
+                                    counts=counts,
+                                    local_gen=local_gen,
+                                    num_generations=num_generations)
+
+    for i in range(num_generations):
+
+        mask = local_gen == i
+        expanded = np.repeat(fitness[mask],counts[mask])
+        
+        mu = np.mean(expanded)
+        std = np.std(expanded)
+        assert np.isclose(stats["mu"][i],mu)
+        assert np.isclose(stats["std"][i],std)
+
+        if std > 0:
+            z = (expanded - mu)/std
+            assert np.isclose(stats["skew"][i],np.mean(z**3))
+            assert np.isclose(stats["kurtosis"][i],np.mean(z**4) - 3)
+
+        for key, q in [("p5",0.05),("median",0.5),("p95",0.95)]:
+            expected = np.quantile(expanded,q,method="inverted_cdf")
+            assert stats[key][i] == expected
+
+    # Empty generations get nan
+    stats = _weighted_fitness_stats(fitness=np.array([0.5,1.0]),
+                                    counts=np.array([1,3]),
+                                    local_gen=np.array([1,1]),
+                                    num_generations=3)
+    assert np.isnan(stats["mu"][0])
+    assert np.isnan(stats["median"][0])
+    assert np.isnan(stats["median"][2])
+    assert stats["median"][1] == 1.0
+    assert stats["p5"][1] == 0.5
@@ -53,6 +53,7 @@ def test_AccessiblePaths_run(ens_test_data,tmpdir):
     assert kwargs["allow_neutral"] == True
     assert kwargs["find_all_paths"] == True
     assert kwargs["output_file"] == "yo.csv"
+    assert kwargs["unique_genotypes"] == False
 
     os.chdir("..")
 
@@ -2,6 +2,7 @@ import pytest
 
 from eee.calcs import DeepMutationalScan
 from eee.calcs import read_json
+from eee.io import read_exhaustive
 
 import os
 
@@ -49,8 +50,43 @@ def test_DeepMutationalScan_run(ens_test_data,tmpdir):
     _, kwargs = read_json(os.path.join("input",'simulation.json'))
     assert kwargs["max_depth"] == 1
     assert kwargs["output_file"] == "yo.csv"
+    assert kwargs["batch_size"] == 100000
+    assert kwargs["output_format"] == "csv"
+    assert kwargs["num_workers"] is None
+    assert kwargs["keep_top_k"] is None
+    assert kwargs["min_fitness"] is None
+    assert kwargs["min_relative_fitness"] is None
 
     os.chdir("..")
 
+    dms.run(output_directory="test_npz",
+            max_depth=2,
+            output_file="yo",
+            batch_size=3,
+            output_format="npz")
+    
+    df = read_exhaustive(os.path.join("test_npz","yo"))
+    assert len(df) == 9
+
+    dms.run(output_directory="test_par",
+            max_depth=2,
+            output_file="yo",
+            batch_size=3,
+            output_format="npz",
+            num_workers=2)
+    
+    assert read_exhaustive(os.path.join("test_par","yo")).equals(df)
+
+    dms.run(output_directory="test_top",
+            max_depth=2,
+            output_file="yo.csv",
+            keep_top_k=2)
+    
+    top_df = read_exhaustive(os.path.join("test_top","yo.csv"))
+    assert len(top_df) == 2
+    assert os.path.exists(os.path.join("test_top","yo_shells.csv"))
+    _, kwargs = read_json(os.path.join("test_top","input","simulation.json"))
+    assert kwargs["keep_top_k"] == 2
+
  
     os.chdir(current_dir)
\ No newline at end of file
@@ -2,10 +2,14 @@ import pytest
 
 from eee.calcs import WrightFisherSimulation
 from eee.calcs import read_json
+from eee._private.interface import WrappedFunctionException
+from eee.io.generations import read_generations
 
+import numpy as np
 import pandas as pd
 
 import os
+import json
 
 def test_WrightFisherSimulation(ens_test_data):
     
@@ -49,6 +53,9 @@ def test_WrightFisherSimulation_run(ens_test_data,tmpdir):
     assert os.path.exists(os.path.join("test","input","simulation.json"))
     assert os.path.exists(os.path.join("test","eee_sim_genotypes.csv"))
     assert os.path.exists(os.path.join("test","eee_sim_generations_00.pickle"))
+
+    # Checkpoints are opt-in
+    assert not os.path.exists(os.path.join("test","eee_sim_checkpoint.ckpt"))
  
     os.chdir('test')
     
@@ -59,8 +66,266 @@ def test_WrightFisherSimulation_run(ens_test_data,tmpdir):
     assert kwargs["num_mutations"] == 1
     assert kwargs["write_prefix"] == "eee_sim"
     assert kwargs["write_frequency"] == 1000
+    assert kwargs["canonical_genotypes"] == False
+    assert kwargs["step_mode"] == "individual"
+    assert kwargs["checkpoint_frequency"] is None
+    assert kwargs["stopping_criteria"] is None
     assert kwargs["verbose"] == False
 
     os.chdir("..")
 
-    os.chdir(current_dir)
\ No newline at end of file
+    # Collapse recurrent mutants
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=None)
+
+    wf.run(output_directory="test_canonical",
+           population_size=100,
+           mutation_rate=0.1,
+           num_generations=100,
+           write_prefix="eee_sim",
+           write_frequency=1000,
+           canonical_genotypes=True,
+           step_mode="multinomial",
+           verbose=False)
+    
+    assert wf._gc.canonical_genotypes
+    df = pd.read_csv(os.path.join("test_canonical","eee_sim_genotypes.csv"))
+    mutations = df["mutations"].fillna("")
+    assert len(mutations) == len(set(mutations))
+
+    # Stopping criteria
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=None)
+    wf.run(output_directory="test_stopping",
+           population_size=100,
+           mutation_rate=0.01,
+           num_generations=1000,
+           write_prefix="eee_sim",
+           stopping_criteria={"fixation":{"exclude_initial":False}},
+           verbose=False)
+    generations = read_generations(os.path.join("test_stopping",
+                                                "eee_sim_generations_0.pickle"))
+    assert len(generations) == 1
+
+    _, kwargs = read_json(os.path.join("test_stopping","input","simulation.json"))
+    assert kwargs["stopping_criteria"] == {"fixation":{"exclude_initial":False}}
+
+    with pytest.raises(WrappedFunctionException):
+        wf.run(output_directory="test_stopping_bad",
+               stopping_criteria=["fixation"],
+               verbose=False)
+
+    os.chdir(current_dir)
+def test_WrightFisherSimulation_resume(ens_test_data,tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    ens = ens_test_data["ens"]
+    ddg_df = ens_test_data["ddg_df"]
+    conditions = ens_test_data["conditions"]
+
+    run_kwargs = {"population_size":100,
+                  "mutation_rate":0.01,
+                  "write_prefix":"eee_sim",
+                  "write_frequency":100,
+                  "checkpoint_frequency":100,
+                  "verbose":False}
+
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=5)
+    wf.run(output_directory="full",num_generations=500,**run_kwargs)
+
+    # Run a shorter simulation, then extend it
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=5)
+    wf.run(output_directory="extend",num_generations=250,**run_kwargs)
+    wf.resume(output_directory="extend",num_generations=500,**run_kwargs)
+
+    full = pd.read_csv(os.path.join("full","eee_sim_genotypes.csv"))
+    extend = pd.read_csv(os.path.join("extend","eee_sim_genotypes.csv"))
+    assert full.equals(extend)
+    for i in range(5):
+        f = f"eee_sim_generations_{i}.pickle"
+        assert read_generations(os.path.join("full",f)) == \
+               read_generations(os.path.join("extend",f))
+
+    _, kwargs = read_json(os.path.join("extend","input",'simulation.json'))
+    assert kwargs["num_generations"] == 500
+
+    # The arguments recorded in the json file can be passed back in, as 
+    # eee-run-calculation does
+    kwargs["num_generations"] = 600
+    wf.resume(output_directory="extend",**kwargs)
+    _, kwargs = read_json(os.path.join("extend","input",'simulation.json'))
+    assert kwargs["num_generations"] == 600
+
+    # Stopping criteria recorded in the json match the checkpoint
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=5)
+    wf.run(output_directory="stopping",
+           num_generations=200,
+           stopping_criteria={"target_fitness":{"target":10}},
+           **run_kwargs)
+    _, kwargs = read_json(os.path.join("stopping","input",'simulation.json'))
+    kwargs["num_generations"] = 300
+    wf.resume(output_directory="stopping",**kwargs)
+
+    # Settings that differ from the checkpoint, or are not arguments to run, 
+    # are rejected without touching the simulation
+    csv_file = os.path.join("extend","eee_sim_genotypes.csv")
+    before = pd.read_csv(csv_file)
+    bad_kwargs = [{"population_size":200},
+                  {"mutation_rate":0.02},
+                  {"write_frequency":50},
+                  {"canonical_genotypes":True},
+                  {"stopping_criteria":{"fixation":{}}},
+                  {"population_sze":100}]
+    for bad in bad_kwargs:
+        these_kwargs = dict(run_kwargs)
+        these_kwargs.update(bad)
+        with pytest.raises(WrappedFunctionException):
+            wf.resume(output_directory="extend",
+                      num_generations=700,
+                      **these_kwargs)
+        assert os.getcwd() == str(tmpdir)
+        assert pd.read_csv(csv_file).equals(before)
+        _, kwargs = read_json(os.path.join("extend","input",'simulation.json'))
+        assert kwargs["num_generations"] == 600
+
+    # Fewer generations than have already been run. The json should still 
+    # hold the generations that were actually run. 
+    with pytest.raises(WrappedFunctionException):
+        wf.resume(output_directory="extend",
+                  num_generations=100,
+                  **run_kwargs)
+    assert pd.read_csv(csv_file).equals(before)
+    _, kwargs = read_json(os.path.join("extend","input",'simulation.json'))
+    assert kwargs["num_generations"] == 600
+
+    # No checkpoint
+    with pytest.raises(WrappedFunctionException):
+        wf.resume(output_directory="extend",write_prefix="not_a_prefix")
+
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=5)
+    wf.run(output_directory="no_checkpoint",
+           num_generations=10,
+           population_size=100,
+           write_prefix="eee_sim",
+           verbose=False)
+    with pytest.raises(WrappedFunctionException):
+        wf.resume(output_directory="no_checkpoint",write_prefix="eee_sim")
+
+    os.chdir(current_dir)
+
+def test_WrightFisherSimulation_run_replicates(ens_test_data,tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    ens = ens_test_data["ens"]
+    ddg_df = ens_test_data["ddg_df"]
+    conditions = ens_test_data["conditions"]
+
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=5)
+
+    df = wf.run_replicates(num_replicates=3,
+                           output_directory="test",
+                           num_workers=2,
+                           population_size=100,
+                           mutation_rate=0.01,
+                           num_generations=50,
+                           write_prefix="eee_sim",
+                           verbose=False)
+    
+    assert os.getcwd() == str(tmpdir)
+    assert len(df) == 3
+    assert os.path.exists(os.path.join("test","replicates.csv"))
+    assert os.path.exists(os.path.join("test","input","simulation.json"))
+    assert np.array_equal(df["num_generations"],[50,50,50])
+
+    # Seeds are distinct, spawned from the parent seed, and stored in each
+    # replicate's json
+    expected = np.random.SeedSequence(5).spawn(3)
+    expected = [int(c.generate_state(1,dtype=np.uint64)[0]) for c in expected]
+    assert list(df["seed"]) == expected
+    assert len(set(expected)) == 3
+    for i in range(3):
+        rep_json = os.path.join("test",f"replicate_{i}","input","simulation.json")
+        with open(rep_json) as f:
+            assert json.load(f)["seed"] == expected[i]
+
+    # A replicate can be re-run on its own from its json file
+    wf_rep, kwargs = read_json(os.path.join("test","replicate_1","input","simulation.json"),
+                               use_stored_seed=True)
+    wf_rep.run(output_directory="rerun",**kwargs)
+    rerun = pd.read_csv(os.path.join("rerun","eee_sim_genotypes.csv"))
+    original = pd.read_csv(os.path.join("test","replicate_1","eee_sim_genotypes.csv"))
+    assert rerun.equals(original)
+
+    # Replicates reproducible from the parent seed
+    wf = WrightFisherSimulation(ens=ens,
+                                ddg_df=ddg_df,
+                                conditions=conditions,
+                                seed=5)
+    df2 = wf.run_replicates(num_replicates=3,
+                            output_directory="test2",
+                            num_workers=1,
+                            population_size=100,
+                            mutation_rate=0.01,
+                            num_generations=50,
+                            write_prefix="eee_sim",
+                            verbose=False)
+    assert df.equals(df2)
+
+    # The top-level json records the validated run arguments and replicate
+    # settings, and can be used to reproduce the replicates
+    with open(os.path.join("test","input","simulation.json")) as f:
+        calc_params = json.load(f)["calc_params"]
+    assert calc_params["num_replicates"] == 3
+    assert calc_params["num_workers"] == 2
+    assert calc_params["population_size"] == 100
+    assert calc_params["step_mode"] == "individual"
+    assert calc_params["verbose"] is False
+
+    wf_top, kwargs = read_json(os.path.join("test","input","simulation.json"),
+                               use_stored_seed=True)
+    assert kwargs["num_replicates"] == 3
+    df3 = wf_top.run_replicates(output_directory="test_rerun",**kwargs)
+    assert df.equals(df3)
+
+    with pytest.raises(WrappedFunctionException):
+        wf.run_replicates(num_replicates=0,
+                          output_directory="test3")
+
+    # Bad run arguments are caught before anything is written
+    bad_kwargs = [{"population_sze":100},
+                  {"population_size":-1},
+                  {"step_mode":"not_a_mode"},
+                  {"output_format":"not_a_format"},
+                  {"stopping_criteria":{"not_a_criterion":{}}}]
+    for bad in bad_kwargs:
+        with pytest.raises(WrappedFunctionException):
+            wf.run_replicates(num_replicates=2,
+                              output_directory="test3",
+                              verbose=False,
+                              **bad)
+        assert not os.path.exists("test3")
+
+    os.chdir(current_dir)
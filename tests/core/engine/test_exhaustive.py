@@ -1,13 +1,21 @@
 import pytest
 
 from eee.core.engine.exhaustive import exhaustive
+from eee.core.engine.exhaustive import _iter_mutation_batches
+from eee.core.engine.exhaustive import _iter_site_combinations
+from eee.core.engine.exhaustive import _iter_shards
+from eee.core.engine.exhaustive import _combination_block
+from eee.core.engine.exhaustive import _score_batch
+from eee.io.exhaustive import read_exhaustive
 from eee.core.genotype import Genotype
 
 import numpy as np
 import pandas as pd
 
+import itertools
 import os
 import glob
+import filecmp
 
 def test_exhaustive(ens_test_data,variable_types,tmpdir):
 
@@ -45,6 +53,33 @@ def test_exhaustive(ens_test_data,variable_types,tmpdir):
     assert np.array_equal(df.columns,["genotype","mutations","num_mutations",
                                       "s1_ddg","s2_ddg","fitness"])
 
+    # Single mutant table should match genotype-by-genotype calculation
+    gc_slow = Genotype(ens=ens,
+                       fitness_function=fitness_function,
+                       ddg_df=ddg_df)
+    for i in range(len(df) - 1):
+        site = gc_slow.ddg_sites[i]
+        mut = gc_slow.ddg_mutations[i]
+        gc_slow.mutate(0,site=site,mutation=mut)
+    slow_df = gc_slow.df
+    assert np.array_equal(df["genotype"],slow_df["genotype"])
+    assert np.array_equal(df["mutations"],slow_df["mutations"])
+    assert np.array_equal(df["num_mutations"],slow_df["num_mutations"])
+    assert np.allclose(df["s1_ddg"],slow_df["s1_ddg"])
+    assert np.allclose(df["s2_ddg"],slow_df["s2_ddg"])
+    assert np.allclose(df["fitness"],slow_df["fitness"])
+
+    # Same answer with a batch fitness function
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  fitness_function_batch=ens_test_data["fc"].fitness_batch)
+    batch_df = exhaustive(gc=gc,
+                          max_depth=1,
+                          output_file=None,
+                          return_output=True)
+    assert np.allclose(df["fitness"],batch_df["fitness"])
+
 
     gc = Genotype(ens=ens,
                   fitness_function=fitness_function,
@@ -127,6 +162,154 @@ def test_exhaustive(ens_test_data,variable_types,tmpdir):
                            "M1V/P2R/A3S",
                            "M1V/P2Q/A3S"])
 
+    # Batch size should not change output. Also check against genotypes built
+    # one at a time
+    df = exhaustive(gc=gc,
+                    max_depth=3,
+                    output_file="full.csv",
+                    return_output=True)
+    
+    gc_slow = Genotype(ens=ens,
+                       fitness_function=fitness_function,
+                       ddg_df=ddg_df)
+    lookup = {():0}
+    for muts in df.loc[1:,"mutations"]:
+        muts = tuple(muts.split("/"))
+        site = gc_slow.ddg_sites[gc_slow.ddg_mutations.index(muts[-1])]
+        lookup[muts] = gc_slow.mutate(lookup[muts[:-1]],site=site,mutation=muts[-1])
+    slow_df = gc_slow.df
+    assert np.array_equal(df["genotype"],slow_df["genotype"])
+    assert np.array_equal(df["mutations"],slow_df["mutations"])
+    assert np.array_equal(df["num_mutations"],slow_df["num_mutations"])
+    for c in ["s1_ddg","s2_ddg","fitness"]:
+        assert np.array_equal(df[c],slow_df[c])
+
+    for batch_size in [1,2,7,1000]:
+        batch_df = exhaustive(gc=gc,
+                              max_depth=3,
+                              output_file="batch.csv",
+                              return_output=True,
+                              batch_size=batch_size)
+        assert batch_df.equals(df)
+        assert filecmp.cmp("full.csv","batch.csv",shallow=False)
+
+        exhaustive(gc=gc,
+                   max_depth=3,
+                   output_file="batch_npz",
+                   batch_size=batch_size,
+                   output_format="npz")
+        assert read_exhaustive("batch_npz").equals(df)
+        num_blocks = len(glob.glob(os.path.join("batch_npz","block_*.npz")))
+        assert num_blocks == int(np.ceil(len(df)/batch_size))
+
+    # Scoring in worker processes gives identical output
+    for num_workers, batch_size in [(1,5),(2,7),(2,1000)]:
+        par_df = exhaustive(gc=gc,
+                            max_depth=3,
+                            output_file="par.csv",
+                            return_output=True,
+                            batch_size=batch_size,
+                            num_workers=num_workers)
+        assert par_df.equals(df)
+        assert filecmp.cmp("full.csv","par.csv",shallow=False)
+
+        exhaustive(gc=gc,
+                   max_depth=3,
+                   output_file="par_npz",
+                   batch_size=batch_size,
+                   output_format="npz",
+                   num_workers=num_workers)
+        assert read_exhaustive("par_npz").equals(df)
+
+    # Filtering while scanning
+    wt_fitness = df.loc[0,"fitness"]
+    cutoff = np.median(df["fitness"])
+    for num_workers in [None,2]:
+        for kwargs, expected in [({"min_fitness":cutoff},
+                                  df["fitness"] >= cutoff),
+                                 ({"min_relative_fitness":1.0},
+                                  df["fitness"] >= 1.0*wt_fitness),
+                                 ({"min_relative_fitness":1.0,"min_fitness":cutoff},
+                                  df["fitness"] >= max(1.0*wt_fitness,cutoff))]:
+            
+            filt_df = exhaustive(gc=gc,
+                                 max_depth=3,
+                                 output_file="filt.csv",
+                                 return_output=True,
+                                 batch_size=7,
+                                 num_workers=num_workers,
+                                 **kwargs)
+            expected_df = df.loc[expected,:].reset_index(drop=True)
+            pd.testing.assert_frame_equal(filt_df,expected_df)
+            assert np.array_equal(read_exhaustive("filt.csv")["genotype"],
+                                  expected_df["genotype"])
+
+            shells = pd.read_csv("filt_shells.csv")
+            assert np.array_equal(shells["num_mutations"],[0,1,2,3])
+            counts = df.groupby("num_mutations")["genotype"].count()
+            assert np.array_equal(shells["num_genotypes"],counts)
+            passed = df.loc[expected,:].groupby("num_mutations")["genotype"].count()
+            passed = passed.reindex(range(4),fill_value=0)
+            assert np.array_equal(shells["num_passed"],passed)
+            assert np.array_equal(shells["num_kept"],passed)
+
+    # Top k, with ties going to the lower genotype number
+    for batch_size in [1,7,1000]:
+        for keep_top_k in [1,10,100000]:
+            top_df = exhaustive(gc=gc,
+                                max_depth=3,
+                                output_file="top_npz",
+                                output_format="npz",
+                                return_output=True,
+                                batch_size=batch_size,
+                                keep_top_k=keep_top_k)
+            
+            order = np.lexsort((df["genotype"],-df["fitness"]))[:keep_top_k]
+            expected_df = df.loc[np.sort(order),:].reset_index(drop=True)
+            assert top_df.equals(expected_df)
+            assert read_exhaustive("top_npz").equals(expected_df)
+
+            shells = pd.read_csv(os.path.join("top_npz","shells.csv"))
+            assert np.array_equal(shells["num_passed"],shells["num_genotypes"])
+            assert np.sum(shells["num_kept"]) == min(keep_top_k,len(df))
+
+    # Top k of genotypes passing a threshold
+    top_df = exhaustive(gc=gc,
+                        max_depth=3,
+                        output_file=None,
+                        return_output=True,
+                        keep_top_k=5,
+                        min_fitness=1.1*np.max(df["fitness"]))
+    assert len(top_df) == 0
+    assert list(top_df.columns) == list(df.columns)
+
+    # Unfiltered scans do not write shell counts
+    exhaustive(gc=gc,max_depth=1,output_file="filt.csv")
+    assert not os.path.exists("filt_shells.csv")
+
+    # csv matches dataframe written by pandas
+    df.to_csv("pandas.csv")
+    assert filecmp.cmp("full.csv","pandas.csv",shallow=False)
+    pd.testing.assert_frame_equal(read_exhaustive("full.csv"),df)
+    for f in glob.glob("*.csv"):
+        os.remove(f)
+
+    # Original gc should not be modified
+    assert len(gc.genotypes) == 1
+
+    with pytest.raises(ValueError):
+        exhaustive(gc=gc,max_depth=1,batch_size=0)
+    with pytest.raises(ValueError):
+        exhaustive(gc=gc,max_depth=1,output_format="not_a_format")
+    with pytest.raises(ValueError):
+        exhaustive(gc=gc,max_depth=1,num_workers=0)
+    with pytest.raises(ValueError):
+        exhaustive(gc=gc,max_depth=1,keep_top_k=0)
+    with pytest.raises(ValueError):
+        exhaustive(gc=gc,max_depth=1,min_fitness="stupid")
+    with pytest.raises(ValueError):
+        exhaustive(gc=gc,max_depth=1,min_relative_fitness="stupid")
+
     # Now try various argument params
 
     ens = ens_test_data["ens"]
@@ -214,5 +397,113 @@ def test_exhaustive(ens_test_data,variable_types,tmpdir):
                     return_output=False)
     assert os.path.exists("junk.csv")
 
+    # ------------------------ genotypes already in gc -------------------------
+    # The scan starts from wildtype and ignores other genotypes in gc, with a
+    # warning. 
+    gc_evolved = Genotype(ens=ens,
+                          fitness_function=fitness_function,
+                          ddg_df=ddg_df)
+    site = list(gc_evolved.ddg_dict.keys())[0]
+    mutation = list(gc_evolved.ddg_dict[site].keys())[0]
+    gc_evolved.mutate(0,site=site,mutation=mutation)
+    with pytest.warns(UserWarning):
+        evolved_df = exhaustive(gc=gc_evolved,
+                                max_depth=2,
+                                output_file=None,
+                                return_output=True)
+    wt_df = exhaustive(gc=Genotype(ens=ens,
+                                   fitness_function=fitness_function,
+                                   ddg_df=ddg_df),
+                       max_depth=2,
+                       output_file=None,
+                       return_output=True)
+    assert evolved_df.equals(wt_df)
+    assert len(gc_evolved.genotypes) == 2
+
+
+    os.chdir(current_dir)
+
+def test__iter_mutation_batches(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = pd.DataFrame({"site":[1,1,2,2,3],
+                           "mut":["M1A","M1V","P2R","P2Q","A3S"],
+                           "s1":[1,-1,0,0,0],
+                           "s2":[-1,1,1,0,0]})
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+
+    site_ids = gc.site_mutation_ids
+    assert site_ids == [[0,1],[2,3],[4]]
+
+    combos = _iter_site_combinations(len(site_ids),max_depth=2)
+    batches = list(_iter_mutation_batches(site_ids,combos,width=2,batch_size=4))
+    assert [len(b) for b in batches] == [4,4,4,2]
+    all_muts = np.concatenate(batches)
+    assert np.array_equal(all_muts[:6],[[-1,-1],[0,-1],[1,-1],[2,-1],[3,-1],[4,-1]])
+    assert np.array_equal(all_muts[6:10],[[0,2],[0,3],[1,2],[1,3]])
+    assert np.array_equal(all_muts[-1],[3,4])
+
+    # Depth larger than the number of sites
+    combos = _iter_site_combinations(len(site_ids),max_depth=5)
+    batches = list(_iter_mutation_batches(site_ids,combos,width=3,batch_size=100))
+    assert len(batches) == 1
+    assert batches[0].shape == (18,3)
+
+    # Only wildtype
+    combos = _iter_site_combinations(len(site_ids),max_depth=0)
+    batches = list(_iter_mutation_batches(site_ids,combos,width=1,batch_size=100))
+    assert np.array_equal(batches[0],[[-1]])
 
-    os.chdir(current_dir)
\ No newline at end of file
+    energy, fitness = _score_batch(gc,all_muts)
+    assert np.array_equal(energy[0],[0,0])
+    assert np.array_equal(energy[6],gc.ddg_array[0] + gc.ddg_array[2])
+    assert np.allclose(fitness,gc.fitness_batch(energy))
+
+    # Closed-form energies match genotypes built one mutation at a time
+    for row, e, f in zip(all_muts,energy,fitness):
+        index = 0
+        for m in row[row >= 0]:
+            index = gc.mutate(index,
+                              site=gc.ddg_sites[m],
+                              mutation=gc.ddg_mutations[m])
+        assert np.array_equal(gc._get_mut_energy(index),e)
+        assert np.isclose(gc._get_fitness(index),f)
+
+def test__combination_block():
+
+    site_ids = [[0,1],[2,3,4],[5]]
+
+    block = _combination_block(site_ids,(),width=2)
+    assert np.array_equal(block,[[-1,-1]])
+
+    block = _combination_block(site_ids,(1,),width=2)
+    assert np.array_equal(block,[[2,-1],[3,-1],[4,-1]])
+
+    # Same order as itertools.product
+    block = _combination_block(site_ids,(0,1,2),width=4)
+    expected = [list(p) + [-1] for p in itertools.product(*site_ids)]
+    assert np.array_equal(block,expected)
+
+def test__iter_shards(ens_test_data):
+
+    site_ids = [[0,1],[2,3],[4]]
+
+    shards = list(_iter_shards(site_ids,max_depth=2,shard_size=4))
+    
+    # Shards hold whole site combinations, in scan order
+    combos = [c for shard, _ in shards for c in shard]
+    assert combos == list(_iter_site_combinations(3,max_depth=2))
+    assert combos[:4] == [(),(0,),(1,),(2,)]
+    
+    for shard, num_genotypes in shards:
+        assert num_genotypes == sum([int(np.prod([len(site_ids[i]) for i in c]))
+                                     for c in shard])
+    assert sum([n for _, n in shards]) == 14
+    assert all([n >= 4 for _, n in shards[:-1]])
+
+    shards = list(_iter_shards(site_ids,max_depth=0,shard_size=10))
+    assert shards == [([()],1)]
@@ -407,4 +407,104 @@ def test_follow_tree(ens_with_fitness,newick_files,variable_types,tmpdir):
                 write_prefix=None,
                 tree=tree)
 
-    os.chdir(current_dir)
\ No newline at end of file
+    os.chdir(current_dir)
+def test_follow_tree_parallel(ens_with_fitness,newick_files,tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    template_gc = ens_with_fitness["gc"]
+
+    # Run with different numbers of workers. Results should be identical.
+    for num_workers in [1,2]:
+
+        os.mkdir(f"workers_{num_workers}")
+        os.chdir(f"workers_{num_workers}")
+
+        tree = ete3.Tree(newick_files["simple.newick"])
+        gc = copy.deepcopy(template_gc)
+        gc._choice_function = np.random.Generator(np.random.PCG64(2)).choice
+        rng = np.random.Generator(np.random.PCG64(1))
+
+        gc_out, tree_out = follow_tree(gc,
+                                       tree=tree,
+                                       population=100,
+                                       mutation_rate=0.1,
+                                       num_generations=1000,
+                                       burn_in_generations=10,
+                                       write_prefix="eee_tree",
+                                       num_workers=num_workers,
+                                       rng=rng)
+        assert issubclass(type(gc_out),Genotype)
+        assert issubclass(type(tree_out),ete3.TreeNode)
+        assert len(gc_out.genotypes) == 0
+
+        os.chdir("..")
+
+    files = os.listdir("workers_1")
+    files.sort()
+    assert files == ["eee_tree.newick",
+                     "eee_tree_anc00-anc01.pickle",
+                     "eee_tree_anc00-anc02.pickle",
+                     "eee_tree_anc01-A.pickle",
+                     "eee_tree_anc01-B.pickle",
+                     "eee_tree_anc02-C.pickle",
+                     "eee_tree_anc02-D.pickle",
+                     "eee_tree_burn-in-anc00.pickle",
+                     "eee_tree_genotypes.csv"]
+    for f in files:
+        with open(os.path.join("workers_1",f),"rb") as a:
+            with open(os.path.join("workers_2",f),"rb") as b:
+                assert a.read() == b.read()
+
+    os.chdir("workers_1")
+
+    # Generations pass from one branch to the next
+    pairs = [("burn-in-anc00","anc00-anc01"),
+             ("burn-in-anc00","anc00-anc02"),
+             ("anc00-anc01","anc01-A"),
+             ("anc00-anc01","anc01-B"),
+             ("anc00-anc02","anc02-C"),
+             ("anc00-anc02","anc02-D")]
+    all_genotypes_seen = []
+    for p1, p2 in pairs:
+        with open(f"eee_tree_{p1}.pickle","rb") as f:
+            start = pickle.load(f)
+        with open(f"eee_tree_{p2}.pickle","rb") as f:
+            end = pickle.load(f)
+        assert start[-1] == end[0]
+        assert start[0] != end[-1]
+        for g in end:
+            all_genotypes_seen.extend(g.keys())
+
+    # Every genotype written once, with a lineage that is consistent with its
+    # parent
+    df = pd.read_csv("eee_tree_genotypes.csv")
+    assert len(np.unique(df["genotype"])) == len(df)
+    assert set(all_genotypes_seen).issubset(set(df["genotype"]))
+
+    df = df.set_index("genotype")
+    df["accum_mut"] = df["accum_mut"].fillna("")
+    for g in df.index:
+        parent = df.loc[g,"parent"]
+        if pd.isna(parent):
+            assert df.loc[g,"num_accum_mut"] == 0
+            continue
+        parent = int(parent)
+        assert parent < g
+        assert df.loc[g,"num_accum_mut"] == df.loc[parent,"num_accum_mut"] + 1
+        assert df.loc[g,"accum_mut"].startswith(df.loc[parent,"accum_mut"])
+
+    os.chdir("..")
+
+    # Bad num_workers
+    tree = ete3.Tree(newick_files["simple.newick"])
+    gc = copy.deepcopy(template_gc)
+    with pytest.raises(ValueError):
+        follow_tree(gc=gc,
+                    num_generations=1000,
+                    mutation_rate=0.1,
+                    tree=tree,
+                    num_workers=0)
+
+    os.chdir(current_dir)
@@ -1,217 +1,190 @@
 import pytest
 
-from eee.core.engine.pathfinder import _traverse
+from eee.core.engine.pathfinder import _find_paths
+from eee.core.engine.pathfinder import _record_paths
+from eee.core.engine.pathfinder import _record_genotypes
 from eee.core.engine.pathfinder import pathfinder
+from eee.core.engine.exhaustive import exhaustive
+from eee.core.genotype import Genotype
 from eee._private.interface import MockContextManager
 
 import pandas as pd
 import numpy as np
 
 import copy 
+import itertools
 import os
 import glob
 
-def test__traverse():
-
-    # Line ensures test is seen by completeness_crawler
-    assert True
-    
-    class _FakeSingleGenotype:
-        """
-        Fake class that exposes what we need to test _traverse.
-        """
-
-        def __init__(self,sites,mutations,fitness):
-            self.sites = sites
-            self.mutations= mutations
-            self.fitness = fitness
-
-    class _FakeGenotype:
-        """
-        Fake class that exposes what we need to test _traverse. mut_dict is a
-        bit different -- this stores the fitness effect of each mutation at 
-        each site. Mutational effects are entirely additive.
-        """
-
-        def __init__(self,ddg_dict):
-            
-            self.genotypes = {0:_FakeSingleGenotype(sites=[],
-                                                    mutations=[],
-                                                    fitness=0)}
-            self.ddg_dict = ddg_dict
-
-        def conditional_mutate(self,index,site,mutation,condition_fcn):
-
-            F1 = self.genotypes[index].fitness
-            F2 = self.genotypes[index].fitness + self.ddg_dict[site][mutation]
-        
-            if condition_fcn(F2,F1):
-                new_idx = np.max(list(self.genotypes.keys())) + 1
-
-                sites = self.genotypes[index].sites[:]
-                sites.append(site)
-
-                mutations = self.genotypes[index].mutations[:]
-                mutations.append(mutation)
-
-                self.genotypes[new_idx] = _FakeSingleGenotype(sites=sites,
-                                                              mutations=mutations,
-                                                              fitness=F2)
-                return new_idx
-            
-            return -1
-
-    def _always_allow(v1,v2):
-        return True
-    
-    def _never_allow(v1,v2):
-        return False
-
-    def _build_genotype_tuple(genotypes):
-        """
-        List of tuples, one for each genotype, sorted.
-        """
-        
-        out = []
-        for g in genotypes:
-            out.append(genotypes[g].mutations[:])
-            out[-1].sort()
-            out[-1] = tuple(out[-1])
-
-        return out
-
-    # Fake progress bar
-    pbar = MockContextManager()
-
-    # --------------------- allow any step ---------------------------
-
-    ddg_dict = {1:{"A1V":1,"A1P":-10},
-                2:{"A2C":0}}
-
-    gc = _FakeGenotype(ddg_dict=ddg_dict)
+def _brute_force_paths(df,site_of,condition_fcn,max_depth):
+    """
+    Count accepted paths to every genotype in an exhaustive scan (df) by 
+    walking every ordering of the mutations in each genotype.
+    """
+
+    fitness = {}
+    for muts, f in zip(df["mutations"],df["fitness"]):
+        key = tuple(sorted([m for m in muts.split("/") if m != ""]))
+        fitness[key] = f
+
+    num_paths = {():1}
+    for key in fitness:
+        if len(key) == 0 or len(key) > max_depth:
+            continue
+        if len(set([site_of[m] for m in key])) != len(key):
+            continue
         
-    visited_dict = _traverse(current_genotype_idx=0,
-                             max_depth=2,
-                             current_depth=0,
-                             visited_dict={},
-                             condition_fcn=_always_allow,
-                             not_exhaustive_path=True,
-                             gc=gc,
-                             pbar=pbar)
-    
-    assert len(visited_dict) == 5
-    expected_visits = [("A1V",),("A1P",),("A2C",),("A1V","A2C",),("A1P","A2C")]
-    for k in expected_visits:
-        assert k in visited_dict
-
-    assert len(gc.genotypes) == 6
-    sorted_genotypes = _build_genotype_tuple(gc.genotypes)
-    expected = [(),
-                ('A1V',),('A1V','A2C'),
-                ('A1P',),('A1P','A2C'),
-                ('A2C',)]
-    for i in range(len(sorted_genotypes)):
-        assert np.array_equal(sorted_genotypes[i],expected[i])
-
-    # --------------------- do not allow any step ---------------------------
-
-    gc = _FakeGenotype(ddg_dict=ddg_dict)
-    
-    visited_dict = _traverse(current_genotype_idx=0,
-                             max_depth=2,
-                             current_depth=0,
-                             visited_dict={},
-                             condition_fcn=_never_allow,
-                             not_exhaustive_path=True,
-                             gc=gc,
-                             pbar=pbar)
-    
-    assert len(visited_dict) == 3
-    expected_visits = [("A1V",),("A1P",),("A2C",)]
-    for k in expected_visits:
-        assert k in visited_dict
-
-    assert len(gc.genotypes) == 1
-    sorted_genotypes = _build_genotype_tuple(gc.genotypes)
-    expected = [()]
-    for i in range(len(sorted_genotypes)):
-        assert np.array_equal(sorted_genotypes[i],expected[i])
-
-
-    # --------------------- use real fitness values ---------------------------
-
-    gc = _FakeGenotype(ddg_dict=ddg_dict)
-    
-    visited_dict = _traverse(current_genotype_idx=0,
-                             max_depth=2,
-                             current_depth=0,
-                             visited_dict={},
-                             condition_fcn=np.greater_equal,
-                             not_exhaustive_path=True,
-                             gc=gc,
-                             pbar=pbar)
-    
-    assert len(visited_dict) == 5
-    expected_visits = [("A1V",),("A1P",),("A2C",),("A1V","A2C",),("A1P","A2C")]
-    for k in expected_visits:
-        assert k in visited_dict
-
-    assert len(gc.genotypes) == 4
-    sorted_genotypes = _build_genotype_tuple(gc.genotypes)
-    expected = [(),
-                ('A1V',),('A1V','A2C'),
-                ('A2C',)]
-    for i in range(len(sorted_genotypes)):
-        assert np.array_equal(sorted_genotypes[i],expected[i])
-
-
-    # --------------------- use real fitness values ---------------------------
-
-    gc = _FakeGenotype(ddg_dict=ddg_dict)
-    
-    visited_dict = _traverse(current_genotype_idx=0,
-                             max_depth=2,
-                             current_depth=0,
-                             visited_dict={},
-                             condition_fcn=np.greater,
-                             not_exhaustive_path=True,
-                             gc=gc,
-                             pbar=pbar)
-    
-    assert len(visited_dict) == 4
-    expected_visits = [("A1V",),("A1P",),("A2C",),("A1V","A2C",)]
-    for k in expected_visits:
-        assert k in visited_dict
-
-    assert len(gc.genotypes) == 2
-    sorted_genotypes = _build_genotype_tuple(gc.genotypes)
-    expected = [(),('A1V',)]
-    for i in range(len(sorted_genotypes)):
-        assert np.array_equal(sorted_genotypes[i],expected[i])
-
-    # --------------------- Switch to exhaustive paths ---------------------------
-
-    gc = _FakeGenotype(ddg_dict=ddg_dict)
-    
-    visited_dict = _traverse(current_genotype_idx=0,
-                             max_depth=2,
-                             current_depth=0,
-                             visited_dict={},
-                             condition_fcn=np.greater_equal,
-                             not_exhaustive_path=False,
-                             gc=gc,
-                             pbar=pbar)
-    
-    assert len(visited_dict) == 5
-    expected_visits = [("A1V",),("A1P",),("A2C",),("A1V","A2C",),("A1P","A2C")]
-    for k in expected_visits:
-        assert k in visited_dict
-
-    assert len(gc.genotypes) == 5
-    sorted_genotypes = _build_genotype_tuple(gc.genotypes)
-    expected = [(),('A1V',),('A1V','A2C'),('A2C',),('A1V','A2C')]
-    for i in range(len(sorted_genotypes)):
-        assert np.array_equal(sorted_genotypes[i],expected[i])
+        count = 0
+        for order in itertools.permutations(key):
+            ok = True
+            for i in range(len(order)):
+                prev = tuple(sorted(order[:i]))
+                new = tuple(sorted(order[:i+1]))
+                if not condition_fcn(fitness[new],fitness[prev]):
+                    ok = False
+                    break
+            if ok:
+                count += 1
+        if count > 0:
+            num_paths[key] = count
+
+    return num_paths, fitness
+
+def _path_test_setup(ens_test_data,max_depth,condition_fcn):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = pd.DataFrame({"site":[1,1,2,2,3,4],
+                           "mut":["M1A","M1V","P2R","P2Q","A3S","L4F"],
+                           "s1":[1,0,-1,0,0,0],
+                           "s2":[0,0,0,0,0,1]})
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    df = exhaustive(gc,max_depth=max_depth,output_file=None,return_output=True)
+    site_of = dict(zip(gc.ddg_mutations,gc.ddg_sites))
+    expected, fitness = _brute_force_paths(df,site_of,condition_fcn,max_depth)
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    paths = _find_paths(gc=gc,
+                        max_depth=max_depth,
+                        condition_fcn=condition_fcn,
+                        pbar=MockContextManager())
+
+    return gc, paths, expected, fitness
+
+def test__find_paths(ens_test_data):
+
+    for condition_fcn in [np.greater_equal,np.greater]:
+        for max_depth in [1,2,3,4]:
+
+            gc, paths, expected, fitness = _path_test_setup(ens_test_data,
+                                                            max_depth,
+                                                            condition_fcn)
+
+            accessible = np.flatnonzero(paths["accessible"])
+            found = set()
+            for node in accessible:
+                key = tuple(sorted([gc.ddg_mutations[m] 
+                                    for m in paths["mutations"][node]]))
+                found.add(key)
+
+                # Fitness matches the exhaustive scan
+                assert paths["fitness"][node] == fitness[key]
+                
+                # First parent is one mutation back
+                p = paths["parent"][node]
+                if node == 0:
+                    assert p == -1
+                else:
+                    assert paths["mutations"][node][:-1] == paths["mutations"][p]
+
+            assert found == set(expected.keys())
+
+            # Steps out of each expanded node are contiguous and accepted 
+            # according to condition_fcn
+            for node in np.unique(paths["cand_parent"]):
+                a = paths["first_cand"][node]
+                b = a + paths["num_cand"][node]
+                assert np.all(paths["cand_parent"][a:b] == node)
+                for c, acc in zip(paths["cand_child"][a:b],
+                                  paths["cand_accepted"][a:b]):
+                    assert acc == condition_fcn(paths["fitness"][c],
+                                                paths["fitness"][node])
+
+def test__record_paths(ens_test_data):
+
+    for condition_fcn in [np.greater_equal,np.greater]:
+        for max_depth in [1,2,3,4]:
+
+            gc, paths, expected, fitness = _path_test_setup(ens_test_data,
+                                                            max_depth,
+                                                            condition_fcn)
+            gc = _record_paths(gc=copy.deepcopy(gc),
+                               paths=paths,
+                               find_all_paths=True)
+            df = gc.df
+
+            # One entry per accepted path
+            assert len(df) == np.sum(list(expected.values()))
+
+            keys = []
+            for muts, f in zip(df["mutations"],df["fitness"]):
+                key = tuple(sorted([m for m in muts.split("/") if m != ""]))
+                assert f == fitness[key]
+                keys.append(key)
+            assert set(keys) == set(expected.keys())
+
+            # Only the first path tried to each genotype is kept
+            gc, paths, expected, fitness = _path_test_setup(ens_test_data,
+                                                            max_depth,
+                                                            condition_fcn)
+            gc = _record_paths(gc=copy.deepcopy(gc),
+                               paths=paths,
+                               find_all_paths=False)
+            df = gc.df
+            keys = [tuple(sorted([m for m in muts.split("/") if m != ""]))
+                    for muts in df["mutations"]]
+            assert len(set(keys)) == len(keys)
+            assert set(keys).issubset(set(expected.keys()))
+
+def test__record_genotypes(ens_test_data):
+
+    for condition_fcn in [np.greater_equal,np.greater]:
+        for max_depth in [1,2,3,4]:
+            for find_all_paths in [True,False]:
+
+                gc, paths, expected, fitness = _path_test_setup(ens_test_data,
+                                                                max_depth,
+                                                                condition_fcn)
+                gc, num_paths, edges = _record_genotypes(gc=gc,
+                                                         paths=paths,
+                                                         find_all_paths=find_all_paths)
+                df = gc.df
+
+                # One entry per accessible genotype
+                assert len(df) == len(expected)
+
+                for idx, muts in zip(df["genotype"],df["mutations"]):
+                    key = tuple(sorted([m for m in muts.split("/") if m != ""]))
+                    if find_all_paths:
+                        assert num_paths[idx] == expected[key]
+                    else:
+                        assert num_paths[idx] == 1
+
+                # One edge per accessible genotype if not finding all paths
+                edge_set = set(zip(edges["parent"],edges["child"]))
+                assert len(edge_set) == len(edges)
+                if not find_all_paths:
+                    assert len(edges) == len(df) - 1
+
+                # Path counts are the sum over incoming edges
+                for c in df["genotype"][1:]:
+                    incoming = [e[0] for e in edge_set if e[1] == c]
+                    assert num_paths[c] == np.sum([num_paths[p] for p in incoming])
 
 
 def test_pathfinder(ens_with_fitness_two_site,variable_types,tmpdir):
@@ -255,10 +228,27 @@ def test_pathfinder(ens_with_fitness_two_site,variable_types,tmpdir):
     assert issubclass(type(out3),pd.DataFrame)
     assert len(out3) < len(out2)
     
+    # Old outputs by default
+    assert "num_paths" not in out2.columns
+    assert not os.path.exists("genotypes2_edges.csv")
+
+    # One entry per genotype with accepted steps written alongside
+    gc = copy.deepcopy(ens_with_fitness_two_site["gc"])
+    out_unique = pathfinder(gc=gc,
+                            max_depth=2,
+                            allow_neutral=True,
+                            find_all_paths=True,
+                            output_file="genotypes_unique.csv",
+                            unique_genotypes=True,
+                            return_output=True)
+    edges = pd.read_csv("genotypes_unique_edges.csv")
+    assert list(edges.columns) == ["parent","child"]
+    assert len(edges) == np.sum(out_unique["num_paths"]) - 1
+    assert len(set(out_unique["mutations"])) == len(out_unique)
+
     # No output file
-    os.remove("genotypes1.csv")
-    os.remove("genotypes2.csv")
-    os.remove("genotypes3.csv")
+    for f in glob.glob("*.csv"):
+        os.remove(f)
     gc = copy.deepcopy(ens_with_fitness_two_site["gc"])
     out4 = pathfinder(gc=gc,
                       max_depth=2,
@@ -330,6 +320,12 @@ def test_pathfinder(ens_with_fitness_two_site,variable_types,tmpdir):
         with pytest.raises(ValueError):
             pathfinder(gc=gc,max_depth=1,find_all_paths=v)
 
+    gc = copy.deepcopy(ens_with_fitness_two_site["gc"])
+    for v in variable_types["not_bools"]:
+        print(v,type(v),flush=True)
+        with pytest.raises(ValueError):
+            pathfinder(gc=gc,max_depth=1,unique_genotypes=v)
+
     gc = copy.deepcopy(ens_with_fitness_two_site["gc"])
     for v in variable_types["not_bools"]:
         print(v,type(v),flush=True)
@@ -0,0 +1,187 @@
+import pytest
+
+from eee.core.engine.stopping import StoppingCriterion
+from eee.core.engine.stopping import Fixation
+from eee.core.engine.stopping import FitnessPlateau
+from eee.core.engine.stopping import TargetFitness
+from eee.core.engine.stopping import WallClock
+from eee.core.engine.stopping import MemoryBudget
+from eee.core.engine.stopping import build_stopping_criteria
+
+import numpy as np
+
+import time
+import pickle
+import sys
+
+def _check(criterion,generation=0,counts=(1,),mean_fitness=1.0):
+
+    counts = np.array(counts)
+    genotypes = np.arange(len(counts))
+    fitness = np.ones(len(counts))
+
+    return criterion.check(generation=generation,
+                           genotypes=genotypes,
+                           counts=counts,
+                           fitness=fitness,
+                           mean_fitness=mean_fitness)
+
+def test_StoppingCriterion():
+
+    c = StoppingCriterion()
+    with pytest.raises(NotImplementedError):
+        _check(c)
+
+def test_Fixation():
+
+    c = Fixation(exclude_initial=False)
+    assert _check(c,counts=[10])
+    assert not _check(c,counts=[9,1])
+
+    c = Fixation(threshold=0.9,exclude_initial=False)
+    assert _check(c,counts=[1,9])
+    assert not _check(c,counts=[2,8])
+
+    # Ignore the genotype that starts out most frequent
+    c = Fixation()
+    assert not _check(c,counts=[10])
+    assert not _check(c,counts=[10,0])
+    assert not _check(c,counts=[5,5])
+    assert _check(c,counts=[0,10])
+
+    c.reset()
+    assert not _check(c,counts=[0,10])
+    assert _check(c,counts=[10,0])
+
+    with pytest.raises(ValueError):
+        Fixation(threshold=0)
+    with pytest.raises(ValueError):
+        Fixation(threshold=1.1)
+    with pytest.raises(ValueError):
+        Fixation(exclude_initial="stupid")
+
+def test_FitnessPlateau():
+
+    c = FitnessPlateau(window=3,tolerance=0.1)
+
+    # Needs a full window
+    assert not _check(c,generation=0,mean_fitness=1.0)
+    assert not _check(c,generation=1,mean_fitness=1.0)
+    assert _check(c,generation=2,mean_fitness=1.0)
+
+    # Large change, then flat. Should stop once the change leaves the window
+    c.reset()
+    values = [0.5,1.0,1.0,1.0,1.0]
+    result = [_check(c,generation=i,mean_fitness=v) for i, v in enumerate(values)]
+    assert result == [False,False,False,True,True]
+
+    # Compare against a brute force calculation of the range over the window
+    c = FitnessPlateau(window=5,tolerance=0.01)
+    rng = np.random.Generator(np.random.PCG64(0))
+    values = 1 + np.cumsum(rng.normal(0,0.002,size=200))
+    for i, v in enumerate(values):
+        window = values[max(0,i-4):i+1]
+        expected = i >= 4 and (np.max(window) - np.min(window)) <= 0.01*v
+        assert _check(c,generation=i,mean_fitness=v) == expected
+
+    with pytest.raises(ValueError):
+        FitnessPlateau(window=1)
+    with pytest.raises(ValueError):
+        FitnessPlateau(tolerance=-1)
+
+def test_TargetFitness():
+
+    c = TargetFitness(target=0.5)
+    assert not _check(c,mean_fitness=0.4)
+    assert _check(c,mean_fitness=0.5)
+    assert _check(c,mean_fitness=0.6)
+
+    with pytest.raises(ValueError):
+        TargetFitness(target="stupid")
+
+def test_WallClock():
+
+    c = WallClock(seconds=0.05)
+    assert not _check(c)
+    time.sleep(0.06)
+    assert _check(c)
+
+    # Restart the clock
+    c.reset()
+    assert not _check(c)
+
+    # Elapsed time survives a pickle round trip (checkpoint and resume) and 
+    # start does not throw it away
+    c = WallClock(seconds=0.1)
+    time.sleep(0.06)
+    c = pickle.loads(pickle.dumps(c))
+    c.start()
+    assert not _check(c)
+    time.sleep(0.06)
+    assert _check(c)
+
+    with pytest.raises(ValueError):
+        WallClock(seconds=0)
+
+def test_MemoryBudget():
+
+    c = MemoryBudget(max_memory=1)
+    assert _check(c)
+
+    c = MemoryBudget(max_memory=1e18)
+    assert not _check(c)
+
+    with pytest.raises(ValueError):
+        MemoryBudget(max_memory=-1)
+
+def test__get_peak_memory(monkeypatch):
+
+    stopping_module = sys.modules[MemoryBudget.__module__]
+
+    class _Usage:
+        ru_maxrss = 1000
+
+    monkeypatch.setattr(stopping_module.resource,
+                        "getrusage",
+                        lambda who: _Usage())
+
+    # kilobytes on linux, bytes on macOS
+    monkeypatch.setattr(stopping_module.sys,"platform","linux")
+    assert stopping_module._get_peak_memory() == 1024000
+    assert _check(MemoryBudget(max_memory=1024000))
+    assert not _check(MemoryBudget(max_memory=1024001))
+
+    monkeypatch.setattr(stopping_module.sys,"platform","darwin")
+    assert stopping_module._get_peak_memory() == 1000
+    assert _check(MemoryBudget(max_memory=1000))
+    assert not _check(MemoryBudget(max_memory=1001))
+
+def test_build_stopping_criteria():
+
+    criteria = build_stopping_criteria({"fixation":{},
+                                        "fitness_plateau":{"window":10},
+                                        "target_fitness":{"target":1}})
+    assert len(criteria) == 3
+    assert issubclass(type(criteria[0]),Fixation)
+    assert issubclass(type(criteria[1]),FitnessPlateau)
+    assert issubclass(type(criteria[2]),TargetFitness)
+
+    criteria = build_stopping_criteria({"fixation":None})
+    assert issubclass(type(criteria[0]),Fixation)
+
+    c = Fixation()
+    assert build_stopping_criteria([c])[0] is c
+    assert build_stopping_criteria(c)[0] is c
+
+    with pytest.raises(ValueError):
+        build_stopping_criteria({"not_a_criterion":{}})
+    with pytest.raises(ValueError):
+        build_stopping_criteria({"fixation":{"not_an_arg":1}})
+    with pytest.raises(ValueError):
+        build_stopping_criteria({"fixation":1})
+    with pytest.raises(ValueError):
+        build_stopping_criteria(["fixation"])
+    with pytest.raises(ValueError):
+        build_stopping_criteria("fixation")
+    with pytest.raises(ValueError):
+        build_stopping_criteria(1)
@@ -2,16 +2,26 @@ import pytest
 
 from eee.core.engine.wright_fisher import write_wf_outputs
 from eee.core.engine.wright_fisher import wright_fisher
+from eee.core.engine.wright_fisher import resume_wright_fisher
+from eee.core.engine.wright_fisher import _individual_step
+from eee.core.engine.wright_fisher import _multinomial_step
 
 from eee.core.genotype import Genotype
+from eee.io.generations import read_generations
+from eee.io.background_writer import BackgroundWriterException
+from eee.core.engine.stopping import StoppingCriterion
 
 import numpy as np
 import pandas as pd
 
 import os
+import sys
+import time
+import threading
 import glob
 import copy
 import pickle
+import filecmp
 
 def test_write_wf_outputs(ens_with_fitness,tmpdir):
     
@@ -91,12 +101,15 @@ def test_write_wf_outputs(ens_with_fitness,tmpdir):
     for f in glob.glob("*.pickle"):
         os.remove(f)
 
-    # Make sure we wrote out the right number of genotypes
+    # Make sure we wrote out the right number of genotypes. All genotypes are
+    # written (once); the ones in the last generation are kept in gc. 
     df = pd.read_csv("test_genotypes.csv")
-    assert total_num_genotypes - len(gc.genotypes) == len(df)
+    assert total_num_genotypes == len(df)
+    assert len(np.unique(df.genotype)) == len(df)
     in_gc = set(list(gc.genotypes.keys()))
     in_out = set(list(df.genotype))
-    assert len(list(in_gc.intersection(in_out))) == 0
+    assert in_gc.issubset(in_out)
+    assert in_gc == set(out_gen[0][0])
     os.remove("test_genotypes.csv")
 
 
@@ -186,6 +199,97 @@ def test_write_wf_outputs(ens_with_fitness,tmpdir):
     os.chdir(current_dir)
 
 
+def test__individual_step(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    gc.mutate(index=0,site=1,mutation="M1A")
+
+    rng = np.random.Generator(np.random.PCG64(0))
+    seen, counts = _individual_step(gc=gc,
+                                    current_genotypes=np.array([0,1]),
+                                    prob=np.array([0.5,0.5]),
+                                    population_size=100,
+                                    expected_num_mutations=0,
+                                    rng=rng)
+    assert np.array_equal(seen,[0,1])
+    assert np.sum(counts) == 100
+
+    # Everyone mutates, but no more than once
+    seen, counts = _individual_step(gc=gc,
+                                    current_genotypes=np.array([0,1]),
+                                    prob=np.array([1.0,0.0]),
+                                    population_size=10,
+                                    expected_num_mutations=1000,
+                                    rng=rng)
+    assert np.sum(counts) == 10
+    assert 0 not in seen
+    assert len(gc.genotypes) == 12
+
+def test__multinomial_step(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    gc.mutate(index=0,site=1,mutation="M1A")
+
+    rng = np.random.Generator(np.random.PCG64(0))
+    seen, counts = _multinomial_step(gc=gc,
+                                     current_genotypes=np.array([0,1]),
+                                     prob=np.array([0.5,0.5]),
+                                     population_size=100,
+                                     expected_num_mutations=0,
+                                     rng=rng)
+    assert np.array_equal(seen,[0,1])
+    assert np.sum(counts) == 100
+    assert len(gc.genotypes) == 2
+
+    # Genotypes with no offspring are dropped
+    seen, counts = _multinomial_step(gc=gc,
+                                     current_genotypes=np.array([0,1]),
+                                     prob=np.array([1.0,0.0]),
+                                     population_size=100,
+                                     expected_num_mutations=0,
+                                     rng=rng)
+    assert np.array_equal(seen,[0])
+    assert np.array_equal(counts,[100])
+
+    # Everyone mutates, but no more than once
+    seen, counts = _multinomial_step(gc=gc,
+                                     current_genotypes=np.array([0,1]),
+                                     prob=np.array([1.0,0.0]),
+                                     population_size=10,
+                                     expected_num_mutations=1000,
+                                     rng=rng)
+    assert np.sum(counts) == 10
+    assert 0 not in seen
+    assert len(gc.genotypes) == 12
+    assert np.array_equal(seen,np.arange(2,12))
+
+    # Mutants that collapse onto the same genotype are merged
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  canonical_genotypes=True)
+    seen, counts = _multinomial_step(gc=gc,
+                                     current_genotypes=np.array([0]),
+                                     prob=np.array([1.0]),
+                                     population_size=1000,
+                                     expected_num_mutations=1000,
+                                     rng=rng)
+    assert np.sum(counts) == 1000
+    assert len(seen) == len(np.unique(seen))
+    assert len(seen) <= 4
+
 def test_wright_fisher(ens_test_data,ens_with_fitness,variable_types,tmpdir):
 
     current_dir = os.getcwd()
@@ -561,4 +665,363 @@ def test_wright_fisher(ens_test_data,ens_with_fitness,variable_types,tmpdir):
     for f in glob.glob("*.pickle"):
         os.remove(f)
 
+    # --------------------------------------------------------------------------
+    # npz output_format. Should record same generations as pickle. 
+
+    for output_format in ["pickle","npz"]:
+        gc = copy.deepcopy(ens_with_fitness["gc"])
+        rng = np.random.Generator(np.random.PCG64(10))
+        gc._choice_function = rng.choice
+        gc, generations = wright_fisher(gc=gc,
+                                        mutation_rate=0.01,
+                                        population=100,
+                                        num_generations=1000,
+                                        write_prefix=f"test_{output_format}",
+                                        write_frequency=100,
+                                        output_format=output_format,
+                                        rng=rng)
+    
+    pickle_files = glob.glob("test_pickle*.pickle")
+    pickle_files.sort()
+    npz_files = glob.glob("test_npz*.npz")
+    npz_files.sort()
+    assert len(pickle_files) == 10
+    assert len(npz_files) == 10
+
+    first_generation = 0
+    for p, n in zip(pickle_files,npz_files):
+        with open(p,"rb") as f:
+            from_pickle = pickle.load(f)
+        assert read_generations(n) == from_pickle
+        
+        data = np.load(n)
+        assert data["generation"][0] == first_generation
+        first_generation += len(data["generation"])
+        data.close()
+
+    assert first_generation == 1000
+
+    for f in glob.glob("test_*"):
+        os.remove(f)
+
+    with pytest.raises(ValueError):
+        wright_fisher(gc=gc,
+                      mutation_rate=0.01,
+                      population=100,
+                      num_generations=10,
+                      output_format="not_a_format")
+
+    # --------------------------------------------------------------------------
+    # background_write. Should write identical files to a run that writes on 
+    # the simulation thread. 
+
+    for background_write in [True,False]:
+        gc = copy.deepcopy(ens_with_fitness["gc"])
+        rng = np.random.Generator(np.random.PCG64(10))
+        gc._choice_function = rng.choice
+        gc, generations = wright_fisher(gc=gc,
+                                        mutation_rate=0.01,
+                                        population=100,
+                                        num_generations=1000,
+                                        write_prefix=f"test_{background_write}",
+                                        write_frequency=100,
+                                        background_write=background_write,
+                                        max_write_queue=1,
+                                        rng=rng)
+    
+    threaded_files = glob.glob("test_True*.pickle")
+    threaded_files.sort()
+    serial_files = glob.glob("test_False*.pickle")
+    serial_files.sort()
+    assert len(threaded_files) == 10
+    for t, s in zip(threaded_files,serial_files):
+        assert read_generations(t) == read_generations(s)
+
+    threaded_df = pd.read_csv("test_True_genotypes.csv")
+    serial_df = pd.read_csv("test_False_genotypes.csv")
+    assert threaded_df.equals(serial_df)
+
+    for f in glob.glob("test_*"):
+        os.remove(f)
+
+    # A failed write should abort the simulation
+    os.mkdir("not_a_dir")
+    with open(os.path.join("not_a_dir","stupid"),"w") as f:
+        f.write("x")
+    gc = copy.deepcopy(ens_with_fitness["gc"])
+    with pytest.raises(BackgroundWriterException):
+        wright_fisher(gc=gc,
+                      mutation_rate=0.01,
+                      population=100,
+                      num_generations=1000,
+                      write_prefix=os.path.join("not_a_dir","stupid","test"),
+                      write_frequency=100,
+                      verbose=False)
+
+    with pytest.raises(ValueError):
+        wright_fisher(gc=gc,
+                      mutation_rate=0.01,
+                      population=100,
+                      num_generations=10,
+                      max_write_queue=0)
+
+    # --------------------------------------------------------------------------
+    # step_mode
+
+    for step_mode in ["individual","multinomial"]:
+
+        gc = Genotype(ens=ens,
+                      fitness_function=fitness_function,
+                      ddg_df=ddg_df)
+        gc, generations = wright_fisher(gc,
+                                        population=1000,
+                                        mutation_rate=0.01,
+                                        num_generations=20,
+                                        step_mode=step_mode,
+                                        verbose=False)
+        assert len(generations) == 20
+        for g in generations:
+            assert _count_pop(g) == 1000
+        
+    with pytest.raises(ValueError):
+        gc, generations = wright_fisher(gc,
+                                        population=1000,
+                                        mutation_rate=0.01,
+                                        num_generations=20,
+                                        step_mode="not_a_mode",
+                                        verbose=False)
+
+    os.chdir(current_dir)
+
+
+def test_wright_fisher_background_write_error(ens_with_fitness,tmpdir,monkeypatch):
+    """
+    A failed background write should stop the simulation on the next 
+    generation, not the next dump.
+    """
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    wf_module = sys.modules[wright_fisher.__module__]
+
+    # Fail only after the dump has returned so the error surfaces mid-loop
+    failed = threading.Event()
+    def _failing_write(*args,**kwargs):
+        time.sleep(0.2)
+        failed.set()
+        raise OSError("disk full")
+    monkeypatch.setattr(wf_module,"_write_generations_pickle",_failing_write)
+
+    # Count generations stepped after the write failed
+    after_failure = []
+    real_get_step_function = wf_module._get_step_function
+    def _get_step_function(step_mode):
+        step_function = real_get_step_function(step_mode)
+        def _counting_step(**kwargs):
+            if failed.is_set():
+                after_failure.append(1)
+                time.sleep(0.05)
+            return step_function(**kwargs)
+        return _counting_step
+    monkeypatch.setattr(wf_module,"_get_step_function",_get_step_function)
+
+    gc = copy.deepcopy(ens_with_fitness["gc"])
+    with pytest.raises(BackgroundWriterException):
+        wright_fisher(gc=gc,
+                      mutation_rate=0.01,
+                      population=100,
+                      num_generations=1000,
+                      write_prefix="test",
+                      write_frequency=100,
+                      verbose=False)
+
+    assert failed.is_set()
+    assert len(after_failure) <= 1
+
+    os.chdir(current_dir)
+
+def test_wright_fisher_stopping_criteria(ens_with_fitness):
+
+    def _run(stopping_criteria,num_generations=1000):
+        gc = copy.deepcopy(ens_with_fitness["gc"])
+        rng = np.random.Generator(np.random.PCG64(10))
+        gc._choice_function = rng.choice
+        return wright_fisher(gc=gc,
+                             mutation_rate=0.001,
+                             population=100,
+                             num_generations=num_generations,
+                             stopping_criteria=stopping_criteria,
+                             verbose=False,
+                             rng=rng)
+
+    _, full = _run(None)
+    assert len(full) == 1000
+
+    # Wildtype starts fixed. Stop when a new genotype fixes. Generations up
+    # to that point should match the full run. 
+    _, generations = _run({"fixation":{}})
+    assert 1 < len(generations) < 1000
+    assert generations == full[:len(generations)]
+    assert len(generations[-1]) == 1
+    assert 0 not in generations[-1]
+    for g in generations[1:-1]:
+        assert len(g) > 1 or 0 in g
+
+    # Ignoring the starting genotype turned off -- stops immediately 
+    _, generations = _run({"fixation":{"exclude_initial":False}})
+    assert len(generations) == 1
+
+    # Mean fitness
+    gc, generations = _run({"target_fitness":{"target":0.8}})
+    assert 1 < len(generations) < 1000
+    mean_fitness = [np.sum([gc.fitnesses[k]*v for k, v in g.items()])/100
+                    for g in generations]
+    assert mean_fitness[-1] >= 0.8
+    assert np.all(np.array(mean_fitness[:-1]) < 0.8)
+
+    # Plateau
+    _, generations = _run({"fitness_plateau":{"window":50,"tolerance":1e-6}})
+    assert len(generations) < 1000
+
+    # Not met
+    _, generations = _run({"target_fitness":{"target":10}})
+    assert len(generations) == 1000
+
+    # The last generation drawn is checked too. The criterion records where
+    # it stopped the simulation and a warning is issued.
+    class _StopAt(StoppingCriterion):
+        name = "stop_at"
+        def __init__(self,generation):
+            self._generation = generation
+        def check(self,generation,genotypes,counts,fitness,mean_fitness):
+            return generation == self._generation
+
+    c = _StopAt(999)
+    with pytest.warns(UserWarning,match="Stopped at generation 999"):
+        _, generations = _run([c])
+    assert len(generations) == 1000
+    assert c.stopped_at == 999
+
+    c = _StopAt(500)
+    with pytest.warns(UserWarning,match="Stopped at generation 500"):
+        _, generations = _run([c])
+    assert len(generations) == 501
+    assert c.stopped_at == 500
+
+    # Not met; nothing recorded
+    c = _StopAt(2000)
+    _, generations = _run([c])
+    assert len(generations) == 1000
+    assert c.stopped_at is None
+
+    with pytest.raises(ValueError):
+        _run({"not_a_criterion":{}})
+
+def test_resume_wright_fisher(ens_with_fitness,tmpdir,monkeypatch):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    def _run(num_generations):
+        gc = copy.deepcopy(ens_with_fitness["gc"])
+        rng = np.random.Generator(np.random.PCG64(10))
+        gc._choice_function = rng.choice
+        return wright_fisher(gc=gc,
+                             mutation_rate=0.01,
+                             population=100,
+                             num_generations=num_generations,
+                             write_prefix="test",
+                             write_frequency=100,
+                             checkpoint_frequency=300,
+                             verbose=False,
+                             rng=rng)
+    
+    def _compare(dir_a,dir_b):
+        files_a = glob.glob(os.path.join(dir_a,"test_*"))
+        files_a = [os.path.basename(f) for f in files_a if not f.endswith(".ckpt")]
+        files_a.sort()
+        files_b = glob.glob(os.path.join(dir_b,"test_*"))
+        files_b = [os.path.basename(f) for f in files_b if not f.endswith(".ckpt")]
+        files_b.sort()
+        assert files_a == files_b
+        for f in files_a:
+            assert filecmp.cmp(os.path.join(dir_a,f),
+                               os.path.join(dir_b,f),
+                               shallow=False)
+
+    # Uninterrupted run
+    os.mkdir("full")
+    os.chdir("full")
+    _run(950)
+    assert os.path.isfile("test_checkpoint.ckpt")
+    os.chdir("..")
+
+    # Crash after the checkpoint at generation 600, then resume. Should write
+    # identical files.
+    os.mkdir("crash")
+    os.chdir("crash")
+
+    wf_module = sys.modules[wright_fisher.__module__]
+    original_step = wf_module._individual_step
+    num_steps = [0]
+    def _crash_step(**kwargs):
+        num_steps[0] += 1
+        if num_steps[0] == 750:
+            raise RuntimeError("crash")
+        return original_step(**kwargs)
+
+    monkeypatch.setattr(wf_module,"_individual_step",_crash_step)
+    with pytest.raises(RuntimeError):
+        _run(950)
+    monkeypatch.setattr(wf_module,"_individual_step",original_step)
+    assert os.path.isfile("test_generations_6.pickle")
+
+    gc, generations = resume_wright_fisher("test_checkpoint.ckpt",
+                                           verbose=False)
+    assert len(generations) == 0
+    os.chdir("..")
+    _compare("full","crash")
+
+    # Extend a finished run
+    os.mkdir("extend")
+    os.chdir("extend")
+    _run(450)
+    assert len(glob.glob("test_generations_*.pickle")) == 5
+    resume_wright_fisher("test_checkpoint.ckpt",
+                         num_generations=950,
+                         verbose=False)
+    os.chdir("..")
+    _compare("full","extend")
+
+    # Cannot go backwards
+    with pytest.raises(ValueError):
+        resume_wright_fisher(os.path.join("full","test_checkpoint.ckpt"),
+                             num_generations=10,
+                             verbose=False)
+
+    with pytest.raises(FileNotFoundError):
+        resume_wright_fisher("not_a_file.ckpt")
+
+    # Expected settings must match the checkpoint
+    ckpt = os.path.join("full","test_checkpoint.ckpt")
+    for bad in [{"population_size":200},
+                {"write_frequency":50},
+                {"canonical_genotypes":True},
+                {"not_a_setting":1}]:
+        with pytest.raises(ValueError):
+            resume_wright_fisher(ckpt,
+                                 num_generations=2000,
+                                 expected_settings=bad,
+                                 verbose=False)
+
+    # Checkpoints need output files
+    gc = copy.deepcopy(ens_with_fitness["gc"])
+    with pytest.raises(ValueError):
+        wright_fisher(gc=gc,
+                      mutation_rate=0.01,
+                      population=100,
+                      num_generations=10,
+                      checkpoint_frequency=10)
+
     os.chdir(current_dir)
@@ -5,6 +5,8 @@ from eee.core.fitness.ff import ff_on_above
 from eee.core.fitness.ff import ff_on_below
 from eee.core.fitness.ff import FF_AVAILABLE
 
+import numpy as np
+
 def test_ff_on():
     assert ff_on(1) == 1
     assert ff_on(0) == 0
@@ -29,6 +31,9 @@ def test_ff_neutral():
     assert ff_neutral(0,5,some_random_kwarg="test") == 1
     assert ff_neutral(1,5,some_random_kwarg="test") == 1
 
+    # arrays
+    assert np.array_equal(ff_neutral(np.array([0,0.5,1])),[1,1,1])
+
 def test_ff_on_above():
     assert ff_on_above(5,threshold=4) == 1
     assert ff_on_above(5,threshold=5) == 1
@@ -38,6 +43,13 @@ def test_ff_on_above():
     assert ff_on_above(5,5,threshold=4,some_random_kwarg="test") == 1
     assert ff_on_above(3,5,threshold=4,some_random_kwarg="test") == 0
 
+    # scalars stay scalars
+    assert type(ff_on_above(5,threshold=4)) is float
+    assert type(ff_on_above(np.float64(5),threshold=4)) is float
+
+    # arrays
+    assert np.array_equal(ff_on_above(np.array([3,4,5]),threshold=4),[0,1,1])
+
 def test_ff_on_below():
     assert ff_on_below(5,threshold=4) == 0
     assert ff_on_below(5,threshold=5) == 1
@@ -47,6 +59,13 @@ def test_ff_on_below():
     assert ff_on_below(5,5,threshold=4,some_random_kwarg="test") == 0
     assert ff_on_below(3,5,threshold=4,some_random_kwarg="test") == 1
 
+    # scalars stay scalars
+    assert type(ff_on_below(5,threshold=4)) is float
+    assert type(ff_on_below(np.float64(5),threshold=4)) is float
+
+    # arrays
+    assert np.array_equal(ff_on_below(np.array([3,4,5]),threshold=4),[1,1,0])
+
 
 def test__get_ff_available():
     
@@ -69,3 +88,7 @@ def test__get_ff_available():
     assert callable(FF_AVAILABLE["on_below"])
     assert FF_AVAILABLE["on_below"](0.55,threshold=0.5) == 0
     assert FF_AVAILABLE["on_below"](0.45,threshold=0.5) == 1
+
+    # All built-in functions are declared vectorized
+    for k in FF_AVAILABLE:
+        assert FF_AVAILABLE[k].vectorized
@@ -114,6 +114,70 @@ def test_Fitness_fitness():
     value = fc.fitness(mut_energy_array=mut_energy_array)
     assert np.array_equal(value,[0,0])
 
+    # Returned arrays should not be shared between calls
+    value_1 = fc.fitness(mut_energy_array=np.array([0,0]))
+    value_2 = fc.fitness(mut_energy_array=np.array([5000,0]))
+    assert value_1 is not value_2
+
+
+def test_Fitness_fitness_batch():
+
+    # Basic ensemble    
+    ens = Ensemble(gas_constant=1)
+    ens.add_species(name="test1",
+                    observable=True,
+                    folded=False,
+                    X=1)
+    ens.add_species(name="test2",
+                    observable=False,
+                    folded=True,
+                    Y=1)
+    
+    mut_energy_matrix = np.array([[0,0],
+                                  [5000,0],
+                                  [0,5000],
+                                  [1,-1],
+                                  [-2,0.5]],dtype=float)
+
+    conditions = {"X":[0,1,2,3],
+                  "Y":[2,1,0,0],
+                  "fitness_fcn":["off","on","on_above","on_below"],
+                  "fitness_kwargs":[{},{},{"threshold":0.5},{"threshold":0.5}],
+                  "select_on":"fx_obs",
+                  "select_on_folded":[True,False,True,False],
+                  "temperature":1}
+
+    fc = Fitness(ens=ens,
+                 conditions=conditions)
+
+    # Should match genotype-by-genotype calculation
+    F_matrix = fc.fitness_batch(mut_energy_matrix=mut_energy_matrix)
+    assert F_matrix.shape == (5,4)
+    for i in range(len(mut_energy_matrix)):
+        expected = fc.fitness(mut_energy_array=mut_energy_matrix[i])
+        assert np.allclose(F_matrix[i],expected)
+
+    # Fresh array with each call
+    F_matrix_2 = fc.fitness_batch(mut_energy_matrix=mut_energy_matrix)
+    assert F_matrix_2 is not F_matrix
+    assert np.array_equal(F_matrix,F_matrix_2)
+
+    # dG_obs and neutral
+    conditions = {"X":[0,1],
+                  "Y":[1,0],
+                  "fitness_fcn":["neutral","on_above"],
+                  "fitness_kwargs":[{},{"threshold":0}],
+                  "select_on":"dG_obs",
+                  "select_on_folded":False,
+                  "temperature":1}
+
+    fc = Fitness(ens=ens,
+                 conditions=conditions)
+    F_matrix = fc.fitness_batch(mut_energy_matrix=mut_energy_matrix[[0,3,4]])
+    for i, j in enumerate([0,3,4]):
+        expected = fc.fitness(mut_energy_array=mut_energy_matrix[j])
+        assert np.allclose(F_matrix[i],expected)
+
 
 def test_Fitness_to_dict():
 
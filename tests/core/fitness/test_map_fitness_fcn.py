@@ -7,6 +7,8 @@ from eee.core.fitness.ff import ff_on_below
 
 from eee.core.fitness.map_fitness_fcn import map_fitness_fcn
 
+import numpy as np
+
 import pytest
 
 def test_map_fitness_fcn(variable_types):
@@ -68,3 +70,27 @@ def test_map_fitness_fcn(variable_types):
         print(v,type(v),flush=True)
         with pytest.raises(ValueError):
             map_fitness_fcn("on",return_as=v)    
+
+
+def test_map_fitness_fcn_vectorized():
+
+    # Built-in functions declare themselves vectorized and pass through
+    assert map_fitness_fcn(value="on_above",return_as="vectorized") == ff_on_above
+    assert map_fitness_fcn(value=ff_off,return_as="vectorized") == ff_off
+
+    # Custom scalar-only function gets wrapped
+    def scalar_fcn(value,*args,**kwargs):
+        if value > kwargs["cut"]:
+            return 2.0
+        return 0.5
+    
+    vec_fcn = map_fitness_fcn(value=scalar_fcn,return_as="vectorized")
+    assert vec_fcn is not scalar_fcn
+    assert vec_fcn.vectorized
+    assert vec_fcn(1.0,cut=0) == 2.0
+    assert np.array_equal(vec_fcn(np.array([-1,0,1]),cut=0),[0.5,0.5,2.0])
+    assert vec_fcn(np.zeros(0),cut=0).shape == (0,)
+
+    # Declared vectorized custom function passes through
+    scalar_fcn.vectorized = True
+    assert map_fitness_fcn(value=scalar_fcn,return_as="vectorized") is scalar_fcn
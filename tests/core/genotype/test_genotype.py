@@ -2,7 +2,9 @@
 import pytest
 
 from eee.core.genotype.single_genotype import SingleGenotype
+from eee.core.genotype.genotype import _is_numpy_choice
 from eee.core.genotype.genotype import Genotype
+from eee.io.background_writer import BackgroundWriter
 
 import numpy as np
 import pandas as pd
@@ -117,12 +119,15 @@ def test_Genotype__add_genotype(ens_test_data):
                   fitness_function=fitness_function,
                   ddg_df=ddg_df)
     
-    sc = SingleGenotype(ens=ens,
-                        ddg_dict=gc.ddg_dict)
-    gc._add_genotype(new_genotype=sc,
-                     prev_index=0)
+    new_index = gc._add_genotype(prev_index=0,
+                                 mutations=(),
+                                 mut_energy=np.zeros(2),
+                                 step_name="A1A")
     
-    assert gc._genotypes[1] is sc
+    assert new_index == 1
+    assert gc._last_index == 1
+    assert issubclass(type(gc._genotypes[1]),SingleGenotype)
+    assert gc._genotypes[1].mutations_accumulated == ["A1A"]
     assert np.array_equal(gc._trajectories[1],[0,1])
     assert np.array_equal(gc._mut_energies[1],[0,0])
     assert gc._fitnesses[0] == gc._fitnesses[1]
@@ -231,6 +236,140 @@ def test_Genotype_mutate(ens_test_data):
     assert gc.genotypes[1].mutations[0] == "P2R"
 
 
+def test_Genotype_mutate_many(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    fitness_function_batch = ens_test_data["fc"].fitness_batch
+    ddg_df = ens_test_data["ddg_df"]
+
+    rng = np.random.Generator(np.random.PCG64(0))
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  choice_function=rng.choice,
+                  fitness_function_batch=fitness_function_batch)
+    
+    new_indexes = gc.mutate_many([])
+    assert len(new_indexes) == 0
+
+    new_indexes = gc.mutate_many([0,0,0,0])
+    assert np.array_equal(new_indexes,[1,2,3,4])
+    for i in new_indexes:
+        assert gc.trajectory(i) == [0,i]
+        assert len(gc.genotypes[i].mutations) == 1
+    
+    # Mutate children many times; compare each child to the result of the 
+    # equivalent call to mutate
+    new_indexes = gc.mutate_many(np.repeat(new_indexes,50))
+    assert len(new_indexes) == 200
+    for i in new_indexes:
+        assert len(gc.trajectory(i)) == 3
+
+    # Force the mutations chosen so we can compare to mutate. Covers new
+    # site, change at existing site, and reversion. 
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  fitness_function_batch=fitness_function_batch)
+    gc.mutate(index=0,site=1,mutation="M1A")
+
+    # Plain choice functions are called with a single list-like (site, then
+    # mutation), as in mutate
+    choices = iter([1,"M1A",1,"M1V",2,"P2R",2,"P2Q",1,"M1A"])
+    gc._choice_function = lambda a: next(choices)
+    new_indexes = gc.mutate_many([1,1,1,1,0])
+    
+    expected = [gc.mutate(index=1,site=1,mutation="M1A"),
+                gc.mutate(index=1,site=1,mutation="M1V"),
+                gc.mutate(index=1,site=2,mutation="P2R"),
+                gc.mutate(index=1,site=2,mutation="P2Q"),
+                gc.mutate(index=0,site=1,mutation="M1A")]
+    for i, j in zip(new_indexes,expected):
+        assert gc.genotypes[i].mutations == gc.genotypes[j].mutations
+        assert gc.genotypes[i].mutations_accumulated == gc.genotypes[j].mutations_accumulated
+        assert gc.trajectory(i)[:-1] == gc.trajectory(j)[:-1]
+        assert np.array_equal(gc.mut_energies[i],gc.mut_energies[j])
+        assert np.isclose(gc.fitnesses[i],gc.fitnesses[j])
+
+    assert gc.genotypes[new_indexes[0]].mutations_accumulated == ["M1A","A1M"]
+    assert gc.genotypes[new_indexes[1]].mutations_accumulated == ["M1A","A1V"]
+    assert gc.genotypes[new_indexes[1]].mutations == ["M1V"]
+    assert gc.genotypes[new_indexes[2]].mutations == ["M1A","P2R"]
+    
+    # numpy choice methods draw all mutations in one call
+    rng = np.random.Generator(np.random.PCG64(1))
+    assert _is_numpy_choice(rng.choice)
+    assert _is_numpy_choice(np.random.choice)
+    assert _is_numpy_choice(np.random.RandomState(0).choice)
+    assert not _is_numpy_choice(random.choice)
+    assert not _is_numpy_choice(rng.integers)
+    assert not _is_numpy_choice(lambda a: a[0])
+
+    gc._choice_function = rng.choice
+    new_indexes = gc.mutate_many([0,0,0])
+    expected = np.random.Generator(np.random.PCG64(1)).choice(len(gc._mutation_p),
+                                                              size=3,
+                                                              p=gc._mutation_p)
+    for i, m in zip(new_indexes,expected):
+        assert gc.genotypes[i].mutations == [gc.ddg_mutations[m]]
+
+    with pytest.raises(IndexError):
+        gc.mutate_many([0,100000])
+    with pytest.raises(IndexError):
+        gc.mutate_many([-1])
+
+    # All sites (and then all mutations at each site) equally likely
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  choice_function=rng.choice)
+    new_indexes = gc.mutate_many(np.zeros(4000,dtype=int))
+    muts = [gc.genotypes[i].mutations[0] for i in new_indexes]
+    values, counts = np.unique(muts,return_counts=True)
+    assert np.array_equal(values,["M1A","M1V","P2Q","P2R"])
+    assert np.all(np.abs(counts/4000 - 0.25) < 0.05)
+
+    # Collapse children onto existing genotypes (including within batch)
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  choice_function=rng.choice,
+                  canonical_genotypes=True,
+                  fitness_cache_size=10)
+    new_indexes = gc.mutate_many(np.zeros(100,dtype=int))
+    assert len(np.unique(new_indexes)) == 4
+    assert len(gc.genotypes) == 5
+    assert gc.fitness_cache_misses == 5
+    assert gc.num_merged == 96
+
+    # Recurrent mutants from the same parent and step are not alternate
+    # lineages
+    for i in np.unique(new_indexes):
+        assert gc.alternate_parents(i) == []
+
+    # Different parents reaching the same set within one batch
+    a = gc.mutate(index=0,site=1,mutation="M1A")
+    b = gc.mutate(index=0,site=2,mutation="P2R")
+
+    choices = iter([2,"P2R",1,"M1A"])
+    gc._choice_function = lambda x: next(choices)
+    ab = gc.mutate_many([a,b])
+    assert ab[0] == ab[1]
+    assert gc.trajectory(ab[0]) == [0,a,ab[0]]
+    assert gc.alternate_parents(ab[0]) == [(b,"M1A")]
+
+    # Only calculate fitness of each mutation set once per batch
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  choice_function=rng.choice,
+                  fitness_cache_size=10)
+    new_indexes = gc.mutate_many(np.zeros(100,dtype=int))
+    assert len(np.unique(new_indexes)) == 100
+    assert gc.fitness_cache_misses == 5
+    assert gc.fitness_cache_hits == 96
+
 def test_Genotype_conditional_mutate(ens_with_fitness):
 
     ens = copy.deepcopy(ens_with_fitness["ens"])
@@ -325,6 +464,218 @@ def test_Genotype_conditional_mutate(ens_with_fitness):
     assert gc._genotypes[5].mutations[0] == "A1C"
 
 
+def test_Genotype_trajectory(ens_test_data,tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    for cache in [False,True]:
+
+        gc = Genotype(ens=ens,
+                      fitness_function=fitness_function,
+                      ddg_df=ddg_df,
+                      cache_trajectories=cache)
+        gc.mutate(index=0,site=1,mutation="M1A")
+        gc.mutate(index=1,site=2,mutation="P2R")
+        gc.mutate(index=1,site=2,mutation="P2Q")
+
+        assert gc.trajectory(0) == [0]
+        assert gc.trajectory(2) == [0,1,2]
+        assert gc.trajectory(3) == [0,1,3]
+        assert gc.trajectories[3] == [0,1,3]
+
+        with pytest.raises(IndexError):
+            gc.trajectory(10)
+
+        # Trajectory survives dropping ancestors
+        gc.dump_to_csv("junk.csv",keep_genotypes=[3])
+        assert gc.trajectory(3) == [0,1,3]
+        with pytest.raises(IndexError):
+            gc.trajectory(1)
+        
+        os.remove("junk.csv")
+
+    os.chdir(current_dir)
+
+def test_Genotype__calc_fitness(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    # No cache by default
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    gc.mutate(index=0,site=1,mutation="M1A")
+    gc.mutate(index=1,site=1,mutation="M1A")
+    assert gc.fitness_cache_hits == 0
+    assert gc.fitness_cache_misses == 0
+    assert len(gc._fitness_cache) == 0
+
+    with pytest.raises(ValueError):
+        gc = Genotype(ens=ens,
+                      fitness_function=fitness_function,
+                      ddg_df=ddg_df,
+                      fitness_cache_size=-1)
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  fitness_cache_size=3)
+    
+    # wildtype is a miss
+    assert gc.fitness_cache_hits == 0
+    assert gc.fitness_cache_misses == 1
+
+    gc.mutate(index=0,site=1,mutation="M1A")
+    assert gc.fitness_cache_misses == 2
+
+    # Reversion to wildtype is a hit
+    gc.mutate(index=1,site=1,mutation="M1A")
+    assert gc.fitness_cache_hits == 1
+    assert np.array_equal(gc.mut_energies[2],[0,0])
+    assert gc.fitnesses[2] == gc.fitnesses[0]
+
+    # Same mutation set reached in a different order is a hit
+    gc.mutate(index=1,site=2,mutation="P2R")
+    gc.mutate(index=0,site=2,mutation="P2R")
+    gc.mutate(index=4,site=1,mutation="M1A")
+    assert gc.fitness_cache_hits == 2
+    assert gc.fitness_cache_misses == 4
+    assert np.array_equal(gc.mut_energies[5],gc.mut_energies[3])
+    assert gc.fitnesses[5] == gc.fitnesses[3]
+
+    # Cached values match uncached calculation
+    expected = np.prod(fitness_function(gc.mut_energies[5]))
+    assert np.isclose(gc.fitnesses[5],expected)
+
+    # Cache is bounded; M1A (least recently used) was dropped
+    assert len(gc._fitness_cache) == 3
+    assert (0,) not in gc._fitness_cache
+    assert () in gc._fitness_cache
+    
+    # conditional_mutate also uses the cache
+    gc.conditional_mutate(index=3,site=2,mutation="P2R",condition_fcn=np.less)
+    assert gc.fitness_cache_misses == 5
+
+def test_Genotype_canonical_genotypes(ens_test_data,tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    # Default: every mutation makes a new genotype
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    assert not gc.canonical_genotypes
+    assert gc.mutate(index=0,site=1,mutation="M1A") == 1
+    assert gc.mutate(index=0,site=1,mutation="M1A") == 2
+    assert gc.mutate(index=1,site=1,mutation="M1A") == 3
+    assert gc.num_merged == 0
+
+    with pytest.raises(ValueError):
+        gc.canonical_genotypes = "stupid"
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df,
+                  canonical_genotypes=True)
+    assert gc.canonical_genotypes
+    assert gc.mutate(index=0,site=1,mutation="M1A") == 1
+    assert gc.mutate(index=0,site=1,mutation="M1A") == 1
+
+    # Reversion goes back to wildtype
+    assert gc.mutate(index=1,site=1,mutation="M1A") == 0
+
+    # Same mutation set reached by a different path
+    assert gc.mutate(index=1,site=2,mutation="P2R") == 2
+    assert gc.mutate(index=0,site=2,mutation="P2R") == 3
+    assert gc.mutate(index=3,site=1,mutation="M1A") == 2
+    assert gc.num_merged == 3
+    assert len(gc.genotypes) == 4
+
+    # Canonical genotype keeps the lineage of first path to reach it. The 
+    # second path (two distinct parents reaching the same set) is recorded 
+    # as an alternate parent.
+    assert gc.trajectory(2) == [0,1,2]
+    assert gc.alternate_parents(2) == [(3,"M1A")]
+    assert gc.all_trajectories(2) == [[0,1,2],[0,3,2]]
+    assert gc.genotypes[2].mutations_accumulated == ["M1A","P2R"]
+
+    # Reversion recorded as an alternate parent of wildtype; the cycle back
+    # through wildtype is not a trajectory
+    assert gc.alternate_parents(0) == [(1,"A1M")]
+    assert gc.all_trajectories(0) == [[0]]
+    assert gc.alternate_parents(1) == []
+    with pytest.raises(IndexError):
+        gc.alternate_parents(100)
+    with pytest.raises(IndexError):
+        gc.all_trajectories(100)
+
+    # conditional_mutate returns the existing genotype if condition met. Only
+    # merges that happen are counted. Repeated edges are only recorded once.
+    assert gc.conditional_mutate(index=3,site=1,mutation="M1A",
+                                 condition_fcn=lambda a, b: True) == 2
+    assert gc.num_merged == 4
+    assert gc.conditional_mutate(index=3,site=1,mutation="M1A",
+                                 condition_fcn=lambda a, b: False) == -1
+    assert gc.num_merged == 4
+    assert len(gc.genotypes) == 4
+    assert gc.alternate_parents(2) == [(3,"M1A")]
+
+    # Alternate lineages survive a dump
+    gc.dump_to_csv("junk.csv",keep_genotypes=[0,2])
+    assert gc.all_trajectories(2) == [[0,1,2],[0,3,2]]
+    os.remove("junk.csv")
+
+    # Dropped genotypes are no longer canonical
+    gc.dump_to_csv("junk.csv",keep_genotypes=[0])
+    assert gc.mutate(index=0,site=1,mutation="M1A") == 4
+    assert gc.mutate(index=0,site=1,mutation="M1A") == 4
+
+    # Turning on after genotypes exist indexes the earliest of each set
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    gc.mutate(index=0,site=1,mutation="M1A")
+    gc.mutate(index=0,site=1,mutation="M1A")
+    gc.canonical_genotypes = True
+    assert gc.mutate(index=0,site=1,mutation="M1A") == 1
+
+    os.chdir(current_dir)
+
+def test_Genotype_get_fitnesses(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    gc.mutate(index=0,site=1,mutation="M1A")
+    gc.mutate(index=1,site=2,mutation="P2R")
+    gc.mutate(index=2,site=1,mutation="M1A")
+
+    fitnesses = gc.get_fitnesses([3,0,1,1])
+    expected = [gc.fitnesses[i] for i in [3,0,1,1]]
+    assert np.array_equal(fitnesses,expected)
+
+    assert np.array_equal(gc.get_num_accumulated([0,1,2,3]),[0,1,2,3])
+
+    with pytest.raises(KeyError):
+        gc.get_fitnesses([0,10])
+
+
 def test_Genotype_dump_to_csv(ens_test_data,tmpdir):
 
     current_dir = os.getcwd()
@@ -383,8 +734,9 @@ def test_Genotype_dump_to_csv(ens_test_data,tmpdir):
     gc.dump_to_csv(filename="test.csv",
                    keep_genotypes=keep_genotypes)
 
+    # All genotypes written, but only keep_genotypes stay in the object
     df = pd.read_csv("test.csv")
-    assert len(df) == 5
+    assert len(df) == 11
     os.remove("test.csv")
 
     keys = list(gc.genotypes.keys())
@@ -404,25 +756,109 @@ def test_Genotype_dump_to_csv(ens_test_data,tmpdir):
                    keep_genotypes=keep_genotypes)
 
     df = pd.read_csv("test.csv")
-    assert len(df) == 5
+    assert len(df) == 11
 
     keys = list(gc.genotypes.keys())
     keys.sort()
     assert np.array_equal(keys,keep_genotypes)
 
+    # Only genotypes created since the last dump are written
+    for i in range(3):
+        gc.mutate(0)
+
+    gc.dump_to_csv(filename="test.csv",
+                   keep_genotypes=keep_genotypes)
+    df = pd.read_csv("test.csv")
+    assert len(df) == 14
+    assert len(np.unique(df.genotype)) == 14
+
     gc.dump_to_csv(filename="test.csv")
     df = pd.read_csv("test.csv")
-    assert len(df) == 11
-    assert len(np.unique(df.genotype)) == 11
+    assert len(df) == 14
+    assert len(np.unique(df.genotype)) == 14
+    os.remove("test.csv")
+
+    # Written file matches the df property
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    for i in range(10):
+        gc.mutate(i)
+    gc.df.to_csv("expected.csv",index=False)
+    gc.dump_to_csv(filename="test.csv")
+    with open("expected.csv") as f:
+        expected = f.read()
+    with open("test.csv") as f:
+        assert f.read() == expected
     os.remove("test.csv")
+    os.remove("expected.csv")
 
     assert len(gc.genotypes) == 0
     assert len(gc.trajectories) == 0
     assert len(gc.mut_energies) == 0
     assert len(gc.fitnesses) == 0
 
+    # Dump through a background writer. Genotypes dropped immediately; file
+    # matches a direct dump. 
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    for i in range(10):
+        gc.mutate(i)
+    expected_df = gc.df
+
+    with BackgroundWriter() as writer:
+        gc.dump_to_csv(filename="test.csv",
+                       keep_genotypes=[0,2],
+                       writer=writer)
+        assert list(gc.genotypes.keys()) == [0,2]
+
+        # Mutating after the dump should not change what is written
+        gc.mutate(0)
+
+    df = pd.read_csv("test.csv")
+    assert len(df) == 11
+    assert np.array_equal(df["genotype"],expected_df["genotype"])
+    assert np.array_equal(df["accum_mut"].fillna(""),expected_df["accum_mut"])
+    assert np.allclose(df["fitness"],expected_df["fitness"])
+    os.remove("test.csv")
+
     os.chdir(current_dir)
 
+def test_Genotype__fork(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    for i in range(5):
+        gc.mutate(i)
+
+    exported = gc._export([5,2])
+    assert np.array_equal(exported["depth"],[5,2])
+    assert np.array_equal(exported["fitness"],[gc.fitnesses[5],gc.fitnesses[2]])
+    assert np.array_equal(exported["energy"][0],gc.mut_energies[5])
+    
+    new_gc = gc._fork(exported)
+    assert list(new_gc.genotypes.keys()) == [0,1]
+    assert np.array_equal(new_gc.get_num_accumulated([0,1]),[5,2])
+    assert new_gc.fitnesses[0] == gc.fitnesses[5]
+    assert np.array_equal(new_gc.mut_energies[1],gc.mut_energies[2])
+    assert new_gc.genotypes[0].mutations == gc.genotypes[5].mutations
+    
+    # New genotypes accumulate on top of the starting depth
+    new_index = new_gc.mutate(0)
+    assert new_index == 2
+    assert new_gc.get_num_accumulated([2])[0] == 6
+    
+    # Original object not affected
+    assert len(gc.genotypes) == 6
+    assert 6 not in gc.genotypes
+
 def test_Genotype_to_dict(ens_test_data):
     
     ens = ens_test_data["ens"]
@@ -576,4 +1012,92 @@ def test_Genotype_ddg_dict(ens_test_data):
     # Make sure property works as expected. 
     for a in ddg_dict:
         for b in ddg_dict[a]:
-            assert np.array_equal(gc.ddg_dict[a][b], ddg_dict[a][b])
\ No newline at end of file
+            assert np.array_equal(gc.ddg_dict[a][b], ddg_dict[a][b])
+
+def test_Genotype_fitness_batch(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fc = ens_test_data["fc"]
+    ddg_df = ens_test_data["ddg_df"]
+
+    mut_energy_matrix = np.array([[0,0],
+                                  [1,-1],
+                                  [-1,2]],dtype=float)
+    expected = [np.prod(fc.fitness(m)) for m in mut_energy_matrix]
+
+    # Falls back to fitness_function
+    gc = Genotype(ens=ens,
+                  fitness_function=fc.fitness,
+                  ddg_df=ddg_df)
+    assert gc._fitness_function_batch is None
+    assert np.allclose(gc.fitness_batch(mut_energy_matrix),expected)
+    
+    # Uses fitness_function_batch
+    gc = Genotype(ens=ens,
+                  fitness_function=fc.fitness,
+                  ddg_df=ddg_df,
+                  fitness_function_batch=fc.fitness_batch)
+    assert gc._fitness_function_batch == fc.fitness_batch
+    assert np.allclose(gc.fitness_batch(mut_energy_matrix),expected)
+
+def test_Genotype_mut_energy_batch(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    
+    mutation_ids = np.array([[-1,-1],
+                             [0,-1],
+                             [3,-1],
+                             [1,2]])
+    energy = gc.mut_energy_batch(mutation_ids)
+    assert energy.shape == (4,2)
+    assert np.array_equal(energy[0],[0,0])
+    assert np.array_equal(energy[1],gc.ddg_array[0])
+    assert np.array_equal(energy[2],gc.ddg_array[3])
+    assert np.array_equal(energy[3],gc.ddg_array[1] + gc.ddg_array[2])
+
+    # Matches a genotype built by mutation
+    index = gc.mutate(0,site=1,mutation="M1V")
+    index = gc.mutate(index,site=2,mutation="P2R")
+    assert np.array_equal(gc._get_mut_energy(index),energy[3])
+
+    # Lists work
+    assert np.array_equal(gc.mut_energy_batch([[1,2]]),energy[3:])
+
+def test_Genotype_site_mutation_ids(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    
+    assert gc.site_mutation_ids == [[0,1],[2,3]]
+    for site, ids in zip(gc.ddg_dict,gc.site_mutation_ids):
+        assert [gc.ddg_mutations[i] for i in ids] == list(gc.ddg_dict[site])
+
+def test_Genotype_ddg_array(ens_test_data):
+
+    ens = ens_test_data["ens"]
+    fitness_function = ens_test_data["fc"].fitness
+    ddg_df = ens_test_data["ddg_df"]
+    ddg_dict = ens_test_data["ddg_dict"]
+
+    gc = Genotype(ens=ens,
+                  fitness_function=fitness_function,
+                  ddg_df=ddg_df)
+    
+    assert gc.ddg_array.shape == (4,2)
+    assert np.array_equal(gc.ddg_sites,[1,1,2,2])
+    assert np.array_equal(gc.ddg_mutations,["M1A","M1V","P2R","P2Q"])
+    for i in range(len(gc.ddg_array)):
+        site = gc.ddg_sites[i]
+        mut = gc.ddg_mutations[i]
+        assert np.array_equal(gc.ddg_array[i],ddg_dict[site][mut])
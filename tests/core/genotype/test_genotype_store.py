@@ -0,0 +1,302 @@
+import pytest
+
+from eee.core.genotype.genotype_store import GenotypeStore
+from eee.core.genotype.genotype_store import GenotypeStoreView
+
+import numpy as np
+
+
+def _build_store():
+
+    store = GenotypeStore(num_species=2)
+    store.add(parent=-1,step=-1,mutations=(),energy=[0,0],fitness=1.0)
+    store.add(parent=0,
+              step=store.get_step_code("A1V"),
+              mutations=(0,),
+              energy=[1,-1],
+              fitness=0.5)
+    store.add(parent=1,
+              step=store.get_step_code("P2R"),
+              mutations=(0,2),
+              energy=[1,0],
+              fitness=0.25)
+    store.add(parent=0,
+              step=store.get_step_code("A1V"),
+              mutations=(0,),
+              energy=[1,-1],
+              fitness=0.5)
+
+    return store
+
+def test_GenotypeStore():
+
+    store = GenotypeStore(num_species=3)
+    assert len(store) == 0
+    assert store.num_ids == 0
+    assert store.energy.shape == (0,3)
+    assert store.step_names == []
+
+def test_GenotypeStore_get_step_code():
+
+    store = GenotypeStore(num_species=2)
+    assert store.get_step_code("A1V") == 0
+    assert store.get_step_code("P2R") == 1
+    assert store.get_step_code("A1V") == 0
+    assert store.step_names == ["A1V","P2R"]
+
+def test_GenotypeStore_add():
+
+    store = _build_store()
+
+    assert len(store) == 4
+    assert store.num_ids == 4
+    assert np.array_equal(store.ids,[0,1,2,3])
+    assert np.array_equal(store.parent,[-1,0,1,0])
+    assert np.array_equal(store.depth,[0,1,2,1])
+    assert np.array_equal(store.fitness,[1.0,0.5,0.25,0.5])
+    assert np.array_equal(store.energy,[[0,0],[1,-1],[1,0],[1,-1]])
+    assert store.mutations == [(),(0,),(0,2),(0,)]
+
+    # Make sure arrays grow past initial capacity
+    store = GenotypeStore(num_species=2)
+    store.add(parent=-1,step=-1,mutations=(),energy=[0,0],fitness=1.0)
+    for i in range(100):
+        new_id = store.add(parent=i,step=-1,mutations=(),energy=[i,i],fitness=i)
+        assert new_id == i + 1
+
+    assert len(store) == 101
+    assert np.array_equal(store.energy[1:,0],np.arange(100))
+    assert np.array_equal(store.depth,np.arange(101))
+
+    # Depth for a genotype without a parent
+    store = GenotypeStore(num_species=2)
+    store.add(parent=-1,step=-1,mutations=(0,2),energy=[0,0],fitness=1.0,depth=4)
+    store.add(parent=0,step=-1,mutations=(0,2,1),energy=[0,0],fitness=1.0,depth=100)
+    assert np.array_equal(store.depth,[4,5])
+
+def test_GenotypeStore_contains():
+
+    store = _build_store()
+    assert store.contains(0)
+    assert store.contains(3)
+    assert store.contains(np.int64(2))
+    assert not store.contains(4)
+    assert not store.contains(-1)
+    assert not store.contains("stupid")
+    assert not store.contains(None)
+
+    store.keep([2])
+    assert not store.contains(0)
+    assert store.contains(2)
+
+def test_GenotypeStore_get_rows():
+
+    store = _build_store()
+    assert np.array_equal(store.get_rows([3,0,0]),[3,0,0])
+    assert store.get_row(2) == 2
+
+    with pytest.raises(KeyError):
+        store.get_rows([0,10])
+    with pytest.raises(KeyError):
+        store.get_rows([-1])
+    with pytest.raises(KeyError):
+        store.get_row(10)
+
+    store.keep([1,3])
+    assert np.array_equal(store.get_rows([3,1]),[1,0])
+    with pytest.raises(KeyError):
+        store.get_rows([0])
+
+def test_GenotypeStore_get_ancestors():
+
+    store = _build_store()
+    assert store.get_ancestors(0) == [0]
+    assert store.get_ancestors(2) == [0,1,2]
+    assert store.get_ancestors(3) == [0,3]
+
+    assert store.get_steps(0) == []
+    assert store.get_steps(2) == ["A1V","P2R"]
+    assert store.get_steps(3) == ["A1V"]
+
+    # Lineage survives dropping ancestors
+    store.keep([2])
+    assert store.get_ancestors(2) == [0,1,2]
+    assert store.get_steps(2) == ["A1V","P2R"]
+
+def test_GenotypeStore_get_ancestors_cache():
+
+    store = GenotypeStore(num_species=2,cache_paths=True)
+    store.add(parent=-1,step=-1,mutations=(),energy=[0,0],fitness=1.0)
+    for i in range(10):
+        store.add(parent=i,step=-1,mutations=(),energy=[0,0],fitness=1.0)
+    
+    assert store.get_ancestors(5) == [0,1,2,3,4,5]
+    assert store._path_cache[5] == (0,1,2,3,4,5)
+    
+    # Walk should stop at the cached ancestor
+    assert store.get_ancestors(8) == list(range(9))
+    assert store._path_cache[8] == tuple(range(9))
+
+    # Returned lists are copies of the cache
+    path = store.get_ancestors(8)
+    path.append(100)
+    assert store.get_ancestors(8) == list(range(9))
+
+    # No cache by default
+    store = _build_store()
+    store.get_ancestors(2)
+    assert len(store._path_cache) == 0
+
+def test_GenotypeStore_get_ancestor_matrix():
+
+    store = _build_store()
+    ancestors, depth = store.get_ancestor_matrix([2,0,3,1])
+    assert np.array_equal(depth,[2,0,1,1])
+    assert np.array_equal(ancestors,[[0,1,2],
+                                     [0,-1,-1],
+                                     [0,3,-1],
+                                     [0,1,-1]])
+    
+    for i in range(4):
+        expected = store.get_ancestors(i)
+        ancestors, depth = store.get_ancestor_matrix([i])
+        assert ancestors[0,:depth[0]+1].tolist() == expected
+
+    ancestors, depth = store.get_ancestor_matrix([])
+    assert ancestors.shape == (0,1)
+    assert len(depth) == 0
+
+def test_GenotypeStore_keep():
+
+    store = _build_store()
+    store.keep([3,1])
+
+    # Rows kept in insertion order
+    assert len(store) == 2
+    assert np.array_equal(store.ids,[1,3])
+    assert np.array_equal(store.fitness,[0.5,0.5])
+    assert np.array_equal(store.energy,[[1,-1],[1,-1]])
+    assert store.mutations == [(0,),(0,)]
+    assert store.num_ids == 4
+
+    # Add after keep
+    new_id = store.add(parent=3,step=-1,mutations=(1,),energy=[5,5],fitness=0.1)
+    assert new_id == 4
+    assert np.array_equal(store.ids,[1,3,4])
+    assert store.get_row(4) == 2
+    assert store.get_depth([4])[0] == 2
+    assert store.get_parent([4])[0] == 3
+    assert store.get_steps(4) == ["A1V"]
+
+    # Lineage compacted to kept genotypes and their ancestors
+    assert np.array_equal(store.lineage_ids,[0,1,3,4])
+    assert np.array_equal(store.parent,[-1,0,0,3])
+    assert np.array_equal(store.depth,[0,1,1,2])
+    with pytest.raises(KeyError):
+        store.get_depth([2])
+
+    # Drop everything
+    store.keep()
+    assert len(store) == 0
+    assert store.num_ids == 5
+    assert not store.contains(1)
+    assert len(store.lineage_ids) == 0
+
+def test_GenotypeStore_add_alternate_parent():
+
+    store = _build_store()
+    a1v = store.get_step_code("A1V")
+    p2r = store.get_step_code("P2R")
+
+    # Matches the parent pointer: not an alternate
+    assert not store.add_alternate_parent(2,parent=1,step=p2r)
+    assert store.get_alternate_parents(2) == []
+
+    assert store.add_alternate_parent(2,parent=3,step=p2r)
+    assert not store.add_alternate_parent(2,parent=3,step=p2r)
+    assert store.get_alternate_parents(2) == [(3,p2r)]
+    assert store.get_alternate_parents(1) == []
+
+    with pytest.raises(KeyError):
+        store.add_alternate_parent(2,parent=10,step=a1v)
+    with pytest.raises(KeyError):
+        store.add_alternate_parent(10,parent=0,step=a1v)
+
+    # Keeping 2 keeps the lineage through both parents
+    store.keep([2])
+    assert np.array_equal(store.lineage_ids,[0,1,2,3])
+    assert store.get_alternate_parents(2) == [(3,p2r)]
+    assert store.get_ancestors(3) == [0,3]
+
+    # Dropping 2 drops its alternate lineage
+    store.add(parent=2,step=a1v,mutations=(2,),energy=[0,0],fitness=1.0)
+    store.keep([4])
+    assert np.array_equal(store.lineage_ids,[0,1,2,3,4])
+    store.keep([])
+    assert len(store.lineage_ids) == 0
+    assert store.get_alternate_parents(2) == []
+
+def test_GenotypeStore_keep_bounded():
+
+    # Simulate many dump cycles: a small population mutates, then everything 
+    # but the population is dropped. Lineage memory should follow the
+    # surviving lineages (the live genotypes and their ancestors), not every
+    # genotype ever created. 
+    rng = np.random.Generator(np.random.PCG64(0))
+    store = GenotypeStore(num_species=2,cache_paths=True)
+    population = [store.add(parent=-1,step=-1,mutations=(),energy=[0,0],fitness=1.0)]
+
+    max_capacity = 0
+    for cycle in range(500):
+        children = []
+        for _ in range(20):
+            parent = population[rng.integers(len(population))]
+            children.append(store.add(parent=parent,
+                                      step=store.get_step_code("A1V"),
+                                      mutations=(),
+                                      energy=[0,0],
+                                      fitness=1.0))
+        
+        # Most new genotypes are lost; survivors are mostly old genotypes
+        pool = population + children
+        weights = np.array([10.0]*len(population) + [1.0]*len(children))
+        population = list(rng.choice(pool,size=5,replace=False,p=weights/np.sum(weights)))
+        population = [int(p) for p in population]
+
+        expected = dict([(p,store.get_ancestors(p)) for p in population])
+        store.keep(population)
+        max_capacity = max(max_capacity,len(store._parent))
+
+        # Lineage is exactly the live genotypes and their ancestors
+        closure = set()
+        for p in population:
+            closure.update(expected[p])
+        assert np.array_equal(store.lineage_ids,sorted(closure))
+
+        # Kept genotypes still have their full trajectories
+        for p in population:
+            assert store.get_ancestors(p) == expected[p]
+            assert store.get_depth([p])[0] == len(expected[p]) - 1
+            assert store.get_steps(p) == ["A1V"]*(len(expected[p]) - 1)
+
+    assert store.num_ids == 10001
+    assert max_capacity < store.num_ids/10
+    assert len(store._path_cache) <= len(store.lineage_ids)
+
+def test_GenotypeStoreView():
+
+    store = _build_store()
+    view = GenotypeStoreView(store,lambda i: store.fitness[store.get_row(i)])
+
+    assert len(view) == 4
+    assert list(view) == [0,1,2,3]
+    assert 2 in view
+    assert 10 not in view
+    assert view[2] == 0.25
+    with pytest.raises(KeyError):
+        view[10]
+
+    store.keep([0,2])
+    assert len(view) == 2
+    assert list(view.keys()) == [0,2]
+    assert 1 not in view
@@ -285,6 +285,35 @@ def test_Ensemble__build_z_matrix():
     assert np.array_equal(ens._folded_mask,[True,False,True])
     assert np.array_equal(ens._unfolded_mask,[False,True,False])
 
+    # Repeated builds over the same grid come from the cache
+    z_matrix = ens._z_matrix
+    ens._build_z_matrix(ligand_dict={"X":np.array([0,0.5,1.0]),
+                                     "Y":np.array([1,0.5,0.0])})
+    assert ens._z_matrix is z_matrix
+    assert len(ens._z_matrix_cache) == 1
+
+    # Different grid gives a new z-matrix
+    ens._build_z_matrix(ligand_dict={"X":np.array([0,0.5,2.0]),
+                                     "Y":np.array([1,0.5,0.0])})
+    assert ens._z_matrix is not z_matrix
+    assert np.array_equal(ens._z_matrix,[[0,-0.5,-2],
+                                         [-2 + 1,-1 + 1,0 + 1],
+                                         [3,3,3]])
+    assert len(ens._z_matrix_cache) == 2
+
+    # Cache is bounded
+    for i in range(ens._z_matrix_cache_size + 5):
+        ens._build_z_matrix(ligand_dict={"X":np.array([i])})
+    assert len(ens._z_matrix_cache) == ens._z_matrix_cache_size
+
+    # Adding a species clears the cache
+    ens.add_species(name="test4",dG0=5)
+    assert len(ens._z_matrix_cache) == 0
+    ens._build_z_matrix(ligand_dict={"X":np.array([0,0.5,1.0]),
+                                     "Y":np.array([1,0.5,0.0])})
+    assert np.array_equal(ens._z_matrix.shape,(4,3))
+    assert np.array_equal(ens._z_matrix[3],[5,5,5])
+
 def test_Ensemble__get_weights():
 
     # single species, R = 1, temperature = 1, no mutations
@@ -1149,6 +1178,91 @@ def test_Ensemble_get_dG_obs_fast():
     assert np.array_equal(np.round(fx_folded,2),
                           np.round(predicted,2))
 
+def test_Ensemble_get_fx_obs_batch():
+
+    ens = Ensemble(gas_constant=1)
+    ens.add_species(name="test1",
+                    observable=False,
+                    folded=True,
+                    dG0=1,
+                    X=1)
+    ens.add_species(name="test2",
+                    observable=True,
+                    folded=False,
+                    dG0=0)
+    ens.add_species(name="test3",
+                    observable=True,
+                    folded=True,
+                    dG0=2)
+
+    ens.read_ligand_dict(ligand_dict={"X":np.array([0,1.0,2.0])})
+    temperature = np.ones(3,dtype=float)
+
+    mut_energy_matrix = np.array([[0,0,0],
+                                  [0,-1,0],
+                                  [2,0,-3],
+                                  [5000,0,0]],dtype=float)
+
+    value, fx_folded = ens.get_fx_obs_batch(mut_energy_matrix=mut_energy_matrix,
+                                            temperature=temperature)
+    assert value.shape == (4,3)
+    assert fx_folded.shape == (4,3)
+
+    # Should match genotype-by-genotype calculation
+    for i in range(len(mut_energy_matrix)):
+        v, f = ens.get_fx_obs_fast(mut_energy_array=mut_energy_matrix[i],
+                                   temperature=temperature)
+        assert np.allclose(value[i],v)
+        assert np.allclose(fx_folded[i],f)
+
+    # Empty batch
+    value, fx_folded = ens.get_fx_obs_batch(mut_energy_matrix=np.zeros((0,3)),
+                                            temperature=temperature)
+    assert value.shape == (0,3)
+    assert fx_folded.shape == (0,3)
+
+
+def test_Ensemble_get_dG_obs_batch():
+
+    ens = Ensemble(gas_constant=1)
+    ens.add_species(name="test1",
+                    observable=False,
+                    folded=True,
+                    dG0=1,
+                    X=1)
+    ens.add_species(name="test2",
+                    observable=True,
+                    folded=False,
+                    dG0=0)
+    ens.add_species(name="test3",
+                    observable=True,
+                    folded=True,
+                    dG0=2)
+
+    ens.read_ligand_dict(ligand_dict={"X":np.array([0,1.0,2.0])})
+    temperature = np.ones(3,dtype=float)
+
+    mut_energy_matrix = np.array([[0,0,0],
+                                  [0,-1,0],
+                                  [2,0,-3]],dtype=float)
+
+    value, fx_folded = ens.get_dG_obs_batch(mut_energy_matrix=mut_energy_matrix,
+                                            temperature=temperature)
+    assert value.shape == (3,3)
+    assert fx_folded.shape == (3,3)
+
+    for i in range(len(mut_energy_matrix)):
+        v, f = ens.get_dG_obs_fast(mut_energy_array=mut_energy_matrix[i],
+                                   temperature=temperature)
+        assert np.allclose(value[i],v)
+        assert np.allclose(fx_folded[i],f)
+
+    # Observable never populated --> nan
+    value, fx_folded = ens.get_dG_obs_batch(mut_energy_matrix=np.array([[-5000,5000,5000]]),
+                                            temperature=temperature)
+    assert np.sum(np.isnan(value)) == 3
+
+
 def test_Ensemble_to_dict():
 
     ens = Ensemble(gas_constant=1)
@@ -1173,6 +1287,8 @@ def test_Ensemble_get_observable_function(variable_types):
     ens = Ensemble(gas_constant=1)
     assert ens.get_observable_function("fx_obs") == ens.get_fx_obs_fast
     assert ens.get_observable_function("dG_obs") == ens.get_dG_obs_fast
+    assert ens.get_observable_function("fx_obs",batch=True) == ens.get_fx_obs_batch
+    assert ens.get_observable_function("dG_obs",batch=True) == ens.get_dG_obs_batch
 
     for v in variable_types["everything"]:
         print(v,type(v),flush=True)
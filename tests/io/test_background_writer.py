@@ -0,0 +1,128 @@
+import pytest
+
+from eee.io.background_writer import BackgroundWriter
+from eee.io.background_writer import BackgroundWriterException
+
+import threading
+import time
+
+def test_BackgroundWriter():
+
+    # Jobs run in order on another thread
+    out = []
+    threads = []
+    def _job(value,delay=0):
+        time.sleep(delay)
+        out.append(value)
+        threads.append(threading.get_ident())
+
+    with BackgroundWriter() as writer:
+        for i in range(10):
+            writer.submit(_job,i,delay=0.001)
+    
+    assert out == list(range(10))
+    assert threading.get_ident() not in threads
+    assert writer.error is None
+
+    # Not threaded -- run immediately on this thread
+    out = []
+    threads = []
+    writer = BackgroundWriter(threaded=False)
+    writer.submit(_job,5)
+    assert out == [5]
+    assert threads == [threading.get_ident()]
+    writer.close()
+
+    # Cannot submit after close
+    with pytest.raises(RuntimeError):
+        writer.submit(_job,6)
+
+def test_BackgroundWriter_back_pressure():
+
+    # Hold the writer thread until we release it. Queue only holds two jobs,
+    # so the fourth submit must wait.
+    release = threading.Event()
+    out = []
+    def _blocked_job(value):
+        release.wait()
+        out.append(value)
+
+    writer = BackgroundWriter(max_queue_size=2)
+    for i in range(3):
+        writer.submit(_blocked_job,i)
+
+    submitted = threading.Event()
+    def _submit_another():
+        writer.submit(_blocked_job,3)
+        submitted.set()
+
+    t = threading.Thread(target=_submit_another)
+    t.start()
+    assert not submitted.wait(timeout=0.1)
+
+    release.set()
+    assert submitted.wait(timeout=5)
+    t.join()
+    writer.close()
+    assert out == [0,1,2,3]
+
+def test_BackgroundWriter_errors():
+
+    out = []
+    def _job(value):
+        if value == 2:
+            raise OSError("disk full")
+        out.append(value)
+
+    # Error raised on close, later jobs skipped
+    writer = BackgroundWriter(max_queue_size=10)
+    for i in range(5):
+        writer.submit(_job,i)
+    with pytest.raises(BackgroundWriterException) as excinfo:
+        writer.close()
+    assert isinstance(excinfo.value.__cause__,OSError)
+    assert out == [0,1]
+    assert isinstance(writer.error,OSError)
+
+    # Error raised on next submit
+    writer = BackgroundWriter()
+    writer.submit(_job,2)
+    time.sleep(0.1)
+    with pytest.raises(BackgroundWriterException):
+        writer.submit(_job,3)
+    with pytest.raises(BackgroundWriterException):
+        writer.close()
+
+    # Error raised by check without waiting for the queue; queued jobs are
+    # dropped
+    out = []
+    release = threading.Event()
+    def _blocking_fail():
+        release.wait(timeout=5)
+        raise OSError("disk full")
+    writer = BackgroundWriter(max_queue_size=10)
+    writer.check()
+    writer.submit(_blocking_fail)
+    writer.submit(_job,0)
+    writer.submit(_job,1)
+    writer.check()
+    release.set()
+    start = time.time()
+    while writer.error is None and time.time() - start < 5:
+        time.sleep(0.01)
+    with pytest.raises(BackgroundWriterException):
+        writer.check()
+    with pytest.raises(BackgroundWriterException):
+        writer.close()
+    assert out == []
+
+    # Not threaded
+    writer = BackgroundWriter(threaded=False)
+    with pytest.raises(BackgroundWriterException):
+        writer.submit(_job,2)
+
+    # Error in the with block is not masked by the writer error
+    with pytest.raises(KeyError):
+        with BackgroundWriter() as writer:
+            writer.submit(_job,2)
+            raise KeyError("in block")
@@ -0,0 +1,216 @@
+import pytest
+
+from eee.io.generations import _chunk_name
+from eee.io.generations import _read_chunks
+from eee.io.generations import write_generations
+from eee.io.generations import read_generations
+from eee.io.generations import read_generation_block
+from eee.io.generations import read_genotype_history
+
+import numpy as np
+
+import os
+import pickle
+import zipfile
+
+def _record_loads(monkeypatch):
+    """
+    Record the names of arrays loaded from npz files.
+    """
+
+    loaded = []
+    original = np.lib.npyio.NpzFile.__getitem__
+    def _getitem(self,key):
+        loaded.append(key)
+        return original(self,key)
+    monkeypatch.setattr(np.lib.npyio.NpzFile,"__getitem__",_getitem)
+
+    return loaded
+
+def test__chunk_name():
+
+    assert _chunk_name("genotype",0) == "genotype_000000"
+    assert _chunk_name("count",12) == "count_000012"
+
+def test__read_chunks(tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    generations = [{0:10},{0:8,1:2},{},{0:5,1:3,2:2},{2:10}]
+    write_generations("test.npz",generations,chunk_size=2)
+
+    with np.load("test.npz") as data:
+        for first in range(len(generations) + 1):
+            for last in range(len(generations) + 1):
+                genotypes, counts, offsets = _read_chunks(data,first,last)
+                expected = generations[first:last]
+                assert len(offsets) == len(expected) + 1
+                for i, g in enumerate(expected):
+                    a = offsets[i]
+                    b = offsets[i+1]
+                    assert dict(zip(genotypes[a:b],counts[a:b])) == g
+
+    os.chdir(current_dir)
+
+def test_write_generations(tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    generations = [(np.array([0]),np.array([10])),
+                   (np.array([0,1]),np.array([8,2])),
+                   {0:5,1:3,2:2}]
+    
+    write_generations("test.npz",generations,first_generation=100)
+    
+    data = np.load("test.npz")
+    assert np.array_equal(data["generation"],[100,101,102])
+    assert np.array_equal(data["offsets"],[0,1,3,6])
+    assert np.array_equal(data["chunks"],[0,3])
+    assert np.array_equal(data["genotype_000000"],[0,0,1,0,1,2])
+    assert np.array_equal(data["count_000000"],[10,8,2,5,3,2])
+    data.close()
+
+    # Chunked
+    write_generations("test.npz",generations,first_generation=100,chunk_size=2)
+    data = np.load("test.npz")
+    assert np.array_equal(data["chunks"],[0,2,3])
+    assert np.array_equal(data["genotype_000000"],[0,0,1])
+    assert np.array_equal(data["count_000000"],[10,8,2])
+    assert np.array_equal(data["genotype_000001"],[0,1,2])
+    assert np.array_equal(data["count_000001"],[5,3,2])
+    data.close()
+
+    # Compressed
+    with zipfile.ZipFile("test.npz") as zf:
+        for info in zf.infolist():
+            assert info.compress_type == zipfile.ZIP_DEFLATED
+
+    # Empty
+    write_generations("empty.npz",[])
+    data = np.load("empty.npz")
+    assert len(data["generation"]) == 0
+    assert np.array_equal(data["offsets"],[0])
+    assert np.array_equal(data["chunks"],[0])
+    data.close()
+
+    os.chdir(current_dir)
+
+def test_read_generations(tmpdir,monkeypatch):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    generations = [{0:10},{0:8,1:2},{0:5,1:3,2:2}]
+    
+    write_generations("test.npz",generations)
+    with open("test.pickle","wb") as f:
+        pickle.dump(generations,f)
+
+    for f in ["test.npz","test.pickle"]:
+
+        assert read_generations(f) == generations
+        assert read_generations(f,start=1) == generations[1:]
+        assert read_generations(f,stop=2) == generations[:2]
+        assert read_generations(f,start=-1) == generations[-1:]
+        assert read_generations(f,start=1,stop=2) == generations[1:2]
+
+        assert read_generations(f,start=3) == []
+
+    read = read_generations("test.npz")
+    for g in read:
+        for k in g:
+            assert type(k) is int
+            assert type(g[k]) is int
+
+    # Reading a range of generations should only decompress the chunks 
+    # holding that range
+    generations = [{0:i,1:2*i} for i in range(10)]
+    write_generations("chunked.npz",generations,chunk_size=3)
+
+    loaded = _record_loads(monkeypatch)
+    assert read_generations("chunked.npz",start=4,stop=6) == generations[4:6]
+    chunk_loads = [k for k in loaded if k.startswith(("genotype_","count_"))]
+    assert sorted(chunk_loads) == ["count_000001","genotype_000001"]
+
+    loaded.clear()
+    assert read_generations("chunked.npz",start=5,stop=7) == generations[5:7]
+    chunk_loads = [k for k in loaded if k.startswith(("genotype_","count_"))]
+    assert sorted(chunk_loads) == ["count_000001","count_000002",
+                                   "genotype_000001","genotype_000002"]
+
+    loaded.clear()
+    assert read_generations("chunked.npz",start=-1) == generations[-1:]
+    chunk_loads = [k for k in loaded if k.startswith(("genotype_","count_"))]
+    assert sorted(chunk_loads) == ["count_000003","genotype_000003"]
+
+    os.chdir(current_dir)
+
+def test_read_genotype_history(tmpdir,monkeypatch):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    write_generations("test_0.npz",[{0:10},{0:8,1:2}],first_generation=0)
+    write_generations("test_1.npz",[{0:5,1:3,2:2},{2:10}],first_generation=2)
+
+    files = ["test_0.npz","test_1.npz"]
+
+    generation, count = read_genotype_history(files,0)
+    assert np.array_equal(generation,[0,1,2,3])
+    assert np.array_equal(count,[10,8,5,0])
+
+    generation, count = read_genotype_history(files,2)
+    assert np.array_equal(count,[0,0,2,10])
+
+    generation, count = read_genotype_history(files,100)
+    assert np.array_equal(count,[0,0,0,0])
+
+    generation, count = read_genotype_history([],0)
+    assert len(generation) == 0
+    assert len(count) == 0
+
+    # Only decompress counts for chunks where the genotype appears
+    generations = [{0:10},{0:8,1:2},{0:10},{0:5,1:5}]
+    write_generations("chunked.npz",generations,chunk_size=1)
+    loaded = _record_loads(monkeypatch)
+    generation, count = read_genotype_history(["chunked.npz"],1)
+    assert np.array_equal(count,[0,2,0,5])
+    count_loads = [k for k in loaded if k.startswith("count_")]
+    assert sorted(count_loads) == ["count_000001","count_000003"]
+
+    os.chdir(current_dir)
+
+def test_read_generation_block(tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    generations = [{0:10},{0:5,1:5},{},{2:3,0:7}]
+    with open("test.pickle","wb") as f:
+        pickle.dump(generations,f)
+    write_generations("test.npz",generations,first_generation=10)
+
+    for filename in ["test.pickle","test.npz"]:
+        genotypes, counts, offsets = read_generation_block(filename)
+        assert np.array_equal(offsets,[0,1,3,3,5])
+        assert np.array_equal(genotypes,[0,0,1,2,0])
+        assert np.array_equal(counts,[10,5,5,3,7])
+
+        genotypes, counts, offsets = read_generation_block(filename,start=1,stop=3)
+        assert np.array_equal(offsets,[0,2,2])
+        assert np.array_equal(genotypes,[0,1])
+        assert np.array_equal(counts,[5,5])
+
+        genotypes, counts, offsets = read_generation_block(filename,start=-1)
+        assert np.array_equal(offsets,[0,2])
+        assert np.array_equal(genotypes,[2,0])
+        assert np.array_equal(counts,[3,7])
+
+        genotypes, counts, offsets = read_generation_block(filename,start=4)
+        assert np.array_equal(offsets,[0])
+        assert len(genotypes) == 0
+        assert len(counts) == 0
+
+    os.chdir(current_dir)
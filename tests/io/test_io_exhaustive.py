@@ -0,0 +1,78 @@
+import pytest
+
+from eee.io.exhaustive import exhaustive_block_to_df
+from eee.io.exhaustive import append_exhaustive_csv
+from eee.io.exhaustive import write_exhaustive_block
+from eee.io.exhaustive import read_exhaustive
+
+import numpy as np
+import pandas as pd
+
+import os
+
+def _make_block(first,num):
+
+    mutations = -np.ones((num,2),dtype=int)
+    mutations[1:,0] = np.arange(num - 1) % 3
+    mutations[2:,1] = 2
+
+    return {"genotype":np.arange(first,first + num),
+            "mutations":mutations,
+            "energy":np.arange(2*num,dtype=float).reshape((num,2))/3,
+            "fitness":np.linspace(0,1,num),
+            "mutation_names":["A1V","A1P","Q2R"],
+            "species":["s1","s2"]}
+
+def test_exhaustive_block_to_df():
+
+    df = exhaustive_block_to_df(_make_block(0,4))
+    assert np.array_equal(df.columns,["genotype","mutations","num_mutations",
+                                      "s1_ddg","s2_ddg","fitness"])
+    assert np.array_equal(df["genotype"],[0,1,2,3])
+    assert list(df["mutations"]) == ["","A1V","A1P/Q2R","Q2R/Q2R"]
+    assert np.array_equal(df["num_mutations"],[0,1,2,2])
+    assert np.array_equal(df["s2_ddg"],np.arange(1,8,2)/3)
+    assert np.array_equal(df["fitness"],np.linspace(0,1,4))
+
+def test_append_exhaustive_csv(tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    blocks = [_make_block(0,4),_make_block(4,3)]
+    for b in blocks:
+        append_exhaustive_csv("test.csv",b)
+
+    # Should match the whole table written by pandas
+    df = pd.concat([exhaustive_block_to_df(b) for b in blocks],ignore_index=True)
+    df.to_csv("pandas.csv")
+    with open("test.csv") as f:
+        test = f.read()
+    with open("pandas.csv") as f:
+        expected = f.read()
+    assert test == expected
+
+    os.chdir(current_dir)
+
+def test_read_exhaustive(tmpdir):
+
+    current_dir = os.getcwd()
+    os.chdir(tmpdir)
+
+    blocks = [_make_block(0,4),_make_block(4,3)]
+    df = pd.concat([exhaustive_block_to_df(b) for b in blocks],ignore_index=True)
+
+    for i, b in enumerate(blocks):
+        append_exhaustive_csv("test.csv",b)
+        write_exhaustive_block("test_npz",i,b)
+
+    assert os.path.isfile(os.path.join("test_npz","metadata.npz"))
+    assert os.path.isfile(os.path.join("test_npz","block_000001.npz"))
+
+    pd.testing.assert_frame_equal(read_exhaustive("test.csv"),df)
+    pd.testing.assert_frame_equal(read_exhaustive("test_npz"),df)
+
+    with pytest.raises(FileNotFoundError):
+        read_exhaustive("not_a_file.csv")
+
+    os.chdir(current_dir)